@@ -1,14 +1,20 @@
 import json
-from diffscraper.libdiffscraper import tokenizer, template, selector
+from diffscraper.libdiffscraper import template, selector
 
 def diffscraper(T, raw_html):
     item = {}
-    F = list(map(lambda x: tokenizer.Tokenizer.feature("html", x), T))
-    D = template.extract(T, raw_html)
-    ts = lambda x, y: D[template.select(F, x, y)].strip()
+    C = template.compile_template(T, "html")
+    ts = lambda x, y: C.select(x, y)
     # Copy the suggested code snippet for a proper selector
     # ex: item["title"] = ts([selector.starttag("title")], 1)
-    shared_window = ts([selector.starttag("body")], 1) # recommended
+    item["shared_window"] = ts([selector.starttag("body")], 1) # recommended
+    if None in item.values():
+        return None  # A selector does not match the template
+    # Only the selected data segments are extracted
+    D = template.extract_segments(C, raw_html, item.values())
+    if D is None:
+        return None  # The document does not match the template
+    shared_window = D[item["shared_window"]].strip()
     leading_pattern = "window._sharedData = "
     if (shared_window.find(leading_pattern) == 0):
         shared_window = shared_window[len(leading_pattern):]
@@ -1,10 +1,9 @@
-from diffscraper.libdiffscraper import tokenizer, template, selector
+from diffscraper.libdiffscraper import template, selector
 
 def diffscraper(T, raw_html):
     item = {}
-    F = list(map(lambda x: tokenizer.Tokenizer.feature("html", x), T))
-    D = template.extract(T, raw_html)
-    ts = lambda x, y: D[template.select(F, x, y)].strip()
+    C = template.compile_template(T, "html")
+    ts = lambda x, y: C.select(x, y)
     # Copy the suggested code snippet for a proper selector
     # ex: item["title"] = ts([selector.starttag("title")], 1)
     item["title"] = ts([selector.starttag("title")], 1) # recommended
@@ -13,4 +12,10 @@ def diffscraper(T, raw_html):
     item["authors"] = ts([selector.inner_text("Authors")], 1) # recommended
     item["bibtex"] = ts([selector.inner_text("BibTeX")], 1) # recommended
     item["abstract"] = ts([selector.class_("abstract")], 1) # recommended
-    return item
+    if None in item.values():
+        return None  # A selector does not match the template
+    # Only the selected data segments are extracted
+    D = template.extract_segments(C, raw_html, item.values())
+    if D is None:
+        return None  # The document does not match the template
+    return {key: D[index].strip() for key, index in item.items()}
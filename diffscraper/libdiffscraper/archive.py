@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    A single-file archive of documents compressed with one template (.dsa).
+    Author: Seunghyun Yoo (shyoo1st@cs.ucla.edu)
+
+    Layout:
+        header      magic (4 bytes), version (1 byte), layout (1 byte), 2 reserved bytes, the length of the template
+                    (uint64)
+        template    the serialized template object (see dataformat)
+        members     serialized data objects, appended one after another
+        index       the number of members, then for each member: length-prefixed UTF-8 name, offset, length, the size of
+                    the original document (varints) and a length-prefixed digest of the original document
+        trailer     the offset and the length of the index (uint64 each), magic (4 bytes)
+    The index is at the end so that members can be appended without knowing them in advance.
+
+    In the columnar layout (see ColumnarArchiveWriter), members are replaced by batches of documents, and the index
+    holds the offset and length of every batch followed by the batch number and the row of each member (plus the
+    Merkle root of its data segments, which is not stored elsewhere).
+"""
+
+import collections
+import lzma
+import mmap
+import os
+import struct
+import zlib
+
+from . import dataformat, template, util
+
+header_format = struct.Struct("<4sBB2xQ")
+trailer_format = struct.Struct("<QQ4s")
+archive_magic = b"DSAR"
+index_magic = b"DSAX"
+archive_version = 1
+
+layout_row = 0
+layout_columnar = 1
+
+codec_raw = 0
+codec_zlib = 1
+codec_lzma = 2
+codec_of = {"raw": codec_raw, "zlib": codec_zlib, "lzma": codec_lzma}
+
+ArchiveMember = collections.namedtuple("ArchiveMember", ["name", "offset", "length", "original_size", "digest"])
+ColumnarMember = collections.namedtuple("ColumnarMember", ["name", "batch", "row", "original_size", "digest",
+                                                           "data_root"])
+
+
+class ArchiveWriter(object):
+    """
+    Members are written to a temporary file next to the archive, which replaces the archive on close.
+    """
+
+    layout = layout_row
+
+    def __init__(self, path, template_object):
+        self._path = path
+        fd, self._temp_path = util.mkstemp_next_to(path)
+        self._file = os.fdopen(fd, "wb")
+        serialized_template = template.serialize_object(template_object)
+        self._file.write(header_format.pack(archive_magic, archive_version, self.layout, len(serialized_template)))
+        self._file.write(serialized_template)
+        self._offset = header_format.size + len(serialized_template)
+        self._members = collections.OrderedDict()
+
+    def __contains__(self, name):
+        return name in self._members
+
+    def add(self, name, serialized, original_size, digest):
+        """
+        :param name: the name of the member (e.g., the file name of the document)
+        :param serialized: a serialized data object
+        :param original_size: the size of the original document
+        :param digest: the hash of the original document
+        :return: False if a member with the same name already exists
+        """
+        if name in self._members:
+            return False
+        self._file.write(serialized)
+        self._members[name] = ArchiveMember(name, self._offset, len(serialized), original_size, digest)
+        self._offset += len(serialized)
+        return True
+
+    def close(self):
+        buffer = bytearray()
+        dataformat.encode_varint(len(self._members), buffer)
+        for member in self._members.values():
+            encoded_name = member.name.encode("utf-8")
+            dataformat.encode_varint(len(encoded_name), buffer)
+            buffer += encoded_name
+            dataformat.encode_varint(member.offset, buffer)
+            dataformat.encode_varint(member.length, buffer)
+            dataformat.encode_varint(member.original_size, buffer)
+            buffer.append(len(member.digest))
+            buffer += member.digest
+        self._finish(buffer)
+
+    def _finish(self, index):
+        self._file.write(index)
+        self._file.write(trailer_format.pack(self._offset, len(index), index_magic))
+        self._file.close()
+        os.replace(self._temp_path, self._path)
+
+    def abort(self):
+        self._file.close()
+        os.remove(self._temp_path)
+
+
+class ColumnarArchiveWriter(ArchiveWriter):
+    """
+    Documents are buffered into batches. A batch stores data segment i of all of its documents contiguously (column i),
+    and each column is compressed on its own, so values of the same kind (titles, years, ...) are compressed together
+    and a column can be read without the others.
+    A batch consists of the number of rows and columns, a directory of (codec, stored length) of every column, and the
+    columns. A column holds the lengths of its values (varints) followed by the values.
+    """
+
+    layout = layout_columnar
+
+    def __init__(self, path, template_object, codec="zlib", batch_size=1024):
+        """
+        :param path:
+        :param template_object:
+        :param codec: "zlib", "lzma" or "raw" (a column is stored raw if compression does not make it shorter)
+        :param batch_size: the number of documents in a batch
+        """
+        super(ColumnarArchiveWriter, self).__init__(path, template_object)
+        self._codec = codec_of[codec]
+        self._batch_size = batch_size
+        self._num_of_columns = len(template_object["inv_seg"]) + 1
+        self._rows = []
+        self._batches = []
+
+    def add(self, name, data_object, original_size):
+        """
+        :param name: the name of the member (e.g., the file name of the document)
+        :param data_object: a data object (see template.make_data_object)
+        :param original_size: the size of the original document
+        :return: False if a member with the same name already exists
+        """
+        if name in self._members:
+            return False
+        data_segments = data_object["data_seg"]
+        if len(data_segments) != self._num_of_columns:
+            raise Exception("The number of data segments does not match the template")
+        self._members[name] = ColumnarMember(name, len(self._batches), len(self._rows), original_size,
+                                             data_object["original_hash"], data_object["mk_root_data"])
+        self._rows.append([data_segment.encode("utf-8") if isinstance(data_segment, str) else bytes(data_segment)
+                           for data_segment in data_segments])
+        if len(self._rows) >= self._batch_size:
+            self._write_batch()
+        return True
+
+    def _write_batch(self):
+        directory = bytearray()
+        dataformat.encode_varint(len(self._rows), directory)
+        dataformat.encode_varint(self._num_of_columns, directory)
+        columns = []
+        for column_index in range(self._num_of_columns):
+            values = [row[column_index] for row in self._rows]
+            column = bytearray()
+            for value in values:
+                dataformat.encode_varint(len(value), column)
+            column += b"".join(values)
+            codec, column = compress_column(column, self._codec)
+            dataformat.encode_varint(codec, directory)
+            dataformat.encode_varint(len(column), directory)
+            columns.append(column)
+
+        self._file.write(directory)
+        self._file.writelines(columns)
+        batch_length = len(directory) + sum(map(len, columns))
+        self._batches.append((self._offset, batch_length))
+        self._offset += batch_length
+        self._rows = []
+
+    def close(self):
+        if len(self._rows) > 0:
+            self._write_batch()
+        buffer = bytearray()
+        dataformat.encode_varint(len(self._batches), buffer)
+        for batch_offset, batch_length in self._batches:
+            dataformat.encode_varint(batch_offset, buffer)
+            dataformat.encode_varint(batch_length, buffer)
+        dataformat.encode_varint(len(self._members), buffer)
+        for member in self._members.values():
+            encoded_name = member.name.encode("utf-8")
+            dataformat.encode_varint(len(encoded_name), buffer)
+            buffer += encoded_name
+            dataformat.encode_varint(member.batch, buffer)
+            dataformat.encode_varint(member.row, buffer)
+            dataformat.encode_varint(member.original_size, buffer)
+            for digest in (member.digest, member.data_root or b""):
+                buffer.append(len(digest))
+                buffer += digest
+        self._finish(buffer)
+
+
+def compress_column(column, codec):
+    """
+    :param column:
+    :param codec:
+    :return: the codec actually used and the stored bytes
+    """
+    if codec == codec_zlib:
+        compressed = zlib.compress(column, 9)
+    elif codec == codec_lzma:
+        compressed = lzma.compress(column)
+    else:
+        return codec_raw, column
+    if len(compressed) < len(column):
+        return codec, compressed
+    return codec_raw, column
+
+
+def decompress_column(stored, codec):
+    if codec == codec_raw:
+        return stored
+    elif codec == codec_zlib:
+        return zlib.decompress(stored)
+    elif codec == codec_lzma:
+        return lzma.decompress(stored)
+    raise Exception("Unknown column codec {}".format(codec))
+
+
+def map_archive(path):
+    """
+    :param path:
+    :return: the mapped archive (a memoryview), its layout, the template object and the index (a memoryview)
+    """
+    with open(path, "rb") as f:
+        buffer = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    if len(buffer) < header_format.size + trailer_format.size:
+        raise Exception("Not an archive: {}".format(path))
+    magic, version, layout, template_length = header_format.unpack_from(buffer)
+    index_offset, index_length, trailer_magic = trailer_format.unpack_from(buffer, len(buffer) - trailer_format.size)
+    if magic != archive_magic or trailer_magic != index_magic:
+        raise Exception("Not an archive: {}".format(path))
+    if version != archive_version:
+        raise Exception("Unsupported archive version {}".format(version))
+
+    template_object = template.deserialize_object(buffer[header_format.size:header_format.size + template_length])
+    return buffer, layout, template_object, buffer[index_offset:index_offset + index_length]
+
+
+def open_archive(path):
+    """
+    :param path:
+    :return: an ArchiveReader or a ColumnarArchiveReader, depending on the layout of the archive
+    """
+    with open(path, "rb") as f:
+        header = f.read(header_format.size)
+    if len(header) == header_format.size and header_format.unpack(header)[2] == layout_columnar:
+        return ColumnarArchiveReader(path)
+    return ArchiveReader(path)
+
+
+class ArchiveReader(object):
+    """
+    The archive is memory-mapped. The index is read once on open; after that a member is found with a dict lookup and
+    parsed directly from the mapped file.
+    """
+
+    def __init__(self, path):
+        self._buffer, layout, self.template_object, index = map_archive(path)
+        if layout != layout_row:
+            raise Exception("Not a row archive: {}".format(path))
+        self._members = collections.OrderedDict()
+        num_of_members, offset = dataformat.decode_varint(index, 0)
+        for _ in range(num_of_members):
+            length, offset = dataformat.decode_varint(index, offset)
+            name = str(index[offset:offset + length], "utf-8")
+            offset += length
+            member_offset, offset = dataformat.decode_varint(index, offset)
+            member_length, offset = dataformat.decode_varint(index, offset)
+            original_size, offset = dataformat.decode_varint(index, offset)
+            length = index[offset]
+            digest = bytes(index[offset + 1:offset + 1 + length])
+            offset += 1 + length
+            self._members[name] = ArchiveMember(name, member_offset, member_length, original_size, digest)
+
+    def __len__(self):
+        return len(self._members)
+
+    def __contains__(self, name):
+        return name in self._members
+
+    def members(self):
+        """
+        :return: a list of ArchiveMember in the order they were added
+        """
+        return list(self._members.values())
+
+    def stored_size(self, name):
+        return self._members[name].length
+
+    def read(self, name):
+        """
+        :param name:
+        :return: the serialized data object of the member (a memoryview of the mapped file)
+        """
+        member = self._members[name]
+        return self._buffer[member.offset:member.offset + member.length]
+
+    def get(self, name, store=None):
+        """
+        :param name:
+        :param store: the segment store that the archive was written with (see dedup.SegmentStore)
+        :return: the data object of the member
+        """
+        return template.deserialize_object(self.read(name), self.template_object.get("zdict"), store)
+
+
+class ColumnarArchiveReader(object):
+    """
+    The same interface as ArchiveReader for archives written by ColumnarArchiveWriter. Decoded columns of the most
+    recently used batch are kept, so reading members in order decodes each column once.
+    """
+
+    def __init__(self, path):
+        self._buffer, layout, self.template_object, index = map_archive(path)
+        if layout != layout_columnar:
+            raise Exception("Not a columnar archive: {}".format(path))
+        self._num_of_columns = len(self.template_object["inv_seg"]) + 1
+
+        self._batches = []
+        num_of_batches, offset = dataformat.decode_varint(index, 0)
+        for _ in range(num_of_batches):
+            batch_offset, offset = dataformat.decode_varint(index, offset)
+            batch_length, offset = dataformat.decode_varint(index, offset)
+            self._batches.append((batch_offset, batch_length))
+
+        self._members = collections.OrderedDict()
+        num_of_members, offset = dataformat.decode_varint(index, offset)
+        for _ in range(num_of_members):
+            length, offset = dataformat.decode_varint(index, offset)
+            name = str(index[offset:offset + length], "utf-8")
+            offset += length
+            batch_index, offset = dataformat.decode_varint(index, offset)
+            row, offset = dataformat.decode_varint(index, offset)
+            original_size, offset = dataformat.decode_varint(index, offset)
+            digests = []
+            for _ in range(2):
+                length = index[offset]
+                digests.append(bytes(index[offset + 1:offset + 1 + length]) if length > 0 else None)
+                offset += 1 + length
+            self._members[name] = ColumnarMember(name, batch_index, row, original_size, digests[0], digests[1])
+
+        self._cached_batch_index = None
+        self._cached_columns = dict()
+
+    def __len__(self):
+        return len(self._members)
+
+    def __contains__(self, name):
+        return name in self._members
+
+    def members(self):
+        """
+        :return: a list of ColumnarMember in the order they were added
+        """
+        return list(self._members.values())
+
+    def stored_size(self, name):
+        """
+        :return: None, since data segments of a member are spread over columns
+        """
+        return None
+
+    def read_column(self, batch_index, column_index):
+        """
+        :param batch_index:
+        :param column_index: the index of a data segment (negative indices count from the last one, as for lists)
+        :return: a list of the values (data segment column_index) of every row in the batch
+        """
+        if not -self._num_of_columns <= column_index < self._num_of_columns:
+            raise IndexError("Column index out of range: {}".format(column_index))
+        column_index %= self._num_of_columns
+        if self._cached_batch_index != batch_index:
+            self._cached_batch_index = batch_index
+            self._cached_columns = dict()
+        if column_index in self._cached_columns:
+            return self._cached_columns[column_index]
+
+        batch_offset, batch_length = self._batches[batch_index]
+        batch = self._buffer[batch_offset:batch_offset + batch_length]
+        num_of_rows, offset = dataformat.decode_varint(batch, 0)
+        num_of_columns, offset = dataformat.decode_varint(batch, offset)
+        column_offset = 0
+        for index in range(num_of_columns):
+            codec, offset = dataformat.decode_varint(batch, offset)
+            length, offset = dataformat.decode_varint(batch, offset)
+            if index == column_index:
+                stored_column = (codec, column_offset, length)
+            column_offset += length
+        codec, column_offset, length = stored_column
+        column = memoryview(decompress_column(batch[offset + column_offset:offset + column_offset + length], codec))
+
+        lengths = []
+        offset = 0
+        for _ in range(num_of_rows):
+            length, offset = dataformat.decode_varint(column, offset)
+            lengths.append(length)
+        values = []
+        for length in lengths:
+            values.append(column[offset:offset + length])
+            offset += length
+        self._cached_columns[column_index] = values
+        return values
+
+    def read_field(self, name, column_index):
+        """
+        :param name:
+        :param column_index: the index of a data segment
+        :return: the data segment of the member (only its column is decoded)
+        """
+        member = self._members[name]
+        return self.read_column(member.batch, column_index)[member.row]
+
+    def iter_column(self, column_index):
+        """
+        To scan a single data segment of every member without decoding the other columns
+        :param column_index:
+        :return: a generator of (name, data segment)
+        """
+        for member in self._members.values():
+            yield member.name, self.read_column(member.batch, column_index)[member.row]
+
+    def get(self, name, store=None):
+        """
+        :param name:
+        :param store: not used; columns hold the data segments themselves
+        :return: the data object of the member
+        """
+        member = self._members[name]
+        data_segments = [self.read_column(member.batch, column_index)[member.row]
+                         for column_index in range(self._num_of_columns)]
+        return template.make_data_object(data_segments, self.template_object["mk_root"], member.data_root,
+                                         member.digest, binary=True)
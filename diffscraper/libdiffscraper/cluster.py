@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Clustering documents that are likely to share a template, by MinHash signatures of token shingles and
+    locality-sensitive hashing (LSH). The cost is linear in the total length of documents.
+    Author: Seunghyun Yoo (shyoo1st@cs.ucla.edu)
+"""
+
+import collections
+import concurrent.futures
+import functools
+import random
+import zlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from . import template, tokenizer
+
+# A prime larger than any CRC-32 value; (a * x + b) % minhash_prime never overflows 64 bits.
+minhash_prime = 4294967311
+
+
+def make_hash_params(num_of_hashes, seed=0):
+    """
+    :param num_of_hashes:
+    :param seed:
+    :return: a list of (a, b) for universal hash functions h(x) = (a * x + b) % minhash_prime
+    """
+    rng = random.Random(seed)
+    return [(rng.randrange(1, 2 ** 32), rng.randrange(0, 2 ** 32)) for _ in range(num_of_hashes)]
+
+
+def shingles(tokens, shingle_size=4):
+    """
+    :param tokens: a list of string tokens
+    :param shingle_size: the number of consecutive tokens in a shingle
+    :return: a set of CRC-32 hashes of every shingle
+    """
+    encoded_tokens = [token.encode("utf-8", errors="surrogatepass") for token in tokens]
+    if len(encoded_tokens) <= shingle_size:
+        return {zlib.crc32(b"\x00".join(encoded_tokens))}
+    return {zlib.crc32(b"\x00".join(encoded_tokens[index:index + shingle_size]))
+            for index in range(len(encoded_tokens) - shingle_size + 1)}
+
+
+def minhash(shingle_hashes, hash_params):
+    """
+    :param shingle_hashes: a set of shingle hashes
+    :param hash_params: see make_hash_params
+    :return: the MinHash signature (a tuple of integers)
+    """
+    if numpy is not None:
+        x = numpy.fromiter(shingle_hashes, dtype=numpy.uint64, count=len(shingle_hashes))
+        a = numpy.array([a for a, _ in hash_params], dtype=numpy.uint64)
+        b = numpy.array([b for _, b in hash_params], dtype=numpy.uint64)
+        return tuple(((a[:, None] * x[None, :] + b[:, None]) % minhash_prime).min(axis=1).tolist())
+    return tuple([min([(a * x + b) % minhash_prime for x in shingle_hashes]) for a, b in hash_params])
+
+
+def signature(document, hash_params, shingle_size=4, parser_type="html"):
+    tokens = tokenizer.Tokenizer.tokenize(parser_type, document)
+    return minhash(shingles(tokens, shingle_size), hash_params)
+
+
+def compute_signatures(documents, workers=1, num_of_bands=12, rows_per_band=5, shingle_size=4, parser_type="html"):
+    """
+    :param documents:
+    :param workers: the number of worker processes
+    :param num_of_bands:
+    :param rows_per_band:
+    :param shingle_size:
+    :param parser_type: a type of parser (see tokenizer.Tokenizer.create_parser)
+    :return: a list of MinHash signatures
+    """
+    signature_of = functools.partial(signature, hash_params=make_hash_params(num_of_bands * rows_per_band),
+                                     shingle_size=shingle_size, parser_type=parser_type)
+    if workers <= 1:
+        return list(map(signature_of, documents))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(signature_of, documents, chunksize=max(1, len(documents) // (workers * 4))))
+
+
+def group_by_bands(signatures, num_of_bands=12, rows_per_band=5):
+    """
+    To group documents whose signatures are identical in at least one band (union-find).
+    Two documents of Jaccard similarity s fall in the same bucket with probability 1 - (1 - s^rows)^bands,
+    which is about 0.5 at s = 0.6 and below 0.003 at s = 0.2 for the default parameters.
+    :param signatures:
+    :param num_of_bands:
+    :param rows_per_band:
+    :return: a list of clusters (lists of document indices), the largest first
+    """
+    parent = list(range(len(signatures)))
+
+    def find(index):
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    for band_index in range(num_of_bands):
+        buckets = dict()
+        for doc_index, doc_signature in enumerate(signatures):
+            key = doc_signature[band_index * rows_per_band:(band_index + 1) * rows_per_band]
+            first_index = buckets.setdefault(key, doc_index)
+            if first_index != doc_index:
+                root_a, root_b = find(first_index), find(doc_index)
+                if root_a != root_b:
+                    parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    clusters = collections.OrderedDict()
+    for doc_index in range(len(signatures)):
+        clusters.setdefault(find(doc_index), []).append(doc_index)
+    return sorted(clusters.values(), key=len, reverse=True)
+
+
+def cluster_documents(documents, workers=1, num_of_bands=12, rows_per_band=5, shingle_size=4, parser_type="html"):
+    """
+    :param documents:
+    :param workers: the number of worker processes
+    :param num_of_bands:
+    :param rows_per_band:
+    :param shingle_size:
+    :param parser_type: a type of parser (see tokenizer.Tokenizer.create_parser)
+    :return: a list of clusters (lists of document indices), the largest first
+    """
+    signatures = compute_signatures(documents, workers, num_of_bands, rows_per_band, shingle_size, parser_type)
+    return group_by_bands(signatures, num_of_bands, rows_per_band)
+
+
+def generate_templates(documents, clusters, workers=1, sample_size=None, parser_type="html"):
+    """
+    To generate a template for each cluster. Clusters are handled in parallel, unless templates are generated from
+    samples (then each cluster uses the workers for validation).
+    :param documents:
+    :param clusters: see cluster_documents
+    :param workers: the number of worker processes
+    :param sample_size: see template.generate_sampled
+    :param parser_type: a type of parser (see tokenizer.Tokenizer.create_parser)
+    :return: a list of templates (lists of invariant segments) in the order of clusters
+    """
+    documents_of = [[documents[doc_index] for doc_index in doc_indices] for doc_indices in clusters]
+    if sample_size is not None:
+        return [template.generate_sampled(cluster_documents, sample_size, workers, parser_type)
+                for cluster_documents in documents_of]
+    if workers <= 1 or len(clusters) <= 1:
+        return [template.generate(cluster_documents, parser_type=parser_type) for cluster_documents in documents_of]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(functools.partial(template.generate, parser_type=parser_type), documents_of))
@@ -75,6 +75,11 @@ class CUIHelper(object):
             return
         self.logger.info(localization.str_loaded_file_8fbff36c(num_of_docs))
 
+    def print_clusters(self, num_of_clusters, num_of_docs):
+        if self.logger is None:
+            return
+        self.logger.info(localization.str_clusters_found_5c0e3a91(num_of_clusters, num_of_docs))
+
     def print_ambiguous_command(self):
         if self.logger is None:
             return
@@ -85,16 +90,22 @@ class CUIHelper(object):
             return
         self.logger.warning(localization.str_ambiguous_command_a640a4e4())
 
-    def print_skeleton(self, items=[]):
+    def print_skeleton(self, items=[], parser_type="html"):
         print("========== Synthesized Script ==========")
         skeleton_code = """def diffscraper(T, raw_html):
     item = {}
-    F = list(map(lambda x: tokenizer.Tokenizer.feature("html", x), T))
-    D = template.extract(T, raw_html)
-    ts = lambda x, y: D[template.select(F, x, y)].strip()
+    C = template.compile_template(T, \"""" + parser_type + """\")
+    ts = lambda x, y: C.select(x, y)
     # Copy the suggested code snippet for a proper selector
     # ex: item["title"] = ts([selector.starttag("title")], 1)\n""" + "\n".join(items) + \
-"""\n    return item"""
+"""
+    if None in item.values():
+        return None  # A selector does not match the template
+    # Only the selected data segments are extracted
+    D = template.extract_segments(C, raw_html, item.values())
+    if D is None:
+        return None  # The document does not match the template
+    return {key: D[index].strip() for key, index in item.items()}"""
         print(skeleton_code)
 
     def print_data_segment(self, segment_index, data_segments_of):
@@ -129,11 +140,35 @@ class CUIHelper(object):
             return
         self.logger.warning(localization.str_skipping_existing_file_67972e49(filename))
 
+    def print_no_matching_template(self, filename):
+        if self.logger is None:
+            return
+        self.logger.warning(localization.str_no_matching_template_b83f26d4(filename))
+
+    def print_member_not_found(self, member_name):
+        if self.logger is None:
+            return
+        self.logger.warning(localization.str_member_not_found_6c2d95b1(member_name))
+
+    def print_archive_member(self, member):
+        print(localization.str_archive_member_e8a3f417(member.name, member.original_size, getattr(member, "length", None),
+                                                       util.hex_digest_from(member.digest)))
+
     def print_compression_ratio(self, original, compressed):
         if self.logger is None:
             return
         self.logger.info(localization.str_compression_ratio_42c0c48b(original, compressed))
 
+    def print_version_is_base(self, path, dependent_path):
+        if self.logger is None:
+            return
+        self.logger.warning(localization.str_version_is_base_7e51c2a9(path, dependent_path))
+
+    def print_store_gc(self, reclaimed, stored):
+        if self.logger is None:
+            return
+        self.logger.info(localization.str_store_gc_5b0e2c7d(reclaimed, stored))
+
     def print_decompression_ratio(self, compressed, decompressed):
         if self.logger is None:
             return
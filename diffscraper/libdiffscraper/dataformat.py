@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    A compact, versioned binary format for template objects and data objects (see template.make_template_object and
+    template.make_data_object).
+    Author: Seunghyun Yoo (shyoo1st@cs.ucla.edu)
+
+    Layout (integers are unsigned LEB128 varints unless noted):
+        header      magic (4 bytes), version (1 byte), flags (1 byte)
+        digests     a length byte followed by the digest, for each digest of the object (a zero length stands for None)
+        parser      (templates only) length-prefixed ASCII name
+        segments    the number of segments, then for each segment: codec, stored length, the original length (only if
+                    the codec is not raw), and the stored bytes
+                    (data objects with the zdict flag instead hold the length of a zlib stream compressed with the
+                    dictionary of the template, which holds the number of segments and each length-prefixed segment)
+        extras      the number of extra fields, then for each field: length-prefixed UTF-8 name, length-prefixed bytes
+    Referenced segments (codec_ref) hold the digest of the segment in a segment store (see dedup.SegmentStore) instead of
+    its bytes. Segments are stored in UTF-8. Raw segments of a binary data object are parsed into memoryview slices of the input,
+    so nothing is copied.
+"""
+
+import struct
+import zlib
+
+header_format = struct.Struct("<4sBB")
+template_magic = b"DSTM"
+data_magic = b"DSDM"
+format_version = 1
+
+flag_binary = 0x01
+flag_zdict = 0x02
+
+codec_raw = 0
+codec_zlib = 1
+codec_ref = 2
+
+# Segments shorter than this are stored raw; a zlib stream has about 10 bytes of overhead.
+min_compressed_length = 64
+# Segments shorter than this are not moved to a segment store (see dedup.SegmentStore); a reference takes 19 bytes.
+min_ref_length = 64
+
+template_digests = ("mk_root",)
+data_digests = ("mk_root_template", "mk_root_data", "original_hash")
+template_keys = {"inv_seg", "mk_root", "parser", "inv_cum_len"}
+data_keys = {"data_seg", "mk_root_template", "mk_root_data", "original_hash", "binary", "data_cum_len"}
+
+
+def encode_varint(value, buffer):
+    while value >= 0x80:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def decode_varint(buffer, offset):
+    """
+    :param buffer:
+    :param offset:
+    :return: the value and the offset right after it
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = buffer[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def encode_varints(values):
+    """
+    :param values: a list of unsigned integers
+    :return: bytes
+    """
+    buffer = bytearray()
+    for value in values:
+        encode_varint(value, buffer)
+    return bytes(buffer)
+
+
+def decode_varints(buffer):
+    values = []
+    offset = 0
+    while offset < len(buffer):
+        value, offset = decode_varint(buffer, offset)
+        values.append(value)
+    return values
+
+
+def encode_segment(segment, buffer, compress=True, store=None):
+    if isinstance(segment, str):
+        segment = segment.encode("utf-8")
+    if store is not None and len(segment) >= min_ref_length:
+        digest = store.put(segment)
+        encode_varint(codec_ref, buffer)
+        encode_varint(len(digest), buffer)
+        encode_varint(len(segment), buffer)
+        buffer += digest
+        return
+    if compress and len(segment) >= min_compressed_length:
+        compressed = zlib.compress(segment)
+        if len(compressed) < len(segment):
+            encode_varint(codec_zlib, buffer)
+            encode_varint(len(compressed), buffer)
+            encode_varint(len(segment), buffer)
+            buffer += compressed
+            return
+    encode_varint(codec_raw, buffer)
+    encode_varint(len(segment), buffer)
+    buffer += segment
+
+
+def decode_segment(buffer, offset, store=None):
+    """
+    :param buffer: a memoryview
+    :param offset:
+    :param store: the segment store that holds referenced segments
+    :return: the segment (a memoryview slice if it is stored raw or referenced, bytes otherwise), its original length
+             and the offset right after it
+    """
+    codec, offset = decode_varint(buffer, offset)
+    length, offset = decode_varint(buffer, offset)
+    if codec == codec_raw:
+        return buffer[offset:offset + length], length, offset + length
+    original_length, offset = decode_varint(buffer, offset)
+    if codec == codec_zlib:
+        segment = zlib.decompress(buffer[offset:offset + length])
+    elif codec == codec_ref:
+        if store is None:
+            raise Exception("The data object needs a segment store")
+        segment = store.get(bytes(buffer[offset:offset + length]))
+    else:
+        raise Exception("Unknown segment codec {}".format(codec))
+    return segment, original_length, offset + length
+
+
+def is_serializable(target_object):
+    """
+    :param target_object:
+    :return: True if the object is a template object or a data object that this format can hold
+    """
+    if not isinstance(target_object, dict):
+        return False
+    if "inv_seg" in target_object:
+        keys, digests = template_keys, template_digests
+    elif "data_seg" in target_object:
+        keys, digests = data_keys, data_digests
+    else:
+        return False
+    for key in digests:
+        digest = target_object.get(key)
+        if digest is not None and not (isinstance(digest, bytes) and len(digest) < 256):
+            return False
+    for key in target_object:
+        if key not in keys and not isinstance(target_object[key], bytes):
+            return False
+    return True
+
+
+def is_serialized(serialized):
+    return bytes(serialized[:4]) in (template_magic, data_magic)
+
+
+def serialize(target_object, compress=True, zdict=None, store=None):
+    """
+    :param target_object: a template object or a data object (see is_serializable)
+    :param compress: if True, segments are compressed with zlib when it makes them shorter
+    :param zdict: a preset dictionary (see template.make_zdict); if given, the data segments of a data object are
+                  compressed together as a single zlib stream primed with it
+    :param store: a segment store (see dedup.SegmentStore); if given, long data segments are put into it and only
+                  their digests are kept
+    :return: bytes
+    """
+    is_template = "inv_seg" in target_object
+    if is_template:
+        magic, keys, digests, segments = template_magic, template_keys, template_digests, target_object["inv_seg"]
+    else:
+        magic, keys, digests, segments = data_magic, data_keys, data_digests, target_object["data_seg"]
+    use_zdict = not is_template and compress and zdict is not None
+    if is_template:
+        store = None
+    flags = flag_binary if target_object.get("binary", False) else 0
+    if use_zdict:
+        flags |= flag_zdict
+
+    buffer = bytearray(header_format.pack(magic, format_version, flags))
+    for key in digests:
+        digest = target_object.get(key) or b""
+        buffer.append(len(digest))
+        buffer += digest
+    if is_template:
+        parser_type = target_object.get("parser", "html").encode("ascii")
+        encode_varint(len(parser_type), buffer)
+        buffer += parser_type
+
+    if use_zdict:
+        stream = bytearray()
+        encode_varint(len(segments), stream)
+        for segment in segments:
+            encode_segment(segment, stream, compress=False, store=store)
+        compressor = zlib.compressobj(9, zdict=zdict)
+        compressed = compressor.compress(stream) + compressor.flush()
+        encode_varint(len(compressed), buffer)
+        buffer += compressed
+    else:
+        encode_varint(len(segments), buffer)
+        for segment in segments:
+            encode_segment(segment, buffer, compress, store)
+
+    extras = sorted([key for key in target_object if key not in keys])
+    encode_varint(len(extras), buffer)
+    for key in extras:
+        encoded_key = key.encode("utf-8")
+        encode_varint(len(encoded_key), buffer)
+        buffer += encoded_key
+        encode_varint(len(target_object[key]), buffer)
+        buffer += target_object[key]
+    return bytes(buffer)
+
+
+def decode_segments(buffer, offset, is_text, store=None):
+    """
+    :param buffer: a memoryview
+    :param offset:
+    :param is_text: if True, segments are decoded to strings
+    :param store: the segment store that holds referenced segments
+    :return: a list of segments, their cumulative lengths (see template.cumulative_lengths) and the offset right after
+             them
+    """
+    num_of_segments, offset = decode_varint(buffer, offset)
+    segments = []
+    cum_lengths = [0]
+    for _ in range(num_of_segments):
+        # Most data segments are raw and shorter than 128 bytes (a one-byte codec and a one-byte length), so they are
+        # sliced here rather than through decode_segment and decode_varint.
+        length = buffer[offset + 1]
+        if buffer[offset] == codec_raw and length < 0x80:
+            offset += 2 + length
+            segment = buffer[offset - length:offset]
+        else:
+            segment, length, offset = decode_segment(buffer, offset, store)
+        segments.append(segment)
+        cum_lengths.append(cum_lengths[-1] + length)
+    if is_text:
+        segments = [str(segment, "utf-8") for segment in segments]
+    return segments, cum_lengths, offset
+
+
+def deserialize(serialized, zdict=None, store=None):
+    """
+    :param serialized: bytes-like
+    :param zdict: the preset dictionary of the template, or a function that returns it for the Merkle root of a
+                  template (needed only if the data object was serialized with a dictionary)
+    :param store: the segment store (needed only if the data object was serialized with one)
+    :return: a template object or a data object. Segment lengths (inv_cum_len or data_cum_len) are restored from the
+             stored lengths without decoding the segments.
+    """
+    buffer = memoryview(serialized)
+    magic, version, flags = header_format.unpack_from(buffer)
+    if magic not in (template_magic, data_magic):
+        raise Exception("Not a serialized template or data object")
+    if version != format_version:
+        raise Exception("Unsupported format version {}".format(version))
+    is_template = magic == template_magic
+    offset = header_format.size
+
+    target_object = dict()
+    for key in (template_digests if is_template else data_digests):
+        length = buffer[offset]
+        target_object[key] = bytes(buffer[offset + 1:offset + 1 + length]) if length > 0 else None
+        offset += 1 + length
+    if is_template:
+        length, offset = decode_varint(buffer, offset)
+        target_object["parser"] = str(buffer[offset:offset + length], "ascii")
+        offset += length
+
+    is_text = is_template or not flags & flag_binary
+    if flags & flag_zdict:
+        if callable(zdict):
+            zdict = zdict(target_object["mk_root_template"])
+        if zdict is None:
+            raise Exception("The data object needs the dictionary of its template")
+        length, offset = decode_varint(buffer, offset)
+        decompressor = zlib.decompressobj(zdict=zdict)
+        stream = decompressor.decompress(buffer[offset:offset + length]) + decompressor.flush()
+        offset += length
+        segments, cum_lengths, _ = decode_segments(memoryview(stream), 0, is_text, store)
+    else:
+        segments, cum_lengths, offset = decode_segments(buffer, offset, is_text, store)
+
+    if is_template:
+        target_object["inv_seg"] = segments
+        target_object["inv_cum_len"] = cum_lengths
+    else:
+        target_object["data_seg"] = segments
+        target_object["data_cum_len"] = cum_lengths
+        target_object["binary"] = not is_text
+
+    num_of_extras, offset = decode_varint(buffer, offset)
+    for _ in range(num_of_extras):
+        length, offset = decode_varint(buffer, offset)
+        key = str(buffer[offset:offset + length], "utf-8")
+        offset += length
+        length, offset = decode_varint(buffer, offset)
+        target_object[key] = bytes(buffer[offset:offset + length])
+        offset += length
+    return target_object
+
+
+class _ReferenceCollector(object):
+    def __init__(self):
+        self.digests = []
+
+    def get(self, digest):
+        self.digests.append(digest)
+        return b""
+
+
+def references(serialized, zdict=None):
+    """
+    :param serialized: a serialized data object
+    :param zdict: see deserialize
+    :return: the digests of the segments that the data object holds in a segment store, one per reference
+    """
+    if not is_serialized(serialized):
+        return []
+    collector = _ReferenceCollector()
+    deserialize(serialized, zdict, collector)
+    return collector.digests
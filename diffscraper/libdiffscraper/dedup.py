@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    A content-addressed, reference-counted store of data segment values shared by compressed documents.
+    Author: Seunghyun Yoo (shyoo1st@cs.ucla.edu)
+"""
+
+import mmap
+import os
+import struct
+
+from . import dataformat, util
+
+index_header_format = struct.Struct("<4sB3x")
+index_magic = b"DSSI"
+index_version = 1
+
+
+class SegmentStore(object):
+    """
+    Values are appended to a single file (segments.dat) once each, keyed by their hash, and encoded like the segments of
+    a serialized object (compressed with zlib when it makes them shorter; see dataformat.encode_segment). The index
+    (segments.idx) maps each hash to the offset and the length of the record, the reference count and the length of the
+    value; it is rewritten on close (or gc). Values whose reference count dropped to zero stay in the file until gc
+    compacts it.
+    """
+
+    def __init__(self, store_dir):
+        self._store_dir = store_dir
+        self._data_path = os.path.join(store_dir, "segments.dat")
+        self._index_path = os.path.join(store_dir, "segments.idx")
+        util.mkdir_p(store_dir)
+        self._entries = dict()
+        self._load_index()
+        self._file = open(self._data_path, "ab")
+        self._data_size = self._file.tell()
+        self._map = None
+        self._map_size = 0
+        self._modified = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, digest):
+        return digest in self._entries
+
+    def _load_index(self):
+        if not os.path.exists(self._index_path):
+            return
+        with open(self._index_path, "rb") as f:
+            buffer = memoryview(f.read())
+        magic, version = index_header_format.unpack_from(buffer)
+        if magic != index_magic or version != index_version:
+            raise Exception("Not a segment store index: {}".format(self._index_path))
+        num_of_entries, offset = dataformat.decode_varint(buffer, index_header_format.size)
+        for _ in range(num_of_entries):
+            digest = bytes(buffer[offset:offset + 16])
+            value_offset, offset = dataformat.decode_varint(buffer, offset + 16)
+            length, offset = dataformat.decode_varint(buffer, offset)
+            refcount, offset = dataformat.decode_varint(buffer, offset)
+            value_length, offset = dataformat.decode_varint(buffer, offset)
+            self._entries[digest] = [value_offset, length, refcount, value_length]
+
+    def put(self, value):
+        """
+        To add a reference to a value (the value is written only if it is not stored yet)
+        :param value: bytes-like
+        :return: the digest of the value
+        """
+        digest = util.compute_hash(value)
+        self._modified = True
+        entry = self._entries.get(digest)
+        if entry is None:
+            record = bytearray()
+            dataformat.encode_segment(value, record)
+            self._file.write(record)
+            self._entries[digest] = [self._data_size, len(record), 1, len(value)]
+            self._data_size += len(record)
+        else:
+            entry[2] += 1
+        return digest
+
+    def _read_record(self, digest):
+        value_offset, length = self._entries[digest][:2]
+        if value_offset + length > self._map_size:
+            self._file.flush()
+            with open(self._data_path, "rb") as f:
+                self._map = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            self._map_size = len(self._map)
+        return self._map[value_offset:value_offset + length]
+
+    def get(self, digest):
+        """
+        :param digest:
+        :return: the value (a memoryview of the mapped file if it is stored raw, bytes otherwise)
+        """
+        return dataformat.decode_segment(self._read_record(digest), 0)[0]
+
+    def release(self, digest):
+        """
+        To remove a reference to a value
+        :param digest:
+        :return: the remaining reference count, or None if the value is not in the store (nothing is released)
+        """
+        entry = self._entries.get(digest)
+        if entry is None:
+            return None
+        self._modified = True
+        entry[2] = max(entry[2] - 1, 0)
+        return entry[2]
+
+    def release_references(self, serialized, zdict=None):
+        """
+        To remove the references that a serialized data object holds (e.g., when the compressed document is deleted)
+        :param serialized:
+        :param zdict: see dataformat.deserialize
+        :return: the digests released (a digest that is not in the store is skipped)
+        """
+        return [digest for digest in dataformat.references(serialized, zdict) if self.release(digest) is not None]
+
+    def referenced_size(self):
+        """
+        :return: the total size of values as referenced by documents (a value counts once per reference)
+        """
+        return sum([value_length * refcount for _, _, refcount, value_length in self._entries.values()])
+
+    def value_size(self):
+        """
+        :return: the total size of values that are referenced at least once (before compression)
+        """
+        return sum([value_length for _, _, refcount, value_length in self._entries.values() if refcount > 0])
+
+    def stored_size(self):
+        """
+        :return: the total size of records of values that are referenced at least once
+        """
+        return sum([length for _, length, refcount, _ in self._entries.values() if refcount > 0])
+
+    def gc(self):
+        """
+        To drop values that are not referenced anymore and compact the file
+        :return: the number of bytes reclaimed
+        """
+        self._file.flush()
+        live_entries = sorted([(entry[0], digest) for digest, entry in self._entries.items() if entry[2] > 0])
+        fd, temp_path = util.mkstemp_next_to(self._data_path)
+        new_size = 0
+        with os.fdopen(fd, "wb") as f:
+            for _, digest in live_entries:
+                record = self._read_record(digest)
+                f.write(record)
+                self._entries[digest][0] = new_size
+                new_size += len(record)
+        self._entries = {digest: self._entries[digest] for _, digest in live_entries}
+
+        self._file.close()
+        os.replace(temp_path, self._data_path)
+        self._file = open(self._data_path, "ab")
+        reclaimed = self._data_size - new_size
+        self._data_size = new_size
+        self._map = None
+        self._map_size = 0
+        self._save_index()
+        return reclaimed
+
+    def _save_index(self):
+        buffer = bytearray(index_header_format.pack(index_magic, index_version))
+        dataformat.encode_varint(len(self._entries), buffer)
+        for digest, (value_offset, length, refcount, value_length) in self._entries.items():
+            buffer += digest
+            dataformat.encode_varint(value_offset, buffer)
+            dataformat.encode_varint(length, buffer)
+            dataformat.encode_varint(refcount, buffer)
+            dataformat.encode_varint(value_length, buffer)
+        fd, temp_path = util.mkstemp_next_to(self._index_path)
+        with os.fdopen(fd, "wb") as f:
+            f.write(buffer)
+        os.replace(temp_path, self._index_path)
+        self._modified = False
+
+    def close(self):
+        self._file.close()
+        if self._modified:
+            self._save_index()
@@ -12,32 +12,42 @@ import json
 import importlib
 
 from . import fileloader, localization
-from . import template, util, selector, tokenizer
+from . import template, util, selector, tokenizer, tokencache, cluster, archive, dedup, dataformat
 
 
 class Engine(object):
-    def __init__(self, cuihelper=None):
+    def __init__(self, cuihelper=None, cache_dir=None, cache_size=256 * 1024 * 1024):
         self._cuihelper = cuihelper
         self._fileloader = fileloader.FileLoader(self._cuihelper)
         self._compressed_extension = "data"
         self._scraped_item_extension = "item"
+        if cache_dir is not None:
+            tokenizer.Tokenizer.set_cache(tokencache.TokenCache(cache_dir, cache_size))
 
-    def generate_impl(self, mode, input_docs, input_template, output_template, force):
+    def generate_impl(self, mode, input_docs, input_template, output_template, force, workers=1, sample_size=None,
+                      parser_type="html", zdict=False):
         try:
             if force is False:
                 if os.path.exists(output_template):
                     return False, localization.str_output_file_exists_69eabc8f(output_template)
             documents, _ = self._fileloader.load_documents_contents_only(input_docs, "text")
 
-            if mode == "generate":
-                invariant_segments = template.generate(documents)
-            elif mode == "update":
+            if mode == "update":
+                # The existing template is aligned against the new documents only (see template.update_parallel).
                 template_object, _ = self._fileloader.load_template(input_template)
-                documents.append("".join(template_object["inv_seg"]))
-                invariant_segments = template.generate(documents)
-
-            merkle_tree = util.merkle_tree(invariant_segments)
-            template_object = template.make_template_object(invariant_segments, merkle_tree.get_root_hash())
+                parser_type = template_object.get("parser", parser_type)
+                zdict = template_object.get("zdict")
+                invariant_segments = template.update_parallel(template_object["inv_seg"], documents, workers, parser_type)
+            elif sample_size is None:
+                invariant_segments = template.generate_parallel(documents, workers, parser_type)
+            else:
+                invariant_segments = template.generate_sampled(documents, sample_size, workers, parser_type)
+            if mode != "update":
+                zdict = template.make_zdict(invariant_segments, documents) if zdict else None
+
+            template_object = template.make_template_object(invariant_segments,
+                                                            self.template_merkle_root(invariant_segments, zdict),
+                                                            parser_type, zdict)
             serialized = self._fileloader.save_template(output_template, template_object)
             self._cuihelper.print_template_file(template_object, serialized)
             return True, None
@@ -46,115 +56,530 @@ class Engine(object):
             self._cuihelper.print_exception_caught(reason)
             return False, reason
 
-    def generate(self, input_docs, output_template, force):
-        return self.generate_impl("generate", input_docs, None, output_template, force)
+    def template_merkle_root(self, invariant_segments, zdict=None):
+        """
+        The dictionary (if any) is a leaf of the Merkle tree as well, so a data object compressed with another
+        dictionary is detected as a template mismatch.
+        """
+        if zdict is None:
+            return util.merkle_tree(invariant_segments).get_root_hash()
+        return util.merkle_tree(list(invariant_segments) + [zdict]).get_root_hash()
+
+    def generate(self, input_docs, output_template, force, workers=1, sample_size=None, parser_type="html",
+                 zdict=False):
+        """
+        :param zdict: if True, the template holds a preset dictionary for compressing data segments (see
+                      template.make_zdict); updating the template keeps the dictionary as it is
+        """
+        return self.generate_impl("generate", input_docs, None, output_template, force, workers, sample_size,
+                                  parser_type, zdict)
+
+    def generate_clusters(self, input_docs, output_template, force, workers=1, sample_size=None, parser_type="html",
+                          zdict=False):
+        """
+        To cluster the documents and generate a template for each cluster (output_template.0, output_template.1, ...).
+        The manifest (output_template.manifest.json) maps each template to its file (relative to the manifest) and each
+        document to the Merkle root (hex) of its template. Clusters that end up with the same template share one file.
+        """
+        try:
+            output_manifest = output_template + ".manifest.json"
+            if force is False:
+                if os.path.exists(output_manifest):
+                    return False, localization.str_output_file_exists_69eabc8f(output_manifest)
+            documents, document_files = self._fileloader.load_documents_contents_only(input_docs, "text")
+
+            clusters = cluster.cluster_documents(documents, workers, parser_type=parser_type)
+            self._cuihelper.print_clusters(len(clusters), len(documents))
+            templates = cluster.generate_templates(documents, clusters, workers, sample_size, parser_type)
+
+            manifest = {"templates": dict(), "documents": dict()}
+            for cluster_index, (doc_indices, invariant_segments) in enumerate(zip(clusters, templates)):
+                cluster_zdict = None
+                if zdict:
+                    cluster_zdict = template.make_zdict(invariant_segments,
+                                                        [documents[doc_index] for doc_index in doc_indices])
+                template_object = template.make_template_object(invariant_segments,
+                                                                self.template_merkle_root(invariant_segments,
+                                                                                          cluster_zdict),
+                                                                parser_type, cluster_zdict)
+                merkle_root = util.hex_digest_from(template_object["mk_root"])
+                if merkle_root not in manifest["templates"]:
+                    cluster_template = "{}.{}".format(output_template, cluster_index)
+                    serialized = self._fileloader.save_template(cluster_template, template_object)
+                    self._cuihelper.print_template_file(template_object, serialized)
+                    manifest["templates"][merkle_root] = os.path.relpath(cluster_template,
+                                                                         os.path.dirname(os.path.abspath(output_manifest)))
+                for doc_index in doc_indices:
+                    manifest["documents"][document_files[doc_index]["path"]] = merkle_root
+
+            with open(output_manifest, "w") as f:
+                json.dump(manifest, f, indent=2)
+            return True, None
+        except:
+            reason = sys.exc_info()[1]
+            self._cuihelper.print_exception_caught(reason)
+            return False, reason
 
-    def update(self, input_docs, input_template, output_template, force):
-        return self.generate_impl("update", input_docs, input_template, output_template, force)
+    def update(self, input_docs, input_template, output_template, force, workers=1, parser_type="html"):
+        return self.generate_impl("update", input_docs, input_template, output_template, force, workers, None,
+                                  parser_type)
 
-    def compress(self, input_docs, input_template, output_dir, force=False):
-        documents, document_files = self._fileloader.load_documents_contents_only(input_docs, "text")
-        template_object, serialized = self._fileloader.load_template(input_template)
-        invariant_segments = template_object["inv_seg"]
-        self._cuihelper.print_template_file(template_object, serialized)
+    def load_library(self, input_templates):
+        template_library, loaded_templates = self._fileloader.load_library(input_templates)
+        for template_object, serialized in loaded_templates:
+            self._cuihelper.print_template_file(template_object, serialized)
+        return template_library
+
+    def open_store(self, store_dir):
+        return dedup.SegmentStore(store_dir) if store_dir is not None else None
+
+    def load_compressed(self, input_data, input_templates, store_dir=None):
+        """
+        :param input_data: a compressed document
+        :param input_templates: template files (or manifests)
+        :param store_dir: the segment store that the document was compressed with
+        :return: the template object and the data object of the compressed document
+        """
+        template_library, _ = self._fileloader.load_library(input_templates)
+        serialized, _ = self._fileloader.load_binary(input_data)
+        store = self.open_store(store_dir)
+        data_object = template.deserialize_object(serialized, template_library.find_zdict, store)
+        data_object = self.resolve_data_object(data_object, os.path.dirname(input_data), template_library, store)
+        template_object = template_library.find_by_root(data_object["mk_root_template"])
+        if template_object is None:
+            raise Exception(localization.str_template_not_found_d41e7c09(
+                util.hex_digest_from(data_object["mk_root_template"])))
+        return template_object, data_object
+
+    def read_range(self, input_data, input_templates, start, end, store_dir=None):
+        """
+        To read bytes [start, end) of a compressed document without decompressing it (see template.read_range)
+        :param input_data: a compressed document
+        :param input_templates: template files (or manifests)
+        :param start:
+        :param end:
+        :param store_dir: see load_compressed
+        :return: bytes
+        """
+        template_object, data_object = self.load_compressed(input_data, input_templates, store_dir)
+        return template.read_range(template_object, data_object, start, end)
+
+    def read_data_segment(self, input_data, input_templates, segment_index, store_dir=None):
+        """
+        :param input_data: a compressed document
+        :param input_templates: template files (or manifests)
+        :param segment_index:
+        :param store_dir: see load_compressed
+        :return: the data segment as bytes and its byte range (see template.read_data_segment)
+        """
+        template_object, data_object = self.load_compressed(input_data, input_templates, store_dir)
+        return template.read_data_segment(template_object, data_object, segment_index)
+
+    def compress(self, input_docs, input_templates, output_dir=None, force=False, output_archive=None,
+                 columnar=False, codec="zlib", store_dir=None, versioned=False, max_chain_length=8):
+        """
+        :param input_templates: template files (or manifests); each document is compressed with the template that
+                                matches it (see library.TemplateLibrary.route)
+        :param output_archive: if given, documents are appended to this archive (see archive.ArchiveWriter) instead of
+                               being written to output_dir one file each. An archive holds a single template.
+        :param columnar: if True, the archive stores data segments column by column (see archive.ColumnarArchiveWriter)
+        :param codec: the codec of columns ("zlib", "lzma" or "raw")
+        :param store_dir: if given, long data segments are kept once each in this segment store and compressed
+                          documents refer to them (see dedup.SegmentStore); columnar archives do not use it
+        :param versioned: if True, each document is written as the next version of the document of the same name in
+                          output_dir (see make_version), e.g., a page crawled again
+        :param max_chain_length: the maximum number of deltas between full snapshots of a versioned document
+        """
+        template_library = self.load_library(input_templates)
+        store = self.open_store(store_dir) if not columnar else None
+
+        archive_writer = None
+        # References held by members of the archive, which are released if the archive is discarded
+        archive_references = []
+        if output_archive is not None:
+            if len(template_library) != 1:
+                return False, localization.str_archive_single_template_0f6b7a2e()
+            if force is False:
+                if os.path.exists(output_archive):
+                    return False, localization.str_output_file_exists_69eabc8f(output_archive)
+            if columnar:
+                archive_writer = archive.ColumnarArchiveWriter(output_archive, template_library.get(0), codec)
+            else:
+                archive_writer = archive.ArchiveWriter(output_archive, template_library.get(0))
+        total_original_size = 0
 
         cnt_fail_count = 0
 
-        for document, document_meta in zip(documents, document_files):
-            self._cuihelper.print_current_file(document_meta["path"])
-
-            data_segments = template.extract(invariant_segments, document)
-            merkle_tree_data = util.merkle_tree(data_segments)
-            data_object = template.make_data_object(data_segments, template_object["mk_root"], merkle_tree_data.get_root_hash(), util.compute_hash(document))
-            serialized = template.serialize_object(data_object)
-
-            self._cuihelper.print_data_file(data_object, serialized)
-
-            util.mkdir_p(output_dir)
-            output_doc = os.path.join(output_dir, os.path.basename(document_meta["path"]) + "." + self._compressed_extension)
-
-            if force is False:
-                if os.path.exists(output_doc):
-                    self._cuihelper.print_skipping_existing_file(output_doc)
+        try:
+            # Documents are compressed as bytes: they are not decoded, data segments are slices of the mapped file,
+            # and the original bytes are restored exactly even if a document is not valid UTF-8.
+            for document_meta in self._fileloader.map_documents(input_docs):
+                document = document_meta["content"]
+                self._cuihelper.print_current_file(document_meta["path"])
+
+                template_index, data_segments = template_library.route(document)
+                if template_index is None:
+                    self._cuihelper.print_no_matching_template(document_meta["path"])
                     cnt_fail_count += 1
                     continue
+                template_object = template_library.get(template_index)
+                merkle_tree_data = util.merkle_tree(data_segments)
+                data_segments = [bytes(data_segment) for data_segment in data_segments]
+                data_object = template.make_data_object(data_segments, template_object["mk_root"], merkle_tree_data.get_root_hash(), util.compute_hash(document), binary=True)
+
+                if columnar:
+                    # Columns are compressed per batch, so there is no size of a single document to report.
+                    if not archive_writer.add(os.path.basename(document_meta["path"]), data_object,
+                                              document_meta["file_size"]):
+                        self._cuihelper.print_skipping_existing_file(os.path.basename(document_meta["path"]))
+                        cnt_fail_count += 1
+                        continue
+                    total_original_size += document_meta["file_size"]
+                    continue
 
-            with open(output_doc, "wb") as f:
-                f.write(serialized)
-                f.flush()
+                if versioned and archive_writer is None:
+                    data_object, output_doc = self.make_version(data_object, merkle_tree_data, output_dir,
+                                                                os.path.basename(document_meta["path"]),
+                                                                template_library, store, max_chain_length)
+
+                serialized = template.serialize_object(data_object, template_object.get("zdict"), store)
 
-            self._cuihelper.print_compression_ratio(document_meta["file_size"], len(serialized))
+                self._cuihelper.print_data_file(data_object, serialized)
+
+                if archive_writer is not None:
+                    member_name = os.path.basename(document_meta["path"])
+                    if not archive_writer.add(member_name, serialized, document_meta["file_size"],
+                                              data_object["original_hash"]):
+                        self._cuihelper.print_skipping_existing_file(member_name)
+                        if store is not None:
+                            store.release_references(serialized, template_object.get("zdict"))
+                        cnt_fail_count += 1
+                        continue
+                    if store is not None:
+                        archive_references.extend(dataformat.references(serialized, template_object.get("zdict")))
+                elif versioned:
+                    util.mkdir_p(output_dir)
+                    with open(output_doc, "wb") as f:
+                        f.write(serialized)
+                        f.flush()
+                else:
+                    util.mkdir_p(output_dir)
+                    output_doc = os.path.join(output_dir, os.path.basename(document_meta["path"]) + "." + self._compressed_extension)
+
+                    if force is False:
+                        if os.path.exists(output_doc):
+                            self._cuihelper.print_skipping_existing_file(output_doc)
+                            if store is not None:
+                                store.release_references(serialized, template_object.get("zdict"))
+                            cnt_fail_count += 1
+                            continue
+                    if store is not None and os.path.exists(output_doc):
+                        # The document being overwritten no longer refers to its segments
+                        with open(output_doc, "rb") as f:
+                            store.release_references(f.read(), template_library.find_zdict)
+
+                    with open(output_doc, "wb") as f:
+                        f.write(serialized)
+                        f.flush()
+
+                self._cuihelper.print_compression_ratio(document_meta["file_size"], len(serialized))
+
+            if archive_writer is not None:
+                archive_writer.close()
+        except:
+            if archive_writer is not None:
+                archive_writer.abort()
+                # The members of the discarded archive do not refer to the store anymore
+                if store is not None:
+                    for digest in archive_references:
+                        store.release(digest)
+            raise
+        finally:
+            # Documents written so far refer to the store, so its index is saved even if compression fails
+            if store is not None:
+                store.close()
+
+        if archive_writer is not None:
+            if columnar and total_original_size > 0:
+                self._cuihelper.print_compression_ratio(total_original_size, os.path.getsize(output_archive))
+        if store is not None and store.value_size() > 0:
+            # The dedup ratio: the size of referenced segments (counted once per reference) to the size of the
+            # distinct values (before the store compresses them)
+            self._cuihelper.print_compression_ratio(store.referenced_size(), store.value_size())
 
         if cnt_fail_count == 0:
             return True, ""
         else:
             return False, localization.str_compress_failed(cnt_fail_count)
 
-    def decompress(self, input_docs, input_template, output_dir, force=False):
+    def version_path(self, output_dir, key, version):
+        return os.path.join(output_dir, "{}.v{}.{}".format(key, version, self._compressed_extension))
+
+    def find_latest_version(self, output_dir, key):
+        """
+        :param output_dir:
+        :param key: the name of a document
+        :return: the latest version of the document in output_dir (0 if there is none)
+        """
+        prefix = key + ".v"
+        suffix = "." + self._compressed_extension
+        latest = 0
+        if os.path.isdir(output_dir):
+            for filename in os.listdir(output_dir):
+                if filename.startswith(prefix) and filename.endswith(suffix):
+                    version = filename[len(prefix):len(filename) - len(suffix)]
+                    if version.isdigit():
+                        latest = max(latest, int(version))
+        return latest
+
+    def make_version(self, data_object, merkle_tree_data, output_dir, key, template_library, store=None,
+                     max_chain_length=8):
+        """
+        To make the next version of a document. Versions are written to <key>.v<N>.data and never rewritten (and are
+        decompressed to <key>.v<N>, so that versions of a document do not overwrite each other). A version
+        holds only the data segments that changed since the latest version (found by comparing the leaves of Merkle
+        trees) and refers to it; a full snapshot is taken instead for the first version, when the template changed, or
+        when the chain of deltas since the last snapshot would exceed max_chain_length.
+        :param data_object: see template.make_data_object
+        :param merkle_tree_data: the Merkle tree of the data segments
+        :param output_dir:
+        :param key: the name of the document
+        :param template_library:
+        :param store: the segment store that the versions are compressed with
+        :param max_chain_length:
+        :return: the data object to write (a delta or the data object itself) and the path of the version
+        """
+        latest = self.find_latest_version(output_dir, key)
+        output_doc = self.version_path(output_dir, key, latest + 1)
+        if latest == 0:
+            return data_object, output_doc
+
+        base_path = self.version_path(output_dir, key, latest)
+        with open(base_path, "rb") as f:
+            base_data_object = template.deserialize_object(f.read(), template_library.find_zdict, store)
+        chain_length = template.delta_chain_length(base_data_object) + 1
+        if chain_length > max_chain_length or base_data_object["mk_root_template"] != data_object["mk_root_template"]:
+            return data_object, output_doc
+        base_data_object = self.resolve_data_object(base_data_object, output_dir, template_library, store)
+        if len(base_data_object["data_seg"]) != len(data_object["data_seg"]):
+            return data_object, output_doc
+
+        changed_indices = util.diff_merkle_leaves(util.merkle_tree(base_data_object["data_seg"]), merkle_tree_data)
+        return template.make_delta_object(data_object, changed_indices, os.path.basename(base_path), base_data_object,
+                                          chain_length), output_doc
+
+    def resolve_data_object(self, data_object, data_dir, template_library, store=None):
+        """
+        To apply a delta (see make_version) to its base version, which may be a delta itself
+        :param data_object:
+        :param data_dir: the directory of the versions
+        :param template_library:
+        :param store: the segment store that the versions are compressed with
+        :return: the full data object
+        """
+        if not template.is_delta_object(data_object):
+            return data_object
+        with open(os.path.join(data_dir, template.delta_base_name(data_object)), "rb") as f:
+            base_data_object = template.deserialize_object(f.read(), template_library.find_zdict, store)
+        # Every base is closer to a snapshot than the delta, so a (corrupted) chain cannot loop
+        if template.delta_chain_length(base_data_object) >= template.delta_chain_length(data_object):
+            raise Exception("Invalid chain of versions: {}".format(template.delta_base_name(data_object)))
+        base_data_object = self.resolve_data_object(base_data_object, data_dir, template_library, store)
+        return template.apply_delta(data_object, base_data_object)
+
+    def decompress(self, input_docs, input_templates, output_dir, force=False, store_dir=None):
+        """
+        :param input_templates: template files (or manifests); each data file is decompressed with the template whose
+                                Merkle root it refers to
+        :param store_dir: the segment store that the documents were compressed with
+        """
         documents, document_files = self._fileloader.load_documents_contents_only(input_docs, "binary")
-        template_object, serialized = self._fileloader.load_template(input_template)
-        self._cuihelper.print_template_file(template_object, serialized)
+        template_library = self.load_library(input_templates)
+        store = self.open_store(store_dir)
 
         cnt_fail_count = 0
 
         for document, document_meta in zip(documents, document_files):
             self._cuihelper.print_current_file(document_meta["path"])
 
-            data_object = template.deserialize_object(document)
+            data_object = template.deserialize_object(document, template_library.find_zdict, store)
             self._cuihelper.print_data_file(data_object, document)
+            data_object = self.resolve_data_object(data_object, os.path.dirname(document_meta["path"]),
+                                                   template_library, store)
+
+            template_object = template_library.find_by_root(data_object["mk_root_template"])
+            if template_object is None:
+                template_object = template_library.get(0)
+            output_doc = os.path.join(output_dir, os.path.basename(os.path.splitext(document_meta["path"])[0]))
+            if not self.decompress_object(template_object, data_object, output_doc, document_meta["file_size"], force):
+                cnt_fail_count += 1
 
-            # Verification (hash-based)
-            # 1. check whether the given template file and the used template file are compatible.
-            # 2. check whether the given data file is not corrupted.
-            # 3. check whether the reconstructed document and the original document are identical.
+        if cnt_fail_count == 0:
+            return True, ""
+        else:
+            return False, localization.str_decompress_failed(cnt_fail_count)
 
-            template_hash_matched = (template_object["mk_root"] == data_object["mk_root_template"])
-            merkle_tree_data = util.merkle_tree(data_object["data_seg"])
-            data_hash_matched = merkle_tree_data.get_root_hash() == data_object["mk_root_data"]
+    def decompress_archive(self, input_archive, output_dir, force=False, member_names=None, store_dir=None):
+        """
+        :param input_archive: an archive written by compress (see archive.open_archive)
+        :param member_names: names of the members to decompress (all members if None)
+        :param store_dir: the segment store that the archive was written with
+        """
+        archive_reader = archive.open_archive(input_archive)
+        store = self.open_store(store_dir)
+        if member_names is None:
+            member_names = [member.name for member in archive_reader.members()]
 
-            if template_hash_matched is False:
-                self._cuihelper.print_hash_mismatch("template", util.hex_digest_from(template_object["mk_root"]),
-                                                    util.hex_digest_from(data_object["mk_root_template"]))
-                cnt_fail_count += 1
-                continue
+        cnt_fail_count = 0
 
-            if data_hash_matched is False:
-                self._cuihelper.print_hash_mismatch("data", util.hex_digest_from(merkle_tree_data.get_root_hash()),
-                                                    util.hex_digest_from(data_object["mk_root_data"]))
+        for member_name in member_names:
+            self._cuihelper.print_current_file(member_name)
+            if member_name not in archive_reader:
+                self._cuihelper.print_member_not_found(member_name)
                 cnt_fail_count += 1
                 continue
 
-            original_document = template.reconstruct(template_object["inv_seg"], data_object["data_seg"])
-            original_hash = util.compute_hash(original_document)
-            document_hash_matched = original_hash == data_object["original_hash"]
-
-            if data_hash_matched is False:
-                self._cuihelper.print_hash_mismatch("document", util.hex_digest_from(original_hash),
-                                                    util.hex_digest_from(data_object["original_hash"]))
+            data_object = archive_reader.get(member_name, store)
+            output_doc = os.path.join(output_dir, os.path.basename(member_name))
+            if not self.decompress_object(archive_reader.template_object, data_object, output_doc,
+                                          archive_reader.stored_size(member_name), force):
                 cnt_fail_count += 1
-                continue
 
-            if document_hash_matched:
-                util.mkdir_p(output_dir)
-                output_doc = os.path.join(output_dir,
-                                          os.path.basename(os.path.splitext(document_meta["path"])[0]))
-                if force is False:
-                    if os.path.exists(output_doc):
-                        self._cuihelper.print_skipping_existing_file(output_doc)
-                        cnt_fail_count += 1
-                        continue
-
-                serialized = original_document.encode("utf-8")
-                with open(output_doc, "wb") as f:
-                    f.write(serialized)
-                    f.flush()
+        if cnt_fail_count == 0:
+            return True, ""
+        else:
+            return False, localization.str_decompress_failed(cnt_fail_count)
 
-                self._cuihelper.print_decompression_ratio(document_meta["file_size"], len(serialized))
+    def delete(self, input_data, input_templates, store_dir):
+        """
+        To delete compressed documents and the segments that no other document refers to (see dedup.SegmentStore)
+        :param input_data: compressed documents
+        :param input_templates: template files (or manifests), for data objects compressed with a dictionary
+        :param store_dir: the segment store that the documents were compressed with
+        """
+        if store_dir is None:
+            return False, localization.str_store_is_required_a4f19d62()
+        template_library = self.load_library(input_templates)
+        store = self.open_store(store_dir)
+
+        # A version that a remaining version uses as its base (see make_version) is kept; so is its own base, and so on
+        dependent_of = {path: self.find_dependent_version(path, template_library, store) for path in input_data}
+        cnt_fail_count = 0
+        is_kept = True
+        while is_kept:
+            is_kept = False
+            deleted = set(map(os.path.abspath, input_data))
+            for path in input_data:
+                dependent_path = dependent_of[path]
+                if dependent_path is not None and os.path.abspath(dependent_path) not in deleted:
+                    self._cuihelper.print_version_is_base(path, dependent_path)
+                    input_data = [other_path for other_path in input_data if other_path != path]
+                    cnt_fail_count += 1
+                    is_kept = True
+                    break
 
+        try:
+            for document_meta in self._fileloader.map_documents(input_data):
+                self._cuihelper.print_current_file(document_meta["path"])
+                store.release_references(document_meta["content"], template_library.find_zdict)
+                os.remove(document_meta["path"])
+            self._cuihelper.print_store_gc(store.gc(), store.stored_size())
+        finally:
+            store.close()
         if cnt_fail_count == 0:
             return True, ""
         else:
-            return False, localization.str_decompress_failed(cnt_fail_count)
+            return False, localization.str_delete_failed_b83f0d46(cnt_fail_count)
+
+    def find_dependent_version(self, path, template_library, store=None):
+        """
+        :param path: a compressed document
+        :param template_library:
+        :param store: the segment store that the versions are compressed with
+        :return: the path of the next version if it is a delta against the document (see make_version), None otherwise
+        """
+        data_dir, filename = os.path.split(path)
+        suffix = "." + self._compressed_extension
+        if not filename.endswith(suffix):
+            return None
+        key, _, version = filename[:len(filename) - len(suffix)].rpartition(".v")
+        if not key or not version.isdigit():
+            return None
+        next_path = self.version_path(data_dir, key, int(version) + 1)
+        if not os.path.exists(next_path):
+            return None
+        with open(next_path, "rb") as f:
+            next_data_object = template.deserialize_object(f.read(), template_library.find_zdict, store)
+        if template.is_delta_object(next_data_object) and template.delta_base_name(next_data_object) == filename:
+            return next_path
+        return None
+
+    def list_archive(self, input_archive):
+        archive_reader = archive.open_archive(input_archive)
+        for member in archive_reader.members():
+            self._cuihelper.print_archive_member(member)
+        return True, ""
+
+    def decompress_object(self, template_object, data_object, output_doc, compressed_size, force=False):
+        """
+        To verify a data object and write the original document
+        :param template_object:
+        :param data_object:
+        :param output_doc: the path of the original document
+        :param compressed_size: the size of the serialized data object (for reporting), or None if it is unknown
+        :param force:
+        :return: True if the document is written
+        """
+        # Verification (hash-based)
+        # 1. check whether the given template file and the used template file are compatible.
+        # 2. check whether the given data file is not corrupted.
+        # 3. check whether the reconstructed document and the original document are identical.
+
+        template_hash_matched = (template_object["mk_root"] == data_object["mk_root_template"])
+        merkle_tree_data = util.merkle_tree(data_object["data_seg"])
+        data_hash_matched = merkle_tree_data.get_root_hash() == data_object["mk_root_data"]
+
+        if template_hash_matched is False:
+            self._cuihelper.print_hash_mismatch("template", util.hex_digest_from(template_object["mk_root"]),
+                                                util.hex_digest_from(data_object["mk_root_template"]))
+            return False
+
+        if data_hash_matched is False:
+            self._cuihelper.print_hash_mismatch("data", util.hex_digest_from(merkle_tree_data.get_root_hash()),
+                                                util.hex_digest_from(data_object["mk_root_data"]))
+            return False
+
+        output_dir = os.path.dirname(os.path.abspath(output_doc))
+        util.mkdir_p(output_dir)
+        if force is False:
+            if os.path.exists(output_doc):
+                self._cuihelper.print_skipping_existing_file(output_doc)
+                return False
+
+        invariant_segments = template_object["inv_seg"]
+        if data_object.get("binary", False):
+            invariant_segments = template.compile_template(invariant_segments,
+                                                           template_object.get("parser", "html")).encoded_segments
+
+        # The document is streamed into a temporary file while being hashed, and the file is renamed only if the hash
+        # matches (so a corrupted document never replaces the output file).
+        hash_object = util.new_hash()
+        fd, temp_doc = util.mkstemp_next_to(output_doc)
+        with os.fdopen(fd, "wb") as f:
+            num_of_bytes = template.write_reconstructed(f, invariant_segments, data_object["data_seg"], hash_object)
+        original_hash = hash_object.digest()
+        document_hash_matched = num_of_bytes is not None and original_hash == data_object["original_hash"]
+
+        if document_hash_matched is False:
+            os.remove(temp_doc)
+            self._cuihelper.print_hash_mismatch("document", util.hex_digest_from(original_hash),
+                                                util.hex_digest_from(data_object["original_hash"]))
+            return False
+
+        os.replace(temp_doc, output_doc)
+        if compressed_size is not None:
+            self._cuihelper.print_decompression_ratio(compressed_size, num_of_bytes)
+        return True
 
     def generate_features(self, tokenized_invariant_segments):
         feature_candidates = dict()
@@ -169,17 +594,17 @@ class Engine(object):
 
         for features in tokenized_invariant_segments:
             for each_tag in features:
-                if "tag" in each_tag:
-                    tagname_candidates.add(each_tag["tag"])
-                if "attrs" in each_tag:
-                    for attr_name, attr_value in each_tag["attrs"]:
-                        tagattr_candidates.add((each_tag["tag"], attr_name, attr_value))
-                        if attr_name == "class":
+                if each_tag.tag is not None:
+                    tagname_candidates.add(each_tag.tag)
+                if each_tag.attrs is not None:
+                    for attr_name, attr_value in each_tag.attrs:
+                        tagattr_candidates.add((each_tag.tag, attr_name, attr_value))
+                        if attr_name == "class" and attr_value is not None:
                             classes = attr_value.split()
                             for class_ in classes:
                                 class_candidates.add(class_)
-                if "data" in each_tag:
-                    inner_text = each_tag["data"].strip()
+                if each_tag.data is not None:
+                    inner_text = each_tag.data.strip()
                     # 80 -> to ignore JavaScript code
                     if util.in_range(len(inner_text), 1, 80):
                         inner_word = [word.strip(string.punctuation) for word in inner_text.split()]
@@ -227,21 +652,24 @@ class Engine(object):
 
         return proper_selectors
 
-    def suggest(self, command, input_docs, input_template, exclude_invariant_segments, index, search, interactive):
+    def suggest(self, command, input_docs, input_template, exclude_invariant_segments, index, search, interactive,
+                parser_type="html"):
         documents, _ = self._fileloader.load_documents_contents_only(input_docs, "text")
 
         if input_template is None:
-            invariant_segments = template.generate(documents)
+            invariant_segments = template.generate(documents, parser_type=parser_type)
         else:
             template_object, _ = self._fileloader.load_template(input_template[0])
             invariant_segments = template_object["inv_seg"]
+            parser_type = template_object.get("parser", parser_type)
 
+        compiled_template = template.compile_template(invariant_segments, parser_type)
         data_segments_of = []
         for document in documents:
-            data_segments_of.append(template.extract(invariant_segments, document))
+            data_segments_of.append(compiled_template.extract(document))
 
         if command == "suggest":
-            tokenized_invariant_segments = list(map(lambda x: tokenizer.Tokenizer.feature("html", x), invariant_segments))
+            tokenized_invariant_segments = compiled_template.features
             candidates = self.generate_features(tokenized_invariant_segments)
 
         list_user_selected_proper_selectors = list()
@@ -282,17 +710,17 @@ class Engine(object):
                         self._cuihelper.print_invariant_segment(segment_index, invariant_segments)
 
         if interactive:
-            self._cuihelper.print_skeleton(list(map(lambda x: "    " + self._cuihelper.convert_to_code(x), list_user_selected_proper_selectors)))
+            self._cuihelper.print_skeleton(list(map(lambda x: "    " + self._cuihelper.convert_to_code(x), list_user_selected_proper_selectors)),
+                                           parser_type)
 
-    def scrape(self, input_module, input_template, input_docs, output_dir, force):
+    def scrape(self, input_module, input_templates, input_docs, output_dir, force):
         module_name = "diffscraper.crawling.{}".format(input_module[0])
         self._cuihelper.print_loading_module(module_name)
         imported_script =  __import__(module_name)
         crawling = getattr(imported_script, "crawling")
         target_module = getattr(crawling, input_module[0])
 
-        template_object, serialized = self._fileloader.load_template(input_template[0])
-        T = template_object["inv_seg"]
+        template_library = self.load_library(input_templates)
         documents, document_files = self._fileloader.load_documents_contents_only(input_docs, "text")
 
         util.mkdir_p(output_dir)
@@ -311,7 +739,23 @@ class Engine(object):
                     cnt_fail_count += 1
                     continue
 
-            serialized = template.serialize_object(target_module.diffscraper(T, document))
+            # Scraping scripts extract only the data segments they select (see template.extract_segments) and return
+            # None if the document does not match, so templates are not matched against the document beforehand: a
+            # single template is used as it is, and otherwise the candidates by anchors are tried in order.
+            if len(template_library) == 1:
+                template_indices = [0]
+            else:
+                template_indices = template_library.candidates(document)
+            item = None
+            for template_index in template_indices:
+                item = target_module.diffscraper(template_library.get_compiled(template_index), document)
+                if item is not None:
+                    break
+            if item is None:
+                self._cuihelper.print_no_matching_template(document_meta["path"])
+                cnt_fail_count += 1
+                continue
+            serialized = template.serialize_object(item)
 
             with open(output_doc, "wb") as f:
                 f.write(serialized)
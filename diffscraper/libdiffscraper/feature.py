@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Author: Seunghyun Yoo (shyoo1st@cs.ucla.edu)
+"""
+
+import sys
+
+
+class Feature(object):
+    """
+    A compact feature record of a token (start/end/startend tag or data).
+    Tag names and attribute names are interned, so records of the same tag share their strings.
+    For backward compatibility, a record can be read like the dict that parsers used to produce,
+    e.g., "attrs" in feature, feature["tag"].
+    """
+    __slots__ = ("type", "tag", "attrs", "data")
+
+    def __init__(self, type, tag=None, attrs=None, data=None):
+        self.type = type
+        self.tag = tag
+        self.attrs = attrs
+        self.data = data
+
+    @staticmethod
+    def from_tag(type, tag, attrs=None):
+        if attrs is not None:
+            attrs = tuple([(sys.intern(attr_name), attr_value) for attr_name, attr_value in attrs])
+        return Feature(type, sys.intern(tag), attrs)
+
+    @staticmethod
+    def from_data(data):
+        return Feature("data", data=data)
+
+    def __contains__(self, key):
+        return getattr(self, key, None) is not None
+
+    def __getitem__(self, key):
+        value = getattr(self, key, None)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __eq__(self, other):
+        if not isinstance(other, Feature):
+            return NotImplemented
+        return (self.type, self.tag, self.attrs, self.data) == (other.type, other.tag, other.attrs, other.data)
+
+    def __hash__(self):
+        return hash((self.type, self.tag, self.attrs, self.data))
+
+    def __repr__(self):
+        return "Feature({!r}, tag={!r}, attrs={!r}, data={!r})".format(self.type, self.tag, self.attrs, self.data)
@@ -5,9 +5,11 @@
     Author: Seunghyun Yoo (shyoo1st@cs.ucla.edu)
 """
 
+import json
+import mmap
 import os
 
-from . import template
+from . import template, library
 
 
 class FileLoader(object):
@@ -26,6 +28,30 @@ class FileLoader(object):
             stat_info = os.stat(filepath)
             return content, stat_info.st_size
 
+    def map_document(self, filepath):
+        """
+        To map a document into memory without reading or decoding it
+        :param filepath:
+        :return: a read-only mmap object (bytes if the file is empty, which cannot be mapped) and the file size
+        """
+        with open(filepath, "rb") as f:
+            stat_info = os.fstat(f.fileno())
+            if stat_info.st_size == 0:
+                return b"", 0
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), stat_info.st_size
+
+    def map_documents(self, filepath_list):
+        """
+        Like load_documents, but documents are mapped one at a time. Every mapping holds a file descriptor, so mapping
+        all documents up front could run out of them.
+        :param filepath_list:
+        :return: a generator of documents
+        """
+        for filepath in filepath_list:
+            content, filesize = self.map_document(filepath)
+            self._cuihelper.print_opening_file(filepath, filesize)
+            yield {"path": filepath, "content": content, "file_size": filesize}
+
     def load_documents(self, filepath_list, fileopen_mode):
         docs = list()
         for filepath in filepath_list:
@@ -52,6 +78,33 @@ class FileLoader(object):
         template_object = template.deserialize_object(serialized)
         return (template_object, serialized)
 
+    def load_library(self, input_templates):
+        """
+        :param input_templates: template files, or manifests written by --generate --cluster (*.manifest.json)
+        :return: a library.TemplateLibrary and a list of (template object, serialized) of each template
+        """
+        template_files = []
+        for input_template in input_templates:
+            if input_template.endswith(".manifest.json"):
+                with open(input_template, "r") as f:
+                    manifest_templates = json.load(f)["templates"].values()
+                for manifest_template in manifest_templates:
+                    # Paths are relative to the manifest (older manifests hold them as they were given to --generate)
+                    template_file = os.path.join(os.path.dirname(input_template), manifest_template)
+                    if not os.path.exists(template_file) and os.path.exists(manifest_template):
+                        template_file = manifest_template
+                    template_files.append(template_file)
+            else:
+                template_files.append(input_template)
+
+        template_library = library.TemplateLibrary()
+        loaded_templates = []
+        for template_file in template_files:
+            template_object, serialized = self.load_template(template_file)
+            template_library.add(template_object)
+            loaded_templates.append((template_object, serialized))
+        return template_library, loaded_templates
+
     def save_template(self, output_template, template_object):
         serialized = template.serialize_object(template_object)
         with open(output_template, "wb") as f:
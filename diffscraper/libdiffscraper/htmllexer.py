@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    A boundary-only HTML lexer built on compiled regular expressions.
+    It follows the scanning rules of html.parser.HTMLParser (as used by RawHTMLParser) to find exactly the same token
+    boundaries, but it does not parse attributes, unescape data or call handlers per token.
+    Author: Seunghyun Yoo (shyoo1st@cs.ucla.edu)
+"""
+
+import re
+
+from . import util
+
+starttagopen = re.compile(r"<[a-zA-Z]")
+commentclose = re.compile(r"--\s*>")
+charrefclose = re.compile(r"[\s;]")
+tagfind_tolerant = re.compile(r"([a-zA-Z][^\t\n\r\f />\x00]*)(?:\s|/(?!>))*")
+attrfind_tolerant = re.compile(
+    r"((?<=[\'\"\s/])[^\s/>][^\s/=>]*)(\s*=+\s*"
+    r"(\'[^\']*\'|\"[^\"]*\"|(?![\'\"])[^>\s]*))?(?:\s|/(?!>))*")
+locatestarttagend_tolerant = re.compile(r"""
+  <[a-zA-Z][^\t\n\r\f />\x00]*       # tag name
+  (?:[\s/]*                          # optional whitespace before attribute name
+    (?:(?<=['"\s/])[^\s/>][^\s/=>]*  # attribute name
+      (?:\s*=+\s*                    # value indicator
+        (?:'[^']*'                   # LITA-enclosed value
+          |"[^"]*"                   # LIT-enclosed value
+          |(?!['"])[^>\s]*           # bare value
+         )
+        \s*                          # possibly followed by a space
+       )?(?:\s|/(?!>))*
+     )*
+   )?
+  \s*                                # trailing whitespace
+""", re.VERBOSE)
+endtagfind = re.compile(r"</\s*([a-zA-Z][-.a-zA-Z0-9:_]*)\s*>")
+declname = re.compile(r"[a-zA-Z][-_.a-zA-Z0-9]*\s*")
+markedsectionclose = re.compile(r"]\s*]\s*>")
+msmarkedsectionclose = re.compile(r"]\s*>")
+
+
+class RawHTMLLexer(object):
+    """
+    Token types are coarse: "<tag>" stands for any start tag (or anything that HTMLParser reports at the position of a
+    start tag), whereas "<end>", "<data>" and "<doc_end>" have the same meaning as in RawHTMLParser.
+    Features (tokens_meta) are not supported; use RawHTMLParser for them.
+    Boundaries are recorded as offsets into the document (offsets), and the (type, line number, offset) tuples of the
+    parser contract (tokens) are made only when they are accessed.
+    """
+    CDATA_CONTENT_ELEMENTS = ("script", "style")
+
+    def __init__(self):
+        self.clear(is_collecting_meta=False)
+
+    def clear(self, is_collecting_meta):
+        if is_collecting_meta:
+            raise Exception("RawHTMLLexer does not collect features")
+        self.offsets = []
+        self.token_types = []
+        self.tokens_meta = []
+        self.is_collecting_meta = False
+        self._rawdata = ""
+        self._pos = 0
+        self._cdata_elem = None
+        self._cdata_end = None
+
+    @property
+    def tokens(self):
+        line_offsets = util.to_line_offsets(self._rawdata, self.offsets)
+        return [(token_type, line_number, offset)
+                for token_type, (line_number, offset) in zip(self.token_types, line_offsets)]
+
+    def feed(self, data):
+        self._rawdata += data
+        self._scan(False)
+
+    def close(self):
+        # RawHTMLParser appends <doc_end> before HTMLParser flushes the buffered data.
+        self._emit("<doc_end>", self._pos)
+        self._scan(True)
+
+    def _emit(self, token_type, pos):
+        self.token_types.append(token_type)
+        self.offsets.append(pos)
+
+    def _set_cdata_mode(self, elem):
+        self._cdata_elem = elem
+        self._cdata_end = re.compile(r"</\s*%s\s*>" % elem, re.I)
+
+    def _scan(self, end):
+        rawdata = self._rawdata
+        startswith = rawdata.startswith
+        i = self._pos
+        n = len(rawdata)
+        while i < n:
+            if self._cdata_elem is None:
+                j = rawdata.find("<", i)
+                if j < 0:
+                    # HTMLParser waits for the rest of a character reference that might be cut in half.
+                    amppos = rawdata.rfind("&", max(i, n - 34))
+                    if amppos >= 0 and not charrefclose.search(rawdata, amppos):
+                        break
+                    j = n
+            else:
+                match = self._cdata_end.search(rawdata, i)
+                if not match:
+                    break
+                j = match.start()
+            if i < j:
+                self._emit("<data>", i)
+            i = j
+            if i == n:
+                break
+
+            if starttagopen.match(rawdata, i):
+                k = self._parse_starttag(i)
+            elif startswith("</", i):
+                k = self._parse_endtag(i)
+            elif startswith("<!--", i):
+                match = commentclose.search(rawdata, i + 4)
+                k = match.end() if match else -1
+            elif startswith("<?", i):
+                k = rawdata.find(">", i + 2)
+                k = k + 1 if k >= 0 else -1
+            elif startswith("<!", i):
+                k = self._parse_html_declaration(i)
+            elif (i + 1) < n:
+                self._emit("<data>", i)
+                k = i + 1
+            else:
+                break
+            if k < 0:
+                if not end:
+                    break
+                k = rawdata.find(">", i + 1)
+                if k < 0:
+                    k = rawdata.find("<", i + 1)
+                    if k < 0:
+                        k = i + 1
+                else:
+                    k += 1
+                self._emit("<data>", i)
+            i = k
+
+        if end and i < n and self._cdata_elem is None:
+            self._emit("<data>", i)
+            i = n
+        self._pos = i
+
+    def _parse_starttag(self, i):
+        endpos = self._check_for_whole_start_tag(i)
+        if endpos < 0:
+            return endpos
+        rawdata = self._rawdata
+        match = tagfind_tolerant.match(rawdata, i + 1)
+        tag = match.group(1).lower()
+        if tag in self.CDATA_CONTENT_ELEMENTS:
+            # Only a well-formed start tag of script/style changes the scanning mode.
+            k = match.end()
+            while k < endpos:
+                m = attrfind_tolerant.match(rawdata, k)
+                if not m:
+                    break
+                k = m.end()
+            tag_end = rawdata[k:endpos].strip()
+            if tag_end == ">":
+                self._set_cdata_mode(tag)
+            elif tag_end != "/>":
+                self._emit("<data>", i)
+                return endpos
+        self._emit("<tag>", i)
+        return endpos
+
+    def _check_for_whole_start_tag(self, i):
+        rawdata = self._rawdata
+        m = locatestarttagend_tolerant.match(rawdata, i)
+        j = m.end()
+        next_char = rawdata[j:j + 1]
+        if next_char == ">":
+            return j + 1
+        if next_char == "/":
+            if rawdata.startswith("/>", j):
+                return j + 2
+            return -1
+        if next_char == "":
+            return -1
+        if next_char in ("abcdefghijklmnopqrstuvwxyz=/"
+                         "ABCDEFGHIJKLMNOPQRSTUVWXYZ"):
+            return -1
+        if j > i:
+            return j
+        else:
+            return i + 1
+
+    def _parse_endtag(self, i):
+        rawdata = self._rawdata
+        gtpos = rawdata.find(">", i + 1)
+        if gtpos < 0:
+            return -1
+        gtpos += 1
+        match = endtagfind.match(rawdata, i)
+        if not match:
+            if self._cdata_elem is not None:
+                self._emit("<data>", i)
+                return gtpos
+            namematch = tagfind_tolerant.match(rawdata, i + 2)
+            if not namematch:
+                if rawdata.startswith("</>", i):
+                    return i + 3
+                return self._parse_bogus_comment(i)
+            self._emit("<end>", i)
+            return rawdata.find(">", namematch.end()) + 1
+
+        if self._cdata_elem is not None:
+            if match.group(1).lower() != self._cdata_elem:
+                self._emit("<data>", i)
+                return gtpos
+
+        self._emit("<end>", i)
+        self._cdata_elem = None
+        self._cdata_end = None
+        return gtpos
+
+    def _parse_bogus_comment(self, i):
+        pos = self._rawdata.find(">", i + 2)
+        if pos == -1:
+            return -1
+        return pos + 1
+
+    def _parse_html_declaration(self, i):
+        rawdata = self._rawdata
+        if rawdata.startswith("<![", i):
+            return self._parse_marked_section(i)
+        elif rawdata[i:i + 9].lower() == "<!doctype":
+            gtpos = rawdata.find(">", i + 9)
+            if gtpos == -1:
+                return -1
+            return gtpos + 1
+        else:
+            return self._parse_bogus_comment(i)
+
+    def _parse_marked_section(self, i):
+        rawdata = self._rawdata
+        j = i + 3
+        if j == len(rawdata):
+            return -1
+        m = declname.match(rawdata, j)
+        if not m:
+            raise AssertionError("expected name token at %r" % rawdata[i:i + 20])
+        if m.end() == len(rawdata):
+            return -1
+        section_name = m.group().strip().lower()
+        if section_name in {"temp", "cdata", "ignore", "include", "rcdata"}:
+            match = markedsectionclose.search(rawdata, i + 3)
+        elif section_name in {"if", "else", "endif"}:
+            match = msmarkedsectionclose.search(rawdata, i + 3)
+        else:
+            raise AssertionError("unknown status keyword %r in marked section" % rawdata[i + 3:m.end()])
+        if not match:
+            return -1
+        return match.end()
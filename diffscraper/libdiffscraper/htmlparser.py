@@ -7,6 +7,8 @@
 
 from html.parser import HTMLParser
 
+from .feature import Feature
+
 
 class RawHTMLParser(HTMLParser):
     tokens = []
@@ -22,25 +24,25 @@ class RawHTMLParser(HTMLParser):
         line_number, offset = self.getpos()
         self.tokens.append(("<start>", line_number, offset))
         if self.is_collecting_meta:
-            self.tokens_meta.append({"type": "start", "tag": tag, "attrs": attrs})
+            self.tokens_meta.append(Feature.from_tag("start", tag, attrs))
 
     def handle_endtag(self, tag):
         line_number, offset = self.getpos()
         self.tokens.append(("<end>", line_number, offset))
         if self.is_collecting_meta:
-            self.tokens_meta.append({"type": "end", "tag": tag})
+            self.tokens_meta.append(Feature.from_tag("end", tag))
 
     def handle_startendtag(self, tag, attrs):
         line_number, offset = self.getpos()
         self.tokens.append(("<startend>", line_number, offset))
         if self.is_collecting_meta:
-            self.tokens_meta.append({"type": "startend", "tag": tag, "attrs": attrs})
+            self.tokens_meta.append(Feature.from_tag("startend", tag, attrs))
 
     def handle_data(self, data):
         line_number, offset = self.getpos()
         self.tokens.append(("<data>", line_number, offset))
         if self.is_collecting_meta:
-            self.tokens_meta.append({"type": "data", "data": data.strip()})
+            self.tokens_meta.append(Feature.from_data(data.strip()))
 
     def close(self):
         line_number, offset = self.getpos()
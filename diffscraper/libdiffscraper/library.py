@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    A collection of templates that routes each document to the template it matches.
+    Author: Seunghyun Yoo (shyoo1st@cs.ucla.edu)
+"""
+
+import collections
+
+from . import template
+
+
+class TemplateLibrary(object):
+    """
+    Each template is fingerprinted by a few anchors: its longest invariant segments among those shared by the fewest
+    templates. A document can match a template only if it contains every anchor of the template, so routing is a
+    handful of substring checks. The index maps each anchor to the templates that hold it; an anchor is checked at
+    most once per document, and a missing anchor rules out every template that holds it at once.
+    The remaining candidates are confirmed with extract, the most specific (longest) template first.
+    """
+
+    def __init__(self, num_of_anchors=3, min_anchor_length=8):
+        self._num_of_anchors = num_of_anchors
+        self._min_anchor_length = min_anchor_length
+        self._template_objects = []
+        self._compiled_templates = []
+        self._template_of_root = dict()
+        self._anchors_of = None
+        self._templates_with = None
+        self._order = None
+
+    def __len__(self):
+        return len(self._template_objects)
+
+    def add(self, template_object):
+        """
+        :param template_object: see template.make_template_object
+        :return: the index of the template
+        """
+        self._template_objects.append(template_object)
+        self._compiled_templates.append(template.compile_template(template_object["inv_seg"],
+                                                                  template_object.get("parser", "html")))
+        self._template_of_root[template_object["mk_root"]] = template_object
+        self._anchors_of = None
+        return len(self._template_objects) - 1
+
+    def get(self, index):
+        return self._template_objects[index]
+
+    def get_compiled(self, index):
+        """
+        :param index:
+        :return: the template.CompiledTemplate of the template
+        """
+        return self._compiled_templates[index]
+
+    def find_by_root(self, merkle_root):
+        """
+        :param merkle_root: the Merkle root of a template (e.g., mk_root_template of a data object)
+        :return: the template object, or None if there is no such template
+        """
+        return self._template_of_root.get(merkle_root)
+
+    def find_zdict(self, merkle_root):
+        """
+        :param merkle_root: the Merkle root of a template
+        :return: the preset dictionary of the template (see template.make_zdict), or None
+        """
+        template_object = self._template_of_root.get(merkle_root)
+        return template_object.get("zdict") if template_object is not None else None
+
+    def build_index(self):
+        num_of_templates_with = collections.Counter()
+        for template_object in self._template_objects:
+            num_of_templates_with.update(set(template_object["inv_seg"]))
+
+        self._anchors_of = []
+        self._templates_with = collections.defaultdict(list)
+        for template_index, template_object in enumerate(self._template_objects):
+            candidates = sorted(set([segment for segment in template_object["inv_seg"]
+                                     if len(segment) >= self._min_anchor_length]),
+                                key=lambda segment: (num_of_templates_with[segment], -len(segment)))
+            anchors = candidates[:self._num_of_anchors]
+            self._anchors_of.append(anchors)
+            for anchor in anchors:
+                self._templates_with[anchor].append(template_index)
+
+        self._order = sorted(range(len(self._template_objects)),
+                             key=lambda template_index: -sum(map(len, self._template_objects[template_index]["inv_seg"])))
+
+    def candidates(self, document):
+        """
+        To find the templates whose anchors are all present in a document, in the order they should be tried. The
+        document is only searched for anchors; no template is matched against it.
+        :param document: a string, or bytes or an mmap object (see template.extract)
+        :return: a generator of template indices
+        """
+        if self._anchors_of is None:
+            self.build_index()
+        is_text = isinstance(document, str)
+
+        is_present = dict()
+        ruled_out = set()
+        for template_index in self._order:
+            if template_index in ruled_out:
+                continue
+            is_candidate = True
+            for anchor in self._anchors_of[template_index]:
+                if anchor not in is_present:
+                    if is_text:
+                        is_present[anchor] = anchor in document
+                    else:
+                        is_present[anchor] = document.find(anchor.encode("utf-8")) != -1
+                if not is_present[anchor]:
+                    ruled_out.update(self._templates_with[anchor])
+                    is_candidate = False
+                    break
+            if is_candidate:
+                yield template_index
+
+    def route(self, document):
+        """
+        To find the best-matching template of a document
+        :param document: a string, or bytes or an mmap object (see template.extract)
+        :return: a pair of the template index and data segments (see template.extract), or (None, None) if no template
+                 matches the document
+        """
+        for template_index in self.candidates(document):
+            data_segments = self._compiled_templates[template_index].extract(document)
+            if data_segments is not None:
+                return template_index, data_segments
+        return None, None
@@ -64,6 +64,14 @@ def str_output_dir_is_required_51ed2ebe():
     return "The output directory must be specified. --output-dir <dir_path>"
 
 
+def str_clusters_found_5c0e3a91(num_of_clusters, num_of_docs):
+    return "{} clusters are found in {} files.".format(num_of_clusters, num_of_docs)
+
+
+def str_no_matching_template_b83f26d4(filename):
+    return "No template matches the document... {}".format(filename)
+
+
 def str_skipping_existing_file_67972e49(filename):
     return "Skipping the existing file... {}".format(filename)
 
@@ -90,4 +98,47 @@ def str_decompress_failed(cnt_fail_count):
 
 
 def str_scrape_failed(cnt_fail_count):
-    return "{} item(s) are not scraped.".format(cnt_fail_count)
\ No newline at end of file
+    return "{} item(s) are not scraped.".format(cnt_fail_count)
+
+
+def str_template_not_found_d41e7c09(merkle_root):
+    return "No template has the Merkle root {}".format(merkle_root)
+
+
+def str_archive_single_template_0f6b7a2e():
+    return "An archive holds a single template; please specify exactly one template file."
+
+
+def str_member_not_found_6c2d95b1(member_name):
+    return "No such member in the archive... {}".format(member_name)
+
+
+def str_archive_member_e8a3f417(member_name, original_size, compressed_size, digest):
+    if compressed_size is None:
+        return "{}  original = {} bytes, md5 = {}".format(member_name, original_size, digest)
+    return "{}  original = {} bytes, compressed = {} bytes, md5 = {}".format(member_name, original_size,
+                                                                           compressed_size, digest)
+
+
+def str_archive_is_required_93c1d0e5():
+    return "An archive file is required (--archive)."
+
+
+def str_store_gc_5b0e2c7d(reclaimed, stored):
+    return "Reclaimed {} bytes from the segment store, stored = {} bytes".format(reclaimed, stored)
+
+
+def str_store_is_required_a4f19d62():
+    return "A segment store is required (--store)."
+
+
+def str_version_is_base_7e51c2a9(path, dependent_path):
+    return "Skipping... {} is the base of {}".format(path, dependent_path)
+
+
+def str_delete_failed_b83f0d46(cnt_fail_count):
+    return "{} file(s) are not deleted.".format(cnt_fail_count)
+
+
+def str_versioned_archive_bcb5d0bf():
+    return "Versioned compression writes files to an output directory and cannot be used with an archive (--archive)."
@@ -29,6 +29,8 @@ def selector_status(count_found, index_found):
         return SelectorStatus.SUCCESS, index_found
 
 
+# Each predicate carries a key that describes it, so that results can be cached per template (see
+# template.CompiledTemplate.select).
 def selector_impl(features, combined_predicates):
     cnt_found = 0
     index_found = 0
@@ -43,10 +45,8 @@ def selector_impl(features, combined_predicates):
 
 def starttag(tag_name):
     def impl(e):
-        if "tag" in e and "type" in e:
-            if e["tag"] == tag_name and e["type"] == "start":
-                return True
-        return False
+        return e.type == "start" and e.tag == tag_name
+    impl.key = ("starttag", tag_name)
     return impl
 
 
@@ -54,29 +54,33 @@ def tagattr(tag_name, attr_name, attr_value):
     def impl(e):
         if attr_name == "class":
             return False
-        if "tag" in e and "attrs" in e:
-            if e["tag"] == tag_name:
-                for n, v in e["attrs"]:
-                    if n == attr_name and v == attr_value:
-                        return True
+        if e.tag == tag_name and e.attrs is not None:
+            for n, v in e.attrs:
+                if n == attr_name and v == attr_value:
+                    return True
         return False
+    impl.key = ("tagattr", tag_name, attr_name, attr_value)
     return impl
 
 
 def class_(class_name):
     def impl(e):
-        if "attrs" in e:
-            for n, v in e["attrs"]:
+        if e.attrs is not None:
+            for n, v in e.attrs:
                 if n == "class" and v == class_name:
                     return True
         return False
+    impl.key = ("class_", class_name)
     return impl
 
 
 def inner_text(token):
+    lowered_token = token.lower()
+
     def impl(e):
-        if "data" in e and "type" in e:
-            if token.lower() in e["data"].lower() and e["type"] == "data":
+        if e.type == "data" and e.data is not None:
+            if lowered_token in e.data.lower():
                 return True
         return False
+    impl.key = ("inner_text", token)
     return impl
@@ -6,10 +6,24 @@
 """
 
 import bisect
+import collections
+import concurrent.futures
+import functools
+import io
+import itertools
 import pickle
 import enum
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from . import selector, util, tokenizer, tree, dataformat
+
+_tag_name_pattern = re.compile(r"</?([A-Za-z][^\s/>]*)")
 
-from . import selector, util, tokenizer, tree
 
 class TokenType(enum.Enum):
     VARIANT = 0
@@ -17,6 +31,11 @@ class TokenType(enum.Enum):
     UNIQUE_INVARIANT = 2
 
 
+# If True, invariant_matching_algorithm keeps token ids (int32) and decisions (int8, TokenType values) in NumPy arrays
+# and works on every document at once. It is the same algorithm as the pure-Python path, which is used without NumPy.
+vectorized = numpy is not None
+
+
 def expand_segment(pivots, tokens_of, tentative_decision, rightward):
     """
     This function tries to expand a segment by looking at adjacent tokens from pivot points.
@@ -73,19 +92,19 @@ def expand_segment(pivots, tokens_of, tentative_decision, rightward):
 def find_next_candidates(tokens_of, tokens_with_loc, current_line):
     """
     To find the next candidates from the current line
-    :param tokens_of:
+    :param tokens_of: interned token ids (any hashable token works as well)
     :param tokens_with_loc: an associative array containing key-value pairs of each token and its locations
     :param current_line:
     :return:
     """
     candidates = []
+    found = set()
     for doc_index, tokens in enumerate(tokens_of):
         if current_line[doc_index] < len(tokens):
             token_current = tokens[current_line[doc_index]]
-            hash_current = util.compute_hash(token_current)
             is_data_token = False
             for another_doc_index, _ in enumerate(tokens_of):
-                if util.compute_freq(tokens_with_loc[hash_current][another_doc_index], current_line[another_doc_index]) == 0:
+                if util.compute_freq(tokens_with_loc[token_current][another_doc_index], current_line[another_doc_index]) == 0:
                     is_data_token = True
                     break
             if is_data_token:
@@ -93,34 +112,70 @@ def find_next_candidates(tokens_of, tokens_with_loc, current_line):
                 continue
             invariant_token = list(current_line)
             for another_doc_index, _ in enumerate(tokens_of):
-                locs = tokens_with_loc[hash_current][another_doc_index]
+                locs = tokens_with_loc[token_current][another_doc_index]
                 # There must be at least one element.
                 next_token_idx = bisect.bisect_left(locs, current_line[another_doc_index])
                 next_token_pos = locs[next_token_idx]
                 invariant_token[another_doc_index] = next_token_pos
             tuple_invariant_token = tuple(invariant_token)
-            if tuple_invariant_token not in candidates:
+            if tuple_invariant_token not in found:
+                found.add(tuple_invariant_token)
                 candidates.append(tuple_invariant_token)
     return candidates
 
 
-def find_unique_invariants(tokens_of, tokens_with_loc, current_line):
+def find_next_unique_candidates(tokens_of, last_locs_with, current_line):
     """
-    In order to find the candidate tree quickly
+    To find the next unique invariant candidates from the current line.
+    This gives the same result as filtering find_next_candidates by the frequency of each candidate (= 1), but every
+    lookup is O(1): the next occurrence of a token is unique iff it is the last occurrence in the document, i.e.,
+    the second last occurrence (if any) comes before the current line.
     :param tokens_of:
-    :param tokens_with_loc:
+    :param last_locs_with: the occurrence table made by compute_last_locs
     :param current_line:
     :return:
     """
+    num_of_docs = len(tokens_of)
+    candidates = []
+    found = set()
+    for doc_index, tokens in enumerate(tokens_of):
+        if current_line[doc_index] < len(tokens):
+            last_locs, second_last_locs = last_locs_with[tokens[current_line[doc_index]]]
+            is_unique = True
+            for another_doc_index in range(num_of_docs):
+                line = current_line[another_doc_index]
+                if last_locs[another_doc_index] < line or second_last_locs[another_doc_index] >= line:
+                    is_unique = False
+                    break
+            if is_unique and last_locs not in found:
+                found.add(last_locs)
+                candidates.append(last_locs)
+    return candidates
+
+
+def build_candidate_tree(tokens_of, tokens_with_loc, current_line, find_candidates=None):
+    """
+    To build the candidate tree of unique invariant tokens.
+    Each candidate appears only once in the tree (node cache), so the tree is actually a DAG whose children are
+    shared by several parents.
+    :param tokens_of:
+    :param tokens_with_loc:
+    :param current_line:
+    :param find_candidates: a function from a line to its next unique candidates
+                            (default: find_next_unique_candidates over tokens_with_loc)
+    :return: the root node whose value is "<root>"
+    """
+    if find_candidates is None:
+        find_candidates = functools.partial(find_next_unique_candidates, tokens_of,
+                                            compute_last_locs(tokens_with_loc))
     candidate_tree = tree.nary_tree() # the root node
     candidate_tree.set_value("<root>")
     node_cache = dict()
-    working_set = list()
+    working_set = collections.deque()
     working_set.append((current_line, "<root>"))
     node_cache["<root>"] = candidate_tree
     while working_set:
-        current_line, origin_line = working_set[0]
-        working_set.pop(0)
+        current_line, origin_line = working_set.popleft()
         # current_line must be in the range of documents
         is_out_of_range = False
         for doc_index, tokens in enumerate(tokens_of):
@@ -130,44 +185,83 @@ def find_unique_invariants(tokens_of, tokens_with_loc, current_line):
         if is_out_of_range:
             continue
         is_detected = False
-        candidates = find_next_candidates(tokens_of, tokens_with_loc, current_line)
- #       print("cur ", current_line)
-#        print("candidates ", candidates)
+        candidates = find_candidates(current_line)
 
         for candidate in candidates:
-            freq = []
-            for doc_index, token_index in enumerate(candidate):
-                token_hash = util.compute_hash(tokens_of[doc_index][token_index])
-                token_freq = util.compute_freq(tokens_with_loc[token_hash][doc_index], token_index)
-                freq.append(token_freq)
-#            print(candidate, freq)
-            if all(map(lambda x:x == 1, freq)): # only for unique invariant tokens
-                if candidate not in node_cache: # do not recompute the path that was already searched
-                    new_branch = tree.nary_tree()
-                    new_branch.set_value(candidate)
-                    node_cache[candidate] = new_branch
-                    is_detected = True
-                    working_set.append((util.get_next_line(candidate), candidate))
-
-                node_cache[origin_line].insert(node_cache[candidate])
-#                print("{} -> {}".format(origin_line, candidate))
+            if candidate not in node_cache: # do not recompute the path that was already searched
+                new_branch = tree.nary_tree()
+                new_branch.set_value(candidate)
+                node_cache[candidate] = new_branch
+                is_detected = True
+                working_set.append((util.get_next_line(candidate), candidate))
 
+            node_cache[origin_line].insert(node_cache[candidate])
 
         if not is_detected:
- #           print("***")
             working_set.append((util.get_next_line(current_line), origin_line))
 
-#        print(working_set)
-#        input()
+    return candidate_tree
+
+
+def find_longest_chain(candidate_tree):
+    """
+    To choose the longest root-to-leaf path of the candidate tree by dynamic programming.
+    The length of the longest path from each node is computed once (post-order), so shared sub-trees are not
+    enumerated again. Among the longest paths, the first one in the order of children is chosen, which is the same
+    path that the breadth-first enumeration of find_unique_invariants lists first.
+    :param candidate_tree: the root node built by build_candidate_tree
+    :return: the best candidate (a list of unique invariant tokens), or None if there is no candidate at all
+    """
+    longest_from = dict()  # node tag -> (length of the longest path from the node, the best child)
+    working_set = [(candidate_tree, False)]
+    while working_set:
+        current_tree, is_visited = working_set.pop()
+        if current_tree.get_tag() in longest_from:
+            continue
+        if not is_visited:
+            working_set.append((current_tree, True))
+            for child in current_tree.get_children():
+                if child.get_tag() not in longest_from:
+                    working_set.append((child, False))
+        else:
+            max_length = 0
+            best_child = None
+            for child in current_tree.get_children():
+                child_length = longest_from[child.get_tag()][0]
+                if max_length < child_length:
+                    max_length = child_length
+                    best_child = child
+            longest_from[current_tree.get_tag()] = (max_length + 1, best_child)
+
+    best_candidate = list()
+    _, current_tree = longest_from[candidate_tree.get_tag()]
+    while current_tree is not None:
+        best_candidate.append(current_tree.get_value())
+        _, current_tree = longest_from[current_tree.get_tag()]
+
+    if not best_candidate:
+        return None
+    return best_candidate
+
+
+def find_unique_invariants(tokens_of, tokens_with_loc, current_line):
+    """
+    To list every root-to-leaf path of the candidate tree.
+    The number of paths grows combinatorially with the length of documents, so this is for debug purpose only.
+    Use find_longest_chain to get the best candidate.
+    :param tokens_of:
+    :param tokens_with_loc:
+    :param current_line:
+    :return:
+    """
+    candidate_tree = build_candidate_tree(tokens_of, tokens_with_loc, current_line)
 
-    # Getting the longest path
-    working_set = list()
+    # Getting every path
+    working_set = collections.deque()
     working_set.append((candidate_tree, list()))
-    current_tree = None
     temp = list()
     while working_set:
-        current_tree, current_path = working_set[0]
-        working_set.pop(0)
+        current_tree, current_path = working_set.popleft()
         if current_tree.get_value() != "<root>":
             current_path.append(current_tree.get_value())
         if not current_tree.get_children():
@@ -175,81 +269,186 @@ def find_unique_invariants(tokens_of, tokens_with_loc, current_line):
         else:
             for child in current_tree.get_children():
                 working_set.append((child, list(current_path)))
-#    print(temp)
     return temp
 
 
+def intern_tokens(tokens_of):
+    """
+    To map each distinct token to a small integer (token id) once, so that the location index and every later
+    comparison work on integers instead of hashing the same string over and over.
+    :param tokens_of: a list of string tokens for each document
+    :return: a pair of token ids for each document and the vocabulary (token id -> string token)
+    """
+    token_id_of = dict()
+    vocabulary = list()
+    token_ids_of = list()
+    for tokens in tokens_of:
+        token_ids = list()
+        for token in tokens:
+            token_id = token_id_of.get(token)
+            if token_id is None:
+                token_id = len(vocabulary)
+                token_id_of[token] = token_id
+                vocabulary.append(token)
+            token_ids.append(token_id)
+        token_ids_of.append(token_ids)
+    return token_ids_of, vocabulary
+
+
 def compute_tokens_with_loc(tokens_of):
     """
-    To make an associative array containing a pair of a token hash and its locations. (cache)
-    :param tokens_of:
+    To make an associative array containing a pair of a token (id) and its locations. (cache)
+    :param tokens_of: interned token ids of each document (see intern_tokens)
     :return:
     """
+    num_of_docs = len(tokens_of)
     tokens_with_loc = {}
     for doc_index, tokens in enumerate(tokens_of):
         for token_index, token in enumerate(tokens):
-            token_hash = util.compute_hash(token)
-            if token_hash not in tokens_with_loc:
-                tokens_with_loc[token_hash] = util.make_empty_array(len(tokens_of))
-            tokens_with_loc[token_hash][doc_index].append(token_index)
+            locs_of = tokens_with_loc.get(token)
+            if locs_of is None:
+                locs_of = util.make_empty_array(num_of_docs)
+                tokens_with_loc[token] = locs_of
+            locs_of[doc_index].append(token_index)
     return tokens_with_loc
 
 
-def invariant_matching_algorithm(documents):
+def compute_last_locs(tokens_with_loc):
     """
-    Matching segments by referring to unique invariant tokens
-    This algorithm can be applied to documents recursively.
-    :param documents:
-    :return: a pair of invariant segment text and tentative decisions, which are for debug purpose.
+    To make an associative array containing a pair of a token and its last/second last locations in each document.
+    -1 means that there is no such occurrence.
+    :param tokens_with_loc:
+    :return:
     """
-    num_of_docs = len(documents)
+    last_locs_with = {}
+    for token, locs_of in tokens_with_loc.items():
+        last_locs = tuple([locs[-1] if len(locs) >= 1 else -1 for locs in locs_of])
+        second_last_locs = tuple([locs[-2] if len(locs) >= 2 else -1 for locs in locs_of])
+        last_locs_with[token] = (last_locs, second_last_locs)
+    return last_locs_with
 
-    # Tokenize raw documents
-    tokens_of = []
-    for doc_index, raw_html in enumerate(documents):
-        tokens = tokenizer.Tokenizer.tokenize("html", raw_html)
-        tokens_of.append(tokens)
 
-    # Cache each token's locations
-    tokens_with_loc = compute_tokens_with_loc(tokens_of)
+def concatenate_token_ids(token_ids_of):
+    """
+    To put token ids of every document into a single int32 array, so that the token at a line (a location in each
+    document) is a single gather: token_ids[doc_offsets + line].
+    :param token_ids_of: interned token ids of each document (see intern_tokens)
+    :return: a tuple of the concatenated token ids, the offset of each document and the length of each document
+    """
+    doc_lengths = numpy.array([len(token_ids) for token_ids in token_ids_of], dtype=numpy.int64)
+    doc_offsets = numpy.zeros(len(token_ids_of), dtype=numpy.int64)
+    numpy.cumsum(doc_lengths[:-1], out=doc_offsets[1:])
+    token_ids = numpy.fromiter(itertools.chain.from_iterable(token_ids_of), dtype=numpy.int32,
+                               count=int(doc_lengths.sum()))
+    return token_ids, doc_offsets, doc_lengths
 
-    # Search unique invariant tokens and construct a candidate tree
-    candidates = find_unique_invariants(tokens_of, tokens_with_loc, (0,) * num_of_docs)
 
-    # Choose the best one from the candidate tree (almost optimal)
-    max_length_of = 0
-    best_candidate = None
-    for candidate in candidates:
-        if max_length_of < len(candidate):
-            max_length_of = len(candidate)
-            best_candidate = candidate
+def compute_last_locs_vectorized(token_ids, doc_offsets, doc_lengths, num_of_vocab):
+    """
+    The same table as compute_last_locs, as two (token id x document) arrays.
+    :param token_ids:
+    :param doc_offsets:
+    :param doc_lengths:
+    :param num_of_vocab: the number of distinct token ids
+    :return: a pair of arrays of the last locations and the second last locations (-1 means no such occurrence)
+    """
+    num_of_docs = len(doc_offsets)
+    last_locs = numpy.full((num_of_vocab, num_of_docs), -1, dtype=numpy.int64)
+    second_last_locs = numpy.full((num_of_vocab, num_of_docs), -1, dtype=numpy.int64)
+    for doc_index in range(num_of_docs):
+        doc_offset = doc_offsets[doc_index]
+        reversed_ids = token_ids[doc_offset:doc_offset + doc_lengths[doc_index]][::-1]
+        num_of_tokens = len(reversed_ids)
+        # The first occurrence in reverse order is the last one.
+        ids, first_indices = numpy.unique(reversed_ids, return_index=True)
+        last_locs[ids, doc_index] = num_of_tokens - 1 - first_indices
+        remaining = numpy.ones(num_of_tokens, dtype=bool)
+        remaining[first_indices] = False
+        remaining_indices = numpy.flatnonzero(remaining)
+        ids, first_indices = numpy.unique(reversed_ids[remaining_indices], return_index=True)
+        second_last_locs[ids, doc_index] = num_of_tokens - 1 - remaining_indices[first_indices]
+    return last_locs, second_last_locs
 
-    tentative_decision = util.make_empty_array(num_of_docs)
-    for doc_index, tokens in enumerate(tokens_of):
-        tentative_decision[doc_index] = [TokenType.VARIANT] * len(tokens)
 
-    if best_candidate is None:
-        return [], tentative_decision
+def find_next_unique_candidates_vectorized(token_ids, doc_offsets, last_locs, second_last_locs, current_line):
+    """
+    The same as find_next_unique_candidates, where the current token of every document is checked against every
+    document at once. The current line must be in the range of documents.
+    :param token_ids:
+    :param doc_offsets:
+    :param last_locs:
+    :param second_last_locs:
+    :param current_line:
+    :return:
+    """
+    line = numpy.array(current_line, dtype=numpy.int64)
+    current_ids = token_ids[doc_offsets + line]
+    rows = last_locs[current_ids]
+    is_unique = (rows >= line).all(axis=1) & (second_last_locs[current_ids] < line).all(axis=1)
+    candidates = []
+    found = set()
+    for candidate in map(tuple, rows[is_unique].tolist()):
+        if candidate not in found:
+            found.add(candidate)
+            candidates.append(candidate)
+    return candidates
 
-    for c in best_candidate:
-        for doc_index, loc in enumerate(c):
-            tentative_decision[doc_index][loc] = TokenType.NOT_UNIQUE_INVARIANT
-        expand_segment(c, tokens_of, tentative_decision, True)
-        expand_segment(c, tokens_of, tentative_decision, False)
 
-    for c in best_candidate:
-        for doc_index, loc in enumerate(c):
-            tentative_decision[doc_index][loc] = TokenType.UNIQUE_INVARIANT
+def expand_segment_vectorized(pivots, token_ids, decisions, doc_offsets, doc_lengths, rightward):
+    """
+    The same as expand_segment over concatenated token ids and decisions.
+    Adjacent lines are examined in chunks of growing size, and each chunk is checked for every document at once.
+    :param pivots:
+    :param token_ids:
+    :param decisions:
+    :param doc_offsets:
+    :param doc_lengths:
+    :param rightward:
+    :return:
+    """
+    pivots = doc_offsets + numpy.array(pivots, dtype=numpy.int64)
+    if rightward:
+        direction = 1
+        max_distance = int((doc_offsets + doc_lengths - 1 - pivots).min())
+    else:
+        direction = -1
+        max_distance = int((pivots - doc_offsets).min())
+
+    distance = 1
+    chunk_size = 16
+    while distance <= max_distance:
+        num_of_steps = min(chunk_size, max_distance - distance + 1)
+        positions = pivots[:, None] + numpy.arange(distance, distance + num_of_steps) * direction
+        tokens = token_ids[positions]
+        is_expandable = (tokens == tokens[0]).all(axis=0) & (decisions[positions] == TokenType.VARIANT.value).all(axis=0)
+        stops = numpy.flatnonzero(~is_expandable)
+        num_of_promoted = stops[0] if len(stops) > 0 else num_of_steps
+        # Type promotion
+        decisions[positions[:, :num_of_promoted]] = TokenType.NOT_UNIQUE_INVARIANT.value
+        if num_of_promoted < num_of_steps:
+            break
+        distance += num_of_steps
+        chunk_size *= 2
 
-    # Segmentation
+
+def find_segments(tentative_decision, num_of_tokens_of):
+    """
+    To sweep every document in lockstep and group invariant tokens into segments.
+    :param tentative_decision:
+    :param num_of_tokens_of:
+    :return: a list of (first token index, last token index) of each segment in the first document
+             (None stands for an empty segment)
+    """
+    num_of_docs = len(tentative_decision)
     is_searching = True
-    invariant_tokens = list()
-    invariant_segments_text = list()
+    segment_start = None
+    segment_end = None
+    segments = list()
     current_loc = [0] * num_of_docs
     while is_searching:
         for doc_index in range(num_of_docs):
             while tentative_decision[doc_index][current_loc[doc_index]] == TokenType.VARIANT:
-                if util.in_range(current_loc[doc_index], 0, len(tokens_of[doc_index]) - 1):
+                if util.in_range(current_loc[doc_index], 0, num_of_tokens_of[doc_index] - 1):
                     current_loc[doc_index] += 1  # Skipping variant tokens (they can't be a part of the template)
                 else:
                     is_searching = False
@@ -261,23 +460,158 @@ def invariant_matching_algorithm(documents):
                     is_invariant = False
                     break
             if is_invariant:
-                invariant_tokens.append(tokens_of[0][current_loc[0]])
+                if segment_start is None:
+                    segment_start = current_loc[0]
+                segment_end = current_loc[0]
                 for doc_index in range(num_of_docs):
                     current_loc[doc_index] += 1
                 is_in_range = True
                 for doc_index in range(num_of_docs):
-                    if not util.in_range(current_loc[doc_index], 0, len(tokens_of[doc_index])):
+                    if not util.in_range(current_loc[doc_index], 0, num_of_tokens_of[doc_index]):
                         is_in_range = False
                         break
                 if not is_in_range:
                     is_searching = False
                     break
             else:
-                invariant_segments_text.append("".join(invariant_tokens))
-                invariant_tokens = list()
+                segments.append((segment_start, segment_end) if segment_start is not None else None)
+                segment_start = None
                 break
-        if len(invariant_tokens) > 0:
-            invariant_segments_text.append("".join(invariant_tokens))
+        if segment_start is not None:
+            segments.append((segment_start, segment_end))
+            segment_start = None
+    return segments
+
+
+def find_segments_vectorized(decisions, doc_offsets, doc_lengths):
+    """
+    The same as find_segments over concatenated decisions.
+    The sweep pairs the k-th invariant token of every document, and a segment ends wherever the next invariant token
+    is not adjacent in some document.
+    :param decisions:
+    :param doc_offsets:
+    :param doc_lengths:
+    :return: the same as find_segments, or None if documents have different numbers of invariant tokens
+    """
+    invariant_locs_of = [numpy.flatnonzero(decisions[doc_offset:doc_offset + doc_length])
+                         for doc_offset, doc_length in zip(doc_offsets, doc_lengths)]
+    num_of_invariants = len(invariant_locs_of[0])
+    for invariant_locs in invariant_locs_of:
+        if len(invariant_locs) != num_of_invariants:
+            return None
+    if num_of_invariants == 0:
+        return []
+
+    invariant_locs = numpy.vstack(invariant_locs_of)
+    breaks = numpy.flatnonzero((numpy.diff(invariant_locs, axis=1) != 1).any(axis=0))
+    first_locs = invariant_locs[0, numpy.concatenate(([0], breaks + 1))]
+    last_locs = invariant_locs[0, numpy.concatenate((breaks, [num_of_invariants - 1]))]
+    return list(zip(first_locs.tolist(), last_locs.tolist()))
+
+
+def match(token_ids_of):
+    """
+    To decide invariant tokens and group them into segments (pure-Python path of invariant_matching_algorithm)
+    :param token_ids_of: interned token ids of each document (see intern_tokens)
+    :return: a pair of segments (see find_segments) and tentative decisions (lists of TokenType)
+    """
+    num_of_docs = len(token_ids_of)
+
+    # Cache each token's locations
+    tokens_with_loc = compute_tokens_with_loc(token_ids_of)
+
+    # Search unique invariant tokens and construct a candidate tree
+    candidate_tree = build_candidate_tree(token_ids_of, tokens_with_loc, (0,) * num_of_docs)
+
+    # Choose the best one from the candidate tree (almost optimal)
+    best_candidate = find_longest_chain(candidate_tree)
+
+    tentative_decision = util.make_empty_array(num_of_docs)
+    for doc_index, tokens in enumerate(token_ids_of):
+        tentative_decision[doc_index] = [TokenType.VARIANT] * len(tokens)
+
+    if best_candidate is None:
+        return [], tentative_decision
+
+    for c in best_candidate:
+        for doc_index, loc in enumerate(c):
+            tentative_decision[doc_index][loc] = TokenType.NOT_UNIQUE_INVARIANT
+        expand_segment(c, token_ids_of, tentative_decision, True)
+        expand_segment(c, token_ids_of, tentative_decision, False)
+
+    for c in best_candidate:
+        for doc_index, loc in enumerate(c):
+            tentative_decision[doc_index][loc] = TokenType.UNIQUE_INVARIANT
+
+    return find_segments(tentative_decision, [len(tokens) for tokens in token_ids_of]), tentative_decision
+
+
+def match_vectorized(token_ids_of, num_of_vocab):
+    """
+    The same as match, where token ids and decisions of every document are concatenated into NumPy arrays.
+    :param token_ids_of: interned token ids of each document (see intern_tokens)
+    :param num_of_vocab: the number of distinct token ids
+    :return: a pair of segments (see find_segments) and tentative decisions (int8 arrays of TokenType values)
+    """
+    num_of_docs = len(token_ids_of)
+    token_ids, doc_offsets, doc_lengths = concatenate_token_ids(token_ids_of)
+
+    last_locs, second_last_locs = compute_last_locs_vectorized(token_ids, doc_offsets, doc_lengths, num_of_vocab)
+    find_candidates = functools.partial(find_next_unique_candidates_vectorized, token_ids, doc_offsets, last_locs,
+                                        second_last_locs)
+    candidate_tree = build_candidate_tree(token_ids_of, None, (0,) * num_of_docs, find_candidates)
+    best_candidate = find_longest_chain(candidate_tree)
+
+    decisions = numpy.zeros(len(token_ids), dtype=numpy.int8)
+    tentative_decision = [decisions[doc_offset:doc_offset + doc_length]
+                          for doc_offset, doc_length in zip(doc_offsets, doc_lengths)]
+
+    if best_candidate is None:
+        return [], tentative_decision
+
+    candidate_locs = doc_offsets + numpy.array(best_candidate, dtype=numpy.int64)
+    for c, locs in zip(best_candidate, candidate_locs):
+        decisions[locs] = TokenType.NOT_UNIQUE_INVARIANT.value
+        expand_segment_vectorized(c, token_ids, decisions, doc_offsets, doc_lengths, True)
+        expand_segment_vectorized(c, token_ids, decisions, doc_offsets, doc_lengths, False)
+    decisions[candidate_locs] = TokenType.UNIQUE_INVARIANT.value
+
+    segments = find_segments_vectorized(decisions, doc_offsets, doc_lengths)
+    if segments is None:
+        segments = find_segments([[TokenType(decision) for decision in decisions.tolist()]
+                                  for decisions in tentative_decision], doc_lengths.tolist())
+    return segments, tentative_decision
+
+
+def invariant_matching_algorithm(documents, parser_type="html"):
+    """
+    Matching segments by referring to unique invariant tokens
+    This algorithm can be applied to documents recursively.
+    :param documents:
+    :param parser_type: a type of parser (see tokenizer.Tokenizer.create_parser)
+    :return: a pair of invariant segment text and tentative decisions, which are for debug purpose.
+    """
+    # Tokenize raw documents into spans, and map each distinct token to an integer once;
+    # the rest of the algorithm compares integers only and slices strings when it emits invariant segments.
+    spans_of = []
+    for doc_index, raw_html in enumerate(documents):
+        spans_of.append(tokenizer.Tokenizer.tokenize_spans(parser_type, raw_html))
+    token_ids_of, vocabulary = intern_tokens([tokenizer.Tokenizer.iter_tokens(raw_html, spans)
+                                              for raw_html, spans in zip(documents, spans_of)])
+
+    if vectorized:
+        segments, tentative_decision = match_vectorized(token_ids_of, len(vocabulary))
+    else:
+        segments, tentative_decision = match(token_ids_of)
+
+    # Invariant tokens are contiguous in the first document, so each segment is a single slice of it.
+    first_starts, first_ends = spans_of[0]
+    invariant_segments_text = list()
+    for segment in segments:
+        if segment is None:
+            invariant_segments_text.append("")
+        else:
+            invariant_segments_text.append(documents[0][first_starts[segment[0]]:first_ends[segment[1]]])
     # __print_decision(tentative_decision)
     return invariant_segments_text, tentative_decision
 
@@ -285,7 +619,7 @@ def __print_decision(tentative_decision):
     print("Decision")
     for doc_index, decisions in enumerate(tentative_decision):
         print("Doc {}:".format(doc_index), end="")
-        for decision in decisions:
+        for decision in map(TokenType, decisions):
             if decision == TokenType.VARIANT:
                 print ("\033[41m\033[1;37m.\033[0m", end="")
             elif decision == TokenType.NOT_UNIQUE_INVARIANT:
@@ -295,18 +629,19 @@ def __print_decision(tentative_decision):
         print("")
 
 
-def generate(documents, prev_text = []):
+def generate(documents, prev_text = [], parser_type="html"):
     """
     To get the template recursively
     :param documents:
     :param prev_text:
+    :param parser_type: a type of parser (see tokenizer.Tokenizer.create_parser)
     :return:
     """
 
     if not documents:
         return None
 
-    text, _ = invariant_matching_algorithm(documents)
+    text, _ = invariant_matching_algorithm(documents, parser_type)
     data_segments = list(map(lambda x: extract(text, x), documents))
     data = [list(i) for i in zip(*data_segments)]
     final_text = []
@@ -314,7 +649,7 @@ def generate(documents, prev_text = []):
         if prev_text != text:
             data_len = list(map(lambda x:len(x), data[seg_index]))
             if 0 not in data_len:
-                text_sub = generate(data[seg_index], text)
+                text_sub = generate(data[seg_index], text, parser_type)
                 if len(text_sub) > 0:
                     final_text.extend(text_sub)
         else:
@@ -326,13 +661,296 @@ def generate(documents, prev_text = []):
     return final_text
 
 
+def choose_separator(invariant_segments):
+    """
+    To choose a character that does not appear in any of the given invariant segments
+    :param invariant_segments:
+    :return:
+    """
+    for code_point in itertools.chain(range(0x00, 0x20), range(0xe000, 0xf900)):
+        separator = chr(code_point)
+        if not any(map(lambda x: separator in x, invariant_segments)):
+            return separator
+    raise Exception("No separator is available")
+
+
+def merge(template_a, template_b, parser_type="html"):
+    """
+    To merge two (partial) templates into a template that is valid for the documents of both.
+    Each template is joined with a separator that appears in neither of them, and the joined texts are handled like
+    documents. Since a separator marks a data segment, merged segments are split at the separators again.
+    :param template_a: a list of invariant segments
+    :param template_b: a list of invariant segments
+    :param parser_type: a type of parser (see tokenizer.Tokenizer.create_parser)
+    :return:
+    """
+    separator = choose_separator(template_a + template_b)
+    text = generate([separator.join(template_a), separator.join(template_b)], parser_type=parser_type)
+    final_text = []
+    for invariant_segment in text:
+        final_text.extend(filter(len, invariant_segment.split(separator)))
+    return final_text
+
+
+def generate_parallel(documents, workers, parser_type="html"):
+    """
+    To get the template by using a process pool.
+    The documents are sharded across worker processes and a partial template is inferred per shard. Then partial
+    templates are merged pairwise in a reduction tree until one template remains.
+    :param documents:
+    :param workers: the number of worker processes
+    :param parser_type: a type of parser (see tokenizer.Tokenizer.create_parser)
+    :return:
+    """
+    num_of_shards = min(workers, len(documents) // 2)
+    if num_of_shards <= 1:
+        return generate(documents, parser_type=parser_type)
+
+    shards = [documents[shard_index::num_of_shards] for shard_index in range(num_of_shards)]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        partial_templates = list(executor.map(functools.partial(generate, parser_type=parser_type), shards))
+        return merge_all(executor, partial_templates, parser_type)
+
+
+def merge_all(executor, partial_templates, parser_type="html"):
+    """
+    To merge partial templates pairwise in a reduction tree until one template remains
+    :param executor: an executor that runs the merges of a level in parallel
+    :param partial_templates: a non-empty list of templates
+    :param parser_type: a type of parser (see tokenizer.Tokenizer.create_parser)
+    :return:
+    """
+    while len(partial_templates) > 1:
+        merged_templates = list(executor.map(functools.partial(merge, parser_type=parser_type),
+                                             partial_templates[0::2], partial_templates[1::2]))
+        if len(partial_templates) % 2 == 1:
+            merged_templates.append(partial_templates[-1])
+        partial_templates = merged_templates
+    return partial_templates[0]
+
+
+def deduplicate(documents):
+    """
+    To drop exact-duplicate documents by their content hash (the first one is kept)
+    :param documents:
+    :return:
+    """
+    unique_documents = []
+    seen = set()
+    for document in documents:
+        document_hash = util.compute_hash(document)
+        if document_hash not in seen:
+            seen.add(document_hash)
+            unique_documents.append(document)
+    return unique_documents
+
+
+def fingerprint(document):
+    """
+    To compute a structural fingerprint of the given document, which is a hash of its sequence of tag names.
+    Documents generated by the same code path tend to share a fingerprint even though their texts differ.
+    :param document:
+    :return:
+    """
+    return util.compute_hash(" ".join(_tag_name_pattern.findall(document)))
+
+
+def choose_sample(documents, sample_size):
+    """
+    To choose a small but diverse sample of documents.
+    Documents are grouped by their structural fingerprint, and the groups are visited in a round-robin fashion
+    (larger groups first) so that every structure gets into the sample before any structure gets a second one.
+    :param documents:
+    :param sample_size:
+    :return: indices of the chosen documents
+    """
+    groups = collections.OrderedDict()
+    for doc_index, document in enumerate(documents):
+        groups.setdefault(fingerprint(document), []).append(doc_index)
+    ordered_groups = sorted(groups.values(), key=lambda x: -len(x))
+
+    sample_indices = []
+    for round_index in range(max(map(len, ordered_groups), default=0)):
+        for group in ordered_groups:
+            if len(sample_indices) >= sample_size:
+                return sample_indices
+            if round_index < len(group):
+                sample_indices.append(group[round_index])
+    return sample_indices
+
+
+def generate_sampled(documents, sample_size, workers=1, parser_type="html"):
+    """
+    To get the template from a sample of documents, and to validate it against the rest of documents.
+    Every document that cannot be extracted by the template gets into the sample (up to sample_size documents at a
+    time). Only the added documents are inferred, and their template is merged into the current one (see merge), so a
+    round costs as much as its added documents rather than the whole sample.
+    :param documents:
+    :param sample_size: the number of documents in the initial sample
+    :param workers: the number of worker processes (see generate_parallel)
+    :param parser_type: a type of parser (see tokenizer.Tokenizer.create_parser)
+    :return:
+    """
+    documents = deduplicate(documents)
+    sample_indices = choose_sample(documents, max(sample_size, 2))
+    text = generate_parallel([documents[doc_index] for doc_index in sample_indices], workers, parser_type)
+    while True:
+        sampled = set(sample_indices)
+        failed_indices = []
+        for doc_index, document in enumerate(documents):
+            if doc_index not in sampled and extract(text, document) is None:
+                failed_indices.append(doc_index)
+        if not failed_indices:
+            return text
+        added_indices = failed_indices[:max(sample_size, 1)]
+        sample_indices.extend(added_indices)
+        added_text = generate_parallel([documents[doc_index] for doc_index in added_indices], workers, parser_type)
+        text = merge(text, added_text, parser_type)
+
+
+def align_segment(invariant_segment, region, parser_type="html"):
+    """
+    To shrink an invariant segment that is missing in a region of a new document.
+    The segment and the region are handled like two documents, so the result is a list of pieces of the segment
+    (in order) that also appear in the region.
+    :param invariant_segment:
+    :param region: the part of the new document where the segment should have been
+    :param parser_type: a type of parser (see tokenizer.Tokenizer.create_parser)
+    :return: a pair of the pieces and the offset in the region right after the last piece
+    """
+    if not invariant_segment or not region:
+        return [], 0
+    pieces = list(filter(len, generate([invariant_segment, region], parser_type=parser_type) or []))
+    offset = 0
+    for piece_index, piece in enumerate(pieces):
+        found_offset = region.find(piece, offset)
+        if found_offset == -1:
+            # Pieces after one that cannot be placed in order are dropped, so the result stays valid for the region
+            return pieces[:piece_index], offset
+        offset = found_offset + len(piece)
+    return pieces, offset
+
+
+def find_anchors(invariant_segments, document):
+    """
+    To find invariant segments that can be placed in a document without ambiguity. The segments are searched in order
+    from the end of the last anchor, as extract does, and a segment becomes an anchor if it occurs exactly once in the
+    rest of the document (an earlier occurrence lies in a region that the segments before it are aligned in).
+    The offset only moves forward, so the document is not scanned from the start for every segment.
+    :param invariant_segments:
+    :param document:
+    :return: a list of (segment index, offset in the document)
+    """
+    anchors = []
+    end_offset = 0
+    for index, invariant_segment in enumerate(invariant_segments):
+        if invariant_segment:
+            offset = document.find(invariant_segment, end_offset)
+            if offset != -1 and document.find(invariant_segment, offset + 1) == -1:
+                anchors.append((index, offset))
+                end_offset = offset + len(invariant_segment)
+    return anchors
+
+
+def align_region(invariant_segments, document, start, end, parser_type="html"):
+    """
+    To align invariant segments against a region of a document, as extract does. Segments that cannot be found are
+    aligned against the part of the region before the next segment that can be found (see align_segment).
+    :param invariant_segments:
+    :param document:
+    :param start: the start offset of the region
+    :param end: the end offset of the region
+    :param parser_type: a type of parser (see tokenizer.Tokenizer.create_parser)
+    :return: a list of invariant segments (or their pieces) that can be found in the region in order
+    """
+    new_segments = []
+    cur_segment_offset = start
+    index = 0
+    while index < len(invariant_segments):
+        found_offset = document.find(invariant_segments[index], cur_segment_offset, end)
+        if found_offset != -1:
+            new_segments.append(invariant_segments[index])
+            cur_segment_offset = found_offset + len(invariant_segments[index])
+            index += 1
+            continue
+
+        next_index = index + 1
+        region_end = end
+        while next_index < len(invariant_segments):
+            found_offset = document.find(invariant_segments[next_index], cur_segment_offset, end)
+            if found_offset != -1:
+                region_end = found_offset
+                break
+            next_index += 1
+        for missing_index in range(index, next_index):
+            pieces, offset = align_segment(invariant_segments[missing_index],
+                                           document[cur_segment_offset:region_end], parser_type)
+            new_segments.extend(pieces)
+            cur_segment_offset += offset
+        index = next_index
+    return new_segments
+
+
+def update(invariant_segments, documents, parser_type="html"):
+    """
+    To update a template with new documents incrementally, without generating it from the old documents again.
+    Each document is aligned against the invariant segments directly: segments that occur once in the rest of the
+    document are placed first (see find_anchors), and the others are aligned between them (see align_region). Only
+    the segments that cannot be found are split or shrunk into pieces, which keep their order in the original segment,
+    so the template stays valid for the documents it was generated from. Only segments that need re-alignment are
+    tokenized.
+    :param invariant_segments: a list of invariant segments
+    :param documents: new documents
+    :param parser_type: a type of parser (see tokenizer.Tokenizer.create_parser)
+    :return: a list of invariant segments valid for both the old and the new documents
+    """
+    for document in documents:
+        new_segments = []
+        cur_segment_offset = 0
+        prev_index = -1
+        for index, offset in find_anchors(invariant_segments, document) + [(len(invariant_segments), len(document))]:
+            new_segments.extend(align_region(invariant_segments[prev_index + 1:index], document, cur_segment_offset,
+                                             offset, parser_type))
+            if index < len(invariant_segments):
+                new_segments.append(invariant_segments[index])
+                cur_segment_offset = offset + len(invariant_segments[index])
+            prev_index = index
+        invariant_segments = new_segments
+    return invariant_segments
+
+
+def update_parallel(invariant_segments, documents, workers, parser_type="html"):
+    """
+    To update a template by using a process pool.
+    The documents are sharded across worker processes and the template is updated with each shard (see update). The
+    updated templates are all valid for the old documents, so they are merged like partial templates (see merge_all).
+    :param invariant_segments: a list of invariant segments
+    :param documents: new documents
+    :param workers: the number of worker processes
+    :param parser_type: a type of parser (see tokenizer.Tokenizer.create_parser)
+    :return:
+    """
+    num_of_shards = min(workers, len(documents))
+    if num_of_shards <= 1:
+        return update(invariant_segments, documents, parser_type)
+
+    shards = [documents[shard_index::num_of_shards] for shard_index in range(num_of_shards)]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        partial_templates = list(executor.map(functools.partial(update, invariant_segments, parser_type=parser_type),
+                                              shards))
+        return merge_all(executor, partial_templates, parser_type)
+
+
 def extract(invariant_segments_text, document):
     """
     To get data segments by removing invariant segments from the original document
+    A document may also be bytes or an mmap object; then invariant segments must be encoded (see encode_segments) and
+    data segments are memoryview slices of the document, so the document is neither decoded nor copied.
     :param invariant_segments_text:
     :param document:
     :return:
     """
+    view = document if isinstance(document, str) else memoryview(document)
     cur_segment_offset = 0
     prev_segment_offset = 0
     data_segments = []
@@ -342,24 +960,78 @@ def extract(invariant_segments_text, document):
             # The invariant segment MUST be found in the document.
             return None
         else:
-            data_segments.append(document[prev_segment_offset:cur_segment_offset])
+            data_segments.append(view[prev_segment_offset:cur_segment_offset])
         cur_segment_offset += len(invariant_segment)
         prev_segment_offset = cur_segment_offset
-    data_segments.append(document[cur_segment_offset:len(document)])
+    data_segments.append(view[cur_segment_offset:len(document)])
     return data_segments
 
 
+def encode_segments(invariant_segments):
+    """
+    :param invariant_segments:
+    :return: a list of invariant segments encoded in UTF-8, for extracting bytes documents
+    """
+    return [invariant_segment.encode("utf-8") for invariant_segment in invariant_segments]
+
+
 def reconstruct(invariant_segments, data_segments):
-    buffer = ""
+    """
+    :param invariant_segments: strings, or encoded invariant segments if data segments are bytes-like
+    :param data_segments:
+    :return: the original document (str or bytes), or None if the number of data segments does not match
+    """
     if len(data_segments) == len(invariant_segments) + 1:
-        for index in range(len(invariant_segments)):
-            buffer += (data_segments[index] + invariant_segments[index])
-        buffer += data_segments[-1]
-        return buffer
+        pieces = [None] * (len(invariant_segments) + len(data_segments))
+        pieces[0::2] = data_segments
+        pieces[1::2] = invariant_segments
+        if isinstance(data_segments[0], str):
+            return "".join(pieces)
+        return b"".join(pieces)
     else:
         return None
 
 
+def reconstruct_pieces(invariant_segments, data_segments):
+    """
+    To yield the pieces of the original document (data and invariant segments interleaved) without joining them
+    :param invariant_segments:
+    :param data_segments: there must be one more data segment than invariant segments
+    :return: a generator of pieces
+    """
+    for data_segment, invariant_segment in zip(data_segments, invariant_segments):
+        yield data_segment
+        yield invariant_segment
+    yield data_segments[-1]
+
+
+def write_reconstructed(sink, invariant_segments, data_segments, hash_object=None):
+    """
+    To write the original document to a binary sink (e.g., a file or a socket file) piece by piece, so the document is
+    never built in memory. Text pieces are encoded in UTF-8 one at a time.
+    :param sink: an object with writelines (e.g., io.BufferedWriter)
+    :param invariant_segments: strings, or encoded invariant segments if data segments are bytes-like
+    :param data_segments:
+    :param hash_object: a hash object (see util.new_hash) updated with every piece, if given
+    :return: the number of bytes written, or None if the number of data segments does not match
+    """
+    if len(data_segments) != len(invariant_segments) + 1:
+        return None
+    num_of_bytes = [0]
+
+    def encoded_pieces():
+        for piece in reconstruct_pieces(invariant_segments, data_segments):
+            if isinstance(piece, str):
+                piece = piece.encode("utf-8")
+            num_of_bytes[0] += len(piece)
+            if hash_object is not None:
+                hash_object.update(piece)
+            yield piece
+
+    sink.writelines(encoded_pieces())
+    return num_of_bytes[0]
+
+
 def select(features, combined_predicates, offset):
     status_code, selected_index = selector.selector_impl(features, combined_predicates)
     if status_code == selector.SelectorStatus.SUCCESS:
@@ -368,27 +1040,406 @@ def select(features, combined_predicates, offset):
         return None
 
 
-def serialize_object(template_object):
+class CompiledTemplate(object):
+    """
+    A template prepared once for extracting many documents. It keeps the segment lengths, the features of the
+    invariant segments, and the results of selectors (which depend on the template only), so a crawling script pays
+    for them once per template instead of once per document.
+    Searching relies on str.find, which already uses a skip table for long segments in C; a multi-pattern automaton
+    written in Python would be slower than that.
+    It can be used where a list of invariant segments is expected (iteration, len and indexing).
+    Documents may be str, bytes or mmap objects (see extract).
+    """
+
+    def __init__(self, invariant_segments, parser_type="html"):
+        self.invariant_segments = tuple(invariant_segments)
+        self.parser_type = parser_type
+        self._lengths = tuple(map(len, self.invariant_segments))
+        self._encoded_segments = None
+        self._encoded_lengths = None
+        self._features = None
+        self._selected_index_of = dict()
+
+    def __len__(self):
+        return len(self.invariant_segments)
+
+    def __iter__(self):
+        return iter(self.invariant_segments)
+
+    def __getitem__(self, index):
+        return self.invariant_segments[index]
+
+    @property
+    def features(self):
+        if self._features is None:
+            self._features = [tokenizer.Tokenizer.feature(self.parser_type, invariant_segment)
+                              for invariant_segment in self.invariant_segments]
+        return self._features
+
+    @property
+    def encoded_segments(self):
+        if self._encoded_segments is None:
+            self._encoded_segments = tuple(encode_segments(self.invariant_segments))
+            self._encoded_lengths = tuple(map(len, self._encoded_segments))
+        return self._encoded_segments
+
+    def extract_offsets(self, document):
+        """
+        To locate data segments in a single pass over the document
+        :param document:
+        :return: a list of offsets, where the i-th data segment is document[offsets[2 * i]:offsets[2 * i + 1]],
+                 or None if an invariant segment is not found
+        """
+        if isinstance(document, str):
+            invariant_segments, lengths = self.invariant_segments, self._lengths
+        else:
+            invariant_segments, lengths = self.encoded_segments, self._encoded_lengths
+        find = document.find
+        offsets = [0]
+        cur_segment_offset = 0
+        for invariant_segment, length in zip(invariant_segments, lengths):
+            cur_segment_offset = find(invariant_segment, cur_segment_offset)
+            if cur_segment_offset == -1:
+                return None
+            offsets.append(cur_segment_offset)
+            cur_segment_offset += length
+            offsets.append(cur_segment_offset)
+        offsets.append(len(document))
+        return offsets
+
+    def extract(self, document):
+        """
+        The same as extract
+        :param document:
+        :return:
+        """
+        offsets = self.extract_offsets(document)
+        if offsets is None:
+            return None
+        view = document if isinstance(document, str) else memoryview(document)
+        return [view[offsets[index]:offsets[index + 1]] for index in range(0, len(offsets), 2)]
+
+    def extract_segments(self, document, indices):
+        """
+        To extract only the requested data segments. Invariant segments are searched up to the highest requested
+        index and the rest of the document is not scanned, so a document that matches the template only partly may
+        still succeed.
+        :param document:
+        :param indices: indices of data segments (negative indices count from the end)
+        :return: a dict from each index to its data segment, or None if an invariant segment is not found
+        """
+        if isinstance(document, str):
+            invariant_segments, lengths = self.invariant_segments, self._lengths
+            view = document
+        else:
+            invariant_segments, lengths = self.encoded_segments, self._encoded_lengths
+            view = memoryview(document)
+        num_of_segments = len(invariant_segments) + 1
+        keys_of = dict()
+        for index in indices:
+            keys_of.setdefault(index + num_of_segments if index < 0 else index, []).append(index)
+        if len(keys_of) == 0:
+            return dict()
+        last_index = min(max(keys_of), num_of_segments - 1)
+
+        find = document.find
+        data_segments = dict()
+        cur_segment_offset = 0
+        for index in range(last_index + 1):
+            if index < len(invariant_segments):
+                next_segment_offset = find(invariant_segments[index], cur_segment_offset)
+                if next_segment_offset == -1:
+                    return None
+            else:
+                next_segment_offset = len(document)
+            if index in keys_of:
+                data_segment = view[cur_segment_offset:next_segment_offset]
+                for key in keys_of[index]:
+                    data_segments[key] = data_segment
+            if index < len(invariant_segments):
+                cur_segment_offset = next_segment_offset + lengths[index]
+        return data_segments
+
+    def select(self, combined_predicates, offset):
+        """
+        The same as select over the features of this template. Results of predicates made by the selector module are
+        cached.
+        :param combined_predicates:
+        :param offset:
+        :return:
+        """
+        keys = tuple([getattr(predicate, "key", None) for predicate in combined_predicates])
+        if None in keys:
+            return select(self.features, combined_predicates, offset)
+        if keys not in self._selected_index_of:
+            self._selected_index_of[keys] = select(self.features, combined_predicates, 0)
+        selected_index = self._selected_index_of[keys]
+        return selected_index + offset if selected_index is not None else None
+
+
+@functools.lru_cache(maxsize=64)
+def _compile_template(invariant_segments, parser_type):
+    return CompiledTemplate(invariant_segments, parser_type)
+
+
+def compile_template(invariant_segments, parser_type="html"):
+    """
+    To get the compiled form of a template. Compiled templates are cached, so calling this for every document is cheap.
+    :param invariant_segments: a list of invariant segments (or a CompiledTemplate)
+    :param parser_type: a type of parser (see tokenizer.Tokenizer.create_parser)
+    :return: a CompiledTemplate
+    """
+    if isinstance(invariant_segments, CompiledTemplate):
+        return invariant_segments
+    return _compile_template(tuple(invariant_segments), parser_type)
+
+
+def extract_segments(invariant_segments, document, indices):
+    """
+    To extract only the requested data segments (see CompiledTemplate.extract_segments)
+    :param invariant_segments: a list of invariant segments (or a CompiledTemplate)
+    :param document:
+    :param indices:
+    :return: a dict from each index to its data segment, or None if an invariant segment is not found
+    """
+    return compile_template(invariant_segments).extract_segments(document, indices)
+
+
+def serialize_object(template_object, zdict=None, store=None):
+    """
+    Template objects and data objects are written in the binary format of the dataformat module; other objects (e.g.,
+    scraped items) are pickled.
+    :param template_object:
+    :param zdict: the preset dictionary of the template (see make_zdict), for compressing a data object
+    :param store: a segment store (see dedup.SegmentStore) that keeps long data segments of a data object
+    :return:
+    """
+    if dataformat.is_serializable(template_object):
+        return dataformat.serialize(template_object, zdict=zdict, store=store)
     return pickle.dumps(template_object)
 
 
-def deserialize_object(serialized):
-    return pickle.loads(serialized)
+class _PlainUnpickler(pickle.Unpickler):
+    """
+    Pickles written by older versions (and scraped items) hold plain values only: dicts, lists, strings, bytes, numbers,
+    booleans and None, which pickle encodes without importing anything. Any other global is refused, since loading it
+    could run arbitrary code.
+    """
+
+    allowed_globals = {("builtins", "set"), ("builtins", "frozenset"), ("builtins", "bytearray"),
+                       ("_codecs", "encode")}
+
+    def find_class(self, module, name):
+        if (module, name) not in self.allowed_globals:
+            raise pickle.UnpicklingError("Refusing to load {}.{} from a pickle".format(module, name))
+        return super().find_class(module, name)
+
+
+def deserialize_object(serialized, zdict=None, store=None):
+    """
+    :param serialized: bytes in the binary format, or a pickle of plain values (objects written by older versions)
+    :param zdict: see dataformat.deserialize
+    :param store: see dataformat.deserialize
+    :return:
+    """
+    if dataformat.is_serialized(serialized):
+        return dataformat.deserialize(serialized, zdict, store)
+    return _PlainUnpickler(io.BytesIO(serialized)).load()
+
+
+def make_zdict(invariant_segments, documents, size=32 * 1024, sample_size=64):
+    """
+    To make a preset dictionary for compressing data segments with zlib. Data segments still hold boilerplate (markup
+    around values, repeated labels, ...), which a small document alone cannot compress well. The dictionary holds the
+    end of the template (a quarter of the size) followed by lines of data segments that occur in at least two sampled
+    documents, the most valuable (document frequency times length) last, since zlib reaches the end of a dictionary
+    with the shortest distances.
+    :param invariant_segments:
+    :param documents: strings
+    :param size: the maximum size of the dictionary (zlib uses at most 32 KB)
+    :param sample_size: the number of documents sampled (evenly) from the documents
+    :return: bytes
+    """
+    compiled_template = compile_template(invariant_segments)
+    step = max(1, len(documents) // sample_size)
+    num_of_documents_with = collections.Counter()
+    for document in documents[::step][:sample_size]:
+        data_segments = compiled_template.extract(document)
+        if data_segments is None:
+            continue
+        pieces = set()
+        for data_segment in data_segments:
+            pieces.add(data_segment)
+            pieces.update(data_segment.splitlines(True))
+        num_of_documents_with.update([piece for piece in pieces if len(piece) >= 4])
 
+    invariant_part = b"".join(compiled_template.encoded_segments)[-(size // 4):]
+    budget = size - len(invariant_part)
+    selected = []
+    for score, piece in sorted([(count * len(piece), piece) for piece, count in num_of_documents_with.items()
+                                if count >= 2], reverse=True):
+        encoded_piece = piece.encode("utf-8")
+        if len(encoded_piece) <= budget:
+            selected.append(encoded_piece)
+            budget -= len(encoded_piece)
+    return invariant_part + b"".join(reversed(selected))
 
-def make_template_object(invariant_segments=None, merkle_root=None):
-    template_object = {"inv_seg": invariant_segments, "mk_root":merkle_root}
+
+def make_template_object(invariant_segments=None, merkle_root=None, parser_type="html", zdict=None):
+    template_object = {"inv_seg": invariant_segments, "mk_root":merkle_root, "parser": parser_type,
+                       "inv_cum_len": cumulative_lengths(invariant_segments or [])}
+    if zdict is not None:
+        template_object["zdict"] = zdict
     return template_object
 
 
-def make_data_object(data_segments=None, template_merkle_root=None, data_merkle_root=None, original_hash=None):
+def make_data_object(data_segments=None, template_merkle_root=None, data_merkle_root=None, original_hash=None,
+                     binary=False):
+    """
+    :param binary: if True, data segments are bytes and the document is reconstructed with encoded invariant segments
+    """
     data_object = {"data_seg": data_segments,
                    "mk_root_template": template_merkle_root,
                    "mk_root_data": data_merkle_root,
-                   "original_hash": original_hash}
+                   "original_hash": original_hash,
+                   "binary": binary,
+                   "data_cum_len": cumulative_lengths(data_segments or [])}
     return data_object
 
 
+def make_delta_object(data_object, changed_indices, base_name, base_data_object, chain_length):
+    """
+    To make a data object that holds only the data segments that differ from a base version of the same document (e.g.,
+    an earlier crawl of the same page). The Merkle roots and the hash still describe the whole document, so the
+    document is verified as usual once the delta is applied (see apply_delta).
+    :param data_object: see make_data_object
+    :param changed_indices: indices of the data segments that differ from the base (see util.diff_merkle_leaves)
+    :param base_name: the file name of the base version (in the same directory)
+    :param base_data_object: the (resolved) data object of the base version
+    :param chain_length: the number of deltas from the last full snapshot, including this one
+    :return:
+    """
+    delta_object = make_data_object([data_object["data_seg"][index] for index in changed_indices],
+                                    data_object["mk_root_template"], data_object["mk_root_data"],
+                                    data_object["original_hash"], data_object["binary"])
+    delta_object["base"] = base_name.encode("utf-8")
+    delta_object["base_root"] = base_data_object["mk_root_data"] or b""
+    delta_object["delta_index"] = dataformat.encode_varints(changed_indices)
+    delta_object["chain_length"] = dataformat.encode_varints([chain_length])
+    return delta_object
+
+
+def is_delta_object(data_object):
+    return "base" in data_object
+
+
+def delta_base_name(delta_object):
+    return str(delta_object["base"], "utf-8")
+
+
+def delta_chain_length(data_object):
+    """
+    :param data_object:
+    :return: the number of deltas from the last full snapshot (0 for a full data object)
+    """
+    if not is_delta_object(data_object):
+        return 0
+    return dataformat.decode_varints(data_object["chain_length"])[0]
+
+
+def apply_delta(delta_object, base_data_object):
+    """
+    :param delta_object: see make_delta_object
+    :param base_data_object: the (resolved) data object of the base version
+    :return: the full data object
+    """
+    if (base_data_object["mk_root_data"] or b"") != delta_object["base_root"]:
+        raise Exception("The base version does not match the delta ({})".format(delta_base_name(delta_object)))
+    data_segments = list(base_data_object["data_seg"])
+    for index, data_segment in zip(dataformat.decode_varints(delta_object["delta_index"]), delta_object["data_seg"]):
+        data_segments[index] = data_segment
+    return make_data_object(data_segments, delta_object["mk_root_template"], delta_object["mk_root_data"],
+                            delta_object["original_hash"], delta_object["binary"])
+
+
+def cumulative_lengths(segments):
+    """
+    :param segments: strings (measured in UTF-8) or bytes-like objects
+    :return: a list of n + 1 byte offsets, where the i-th segment spans [cum[i], cum[i + 1]) of the concatenation
+    """
+    cum_lengths = [0]
+    for segment in segments:
+        cum_lengths.append(cum_lengths[-1] + len(segment.encode("utf-8") if isinstance(segment, str) else segment))
+    return cum_lengths
+
+
+def _encoded_piece(template_object, data_object, piece_index):
+    if piece_index % 2 == 0:
+        piece = data_object["data_seg"][piece_index // 2]
+    else:
+        piece = template_object["inv_seg"][piece_index // 2]
+    return piece.encode("utf-8") if isinstance(piece, str) else bytes(piece)
+
+
+def read_range(template_object, data_object, start, end):
+    """
+    To read bytes [start, end) of the original document without reconstructing it. Only the segments overlapping the
+    range are touched: the document consists of pieces (data and invariant segments interleaved), and the first piece
+    is found by binary search over the cumulative lengths of both kinds of segments.
+    :param template_object: see make_template_object
+    :param data_object: see make_data_object
+    :param start:
+    :param end:
+    :return: bytes (shorter than end - start if the range goes beyond the document)
+    """
+    inv_cum_len = template_object.get("inv_cum_len") or cumulative_lengths(template_object["inv_seg"])
+    data_cum_len = data_object.get("data_cum_len") or cumulative_lengths(data_object["data_seg"])
+    num_of_pieces = 2 * len(data_cum_len) - 3
+
+    def piece_offset(piece_index):
+        # The sum of every piece before it: (piece_index + 1) // 2 data segments and piece_index // 2 invariant ones
+        return data_cum_len[(piece_index + 1) // 2] + inv_cum_len[piece_index // 2]
+
+    start = max(start, 0)
+    end = min(end, piece_offset(num_of_pieces))
+    if start >= end:
+        return b""
+
+    # The last piece that starts at or before start
+    low, high = 0, num_of_pieces - 1
+    while low < high:
+        mid = (low + high + 1) // 2
+        if piece_offset(mid) <= start:
+            low = mid
+        else:
+            high = mid - 1
+
+    pieces = []
+    piece_index = low
+    while piece_index < num_of_pieces and piece_offset(piece_index) < end:
+        offset = piece_offset(piece_index)
+        piece = _encoded_piece(template_object, data_object, piece_index)
+        pieces.append(piece[max(start - offset, 0):end - offset])
+        piece_index += 1
+    return b"".join(pieces)
+
+
+def read_data_segment(template_object, data_object, segment_index):
+    """
+    :param template_object: see make_template_object
+    :param data_object: see make_data_object
+    :param segment_index:
+    :return: the data segment as bytes, and its byte range in the original document
+    """
+    inv_cum_len = template_object.get("inv_cum_len") or cumulative_lengths(template_object["inv_seg"])
+    data_cum_len = data_object.get("data_cum_len") or cumulative_lengths(data_object["data_seg"])
+    if segment_index < 0:
+        segment_index += len(data_cum_len) - 1
+    data_segment = _encoded_piece(template_object, data_object, 2 * segment_index)
+    offset = data_cum_len[segment_index] + inv_cum_len[segment_index]
+    return data_segment, (offset, offset + len(data_segment))
+
+
 # def candidates_pattern_repetition(edges, outgoing_count, incoming_count):
 #     cnt = {}
 #     for prev_token_hash in edges:
@@ -5,40 +5,50 @@
     Author: Seunghyun Yoo (shyoo1st@cs.ucla.edu)
 """
 
+import re
+
+from . import util
+from .feature import Feature
+
+# A line break, a run of other whitespace, a word, or a single punctuation character
+token_pattern = re.compile(r"(\n)|([^\S\n]+)|(\w+)|([^\w\s])")
+token_type_of_group = (None, "<newline>", "<space>", "<word>", "<punct>")
+
 
 class RawTextParser(object):
-    tokens = []
+    """
+    A tokenizer for non-HTML documents such as JSON API responses and log-style text pages.
+    It splits a document on line, whitespace and punctuation boundaries. Like RawHTMLLexer, boundaries are recorded as
+    offsets into the document (offsets), and the (type, line number, offset) tuples are made when they are accessed.
+    """
 
     def __init__(self):
-        self.clear()
+        self.clear(is_collecting_meta=False)
+
+    def clear(self, is_collecting_meta=False):
+        self.offsets = []
+        self.token_types = []
+        self.tokens_meta = []
+        self.is_collecting_meta = is_collecting_meta
+        self._rawdata = ""
 
-    def clear(self):
-        self.tokens = []
+    @property
+    def tokens(self):
+        line_offsets = util.to_line_offsets(self._rawdata, self.offsets)
+        return [(token_type, line_number, offset)
+                for token_type, (line_number, offset) in zip(self.token_types, line_offsets)]
 
     def feed(self, doc):
-        pass
+        # A token may continue in the next chunk, so the whole document is scanned when the parser is closed.
+        self._rawdata += doc
 
     def close(self):
-        pass
-
-    # def handle_starttag(self, tag, _):
-    #     line_number, offset = self.getpos()
-    #     self.tokens.append(("<start>", line_number, offset))
-    #
-    # def handle_endtag(self, tag):
-    #     line_number, offset = self.getpos()
-    #     self.tokens.append(("<end>", line_number, offset))
-    #
-    # def handle_startendtag(self, tag, _):
-    #     line_number, offset = self.getpos()
-    #     self.tokens.append(("<startend>", line_number, offset))
-    #
-    # def handle_data(self, data):
-    #     line_number, offset = self.getpos()
-    #     self.tokens.append(("<data>", line_number, offset))
-    #
-    # def close(self):
-    #     line_number, offset = self.getpos()
-    #     self.tokens.append(("<doc_end>", line_number, offset))
-    #     super(RawHTMLParser, self).close()
-    #
+        offsets = self.offsets
+        types = self.token_types
+        for match in token_pattern.finditer(self._rawdata):
+            offsets.append(match.start())
+            types.append(token_type_of_group[match.lastindex])
+            if self.is_collecting_meta:
+                self.tokens_meta.append(Feature.from_data(match.group().strip()))
+        offsets.append(len(self._rawdata))
+        types.append("<doc_end>")
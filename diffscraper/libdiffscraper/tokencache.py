@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    A persistent, content-addressed cache of tokenization results (token spans and feature records).
+    Author: Seunghyun Yoo (shyoo1st@cs.ucla.edu)
+"""
+
+import array
+import mmap
+import os
+import struct
+
+from . import util
+from .feature import Feature
+
+# magic, version, has_features, number of boundaries, length of the feature section (bytes)
+header_format = struct.Struct("<4sBB2xII")
+cache_magic = b"DSTC"
+cache_version = 1
+feature_types = ("start", "end", "startend", "data")
+
+
+def encode_features(features):
+    """
+    To encode feature records compactly: a table of distinct strings followed by records of string indices
+    (index + 1, zero stands for None).
+    :param features:
+    :return:
+    """
+    index_of = dict()
+    strings = []
+
+    def index(value):
+        if value is None:
+            return 0
+        string_index = index_of.get(value)
+        if string_index is None:
+            strings.append(value)
+            string_index = len(strings)
+            index_of[value] = string_index
+        return string_index
+
+    records = array.array("I")
+    for feature in features:
+        records.append(feature_types.index(feature.type))
+        records.append(index(feature.tag))
+        records.append(index(feature.data))
+        if feature.attrs is None:
+            records.append(0)
+        else:
+            records.append(len(feature.attrs) + 1)
+            for attr_name, attr_value in feature.attrs:
+                records.append(index(attr_name))
+                records.append(index(attr_value))
+
+    encoded_strings = [string.encode("utf-8", errors="surrogatepass") for string in strings]
+    lengths = array.array("I", map(len, encoded_strings))
+    return b"".join([struct.pack("<III", len(features), len(strings), len(records)),
+                     lengths.tobytes(), records.tobytes()] + encoded_strings)
+
+
+def decode_features(buffer):
+    """
+    To decode feature records encoded by encode_features
+    :param buffer:
+    :return: a tuple of feature.Feature records
+    """
+    buffer = memoryview(buffer)
+    num_of_features, num_of_strings, num_of_records = struct.unpack_from("<III", buffer)
+    offset = 12
+    lengths = buffer[offset:offset + 4 * num_of_strings].cast("I")
+    offset += 4 * num_of_strings
+    records = buffer[offset:offset + 4 * num_of_records].cast("I")
+    offset += 4 * num_of_records
+    strings = [None]
+    for length in lengths:
+        strings.append(str(buffer[offset:offset + length], "utf-8", errors="surrogatepass"))
+        offset += length
+
+    features = []
+    pos = 0
+    for _ in range(num_of_features):
+        feature_type, tag, data, num_of_attrs = records[pos:pos + 4]
+        pos += 4
+        attrs = None
+        if num_of_attrs > 0:
+            attrs = []
+            for attr_index in range(num_of_attrs - 1):
+                attrs.append((strings[records[pos]], strings[records[pos + 1]]))
+                pos += 2
+        if feature_types[feature_type] == "data":
+            features.append(Feature.from_data(strings[data]))
+        else:
+            features.append(Feature.from_tag(feature_types[feature_type], strings[tag], attrs))
+    return tuple(features)
+
+
+class TokenCache(object):
+    """
+    Each entry is a file named after the content hash and the parser type. It holds a fixed header, the token
+    boundaries as an array of uint32 (spans are two views of it), and optionally encoded feature records.
+    Large entries are memory-mapped. The least recently used entries (by modification time, which is refreshed on every
+    hit) are evicted when the total size exceeds the size limit.
+    """
+
+    def __init__(self, cache_dir, size_limit=256 * 1024 * 1024, min_length=256, mmap_threshold=1024 * 1024):
+        """
+        :param cache_dir: the cache directory (it is created if needed)
+        :param size_limit: the maximum total size of entries in bytes
+        :param min_length: strings shorter than this are not cached, since parsing them is cheaper than a file access
+        :param mmap_threshold: entries larger than this are memory-mapped instead of being read
+        """
+        self._cache_dir = cache_dir
+        self._size_limit = size_limit
+        self._min_length = min_length
+        self._mmap_threshold = mmap_threshold
+        self._total_size = None
+
+    def path_of(self, parser_type, raw_string):
+        key = util.hex_digest_from(util.compute_hash(raw_string))
+        return os.path.join(self._cache_dir, key[:2], "{}.{}.tok".format(key, parser_type))
+
+    def load(self, parser_type, raw_string, with_features=False):
+        """
+        :param parser_type:
+        :param raw_string:
+        :param with_features: if True, an entry without feature records is regarded as a miss
+        :return: a pair of spans and features (None if they were not stored), or None if there is no entry
+        """
+        if len(raw_string) < self._min_length:
+            return None
+        path = self.path_of(parser_type, raw_string)
+        try:
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size >= self._mmap_threshold:
+                    buffer = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+                else:
+                    buffer = memoryview(f.read())
+        except OSError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            # e.g., a read-only shared cache; the entry is still valid, it just does not get fresher
+            pass
+
+        if len(buffer) < header_format.size:
+            return None
+        magic, version, has_features, num_of_boundaries, features_length = header_format.unpack_from(buffer)
+        if magic != cache_magic or version != cache_version:
+            return None
+        if with_features and not has_features:
+            return None
+
+        offset = header_format.size
+        boundaries = buffer[offset:offset + 4 * num_of_boundaries].cast("I")
+        offset += 4 * num_of_boundaries
+        features = None
+        if has_features:
+            features = decode_features(buffer[offset:offset + features_length])
+        return (boundaries[:-1], boundaries[1:]), features
+
+    def store(self, parser_type, raw_string, spans, features=None):
+        if len(raw_string) < self._min_length:
+            return
+        starts, ends = spans
+        boundaries = array.array("I", starts)
+        boundaries.extend(ends[-1:])
+        encoded_features = b"" if features is None else encode_features(features)
+        header = header_format.pack(cache_magic, cache_version, int(features is not None), len(boundaries),
+                                    len(encoded_features))
+
+        path = self.path_of(parser_type, raw_string)
+        try:
+            util.mkdir_p(os.path.dirname(path))
+            fd, temp_path = util.mkstemp_next_to(path)
+        except OSError:
+            # e.g., a read-only shared cache; the result is just not cached
+            return
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(header)
+                f.write(boundaries.tobytes())
+                f.write(encoded_features)
+            os.replace(temp_path, path)
+        except OSError:
+            # e.g., a full disk
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return
+
+        self._account(header_format.size + 4 * len(boundaries) + len(encoded_features))
+
+    def entries(self):
+        """
+        :return: a list of (modification time, size, path) of every entry
+        """
+        entries = []
+        if not os.path.isdir(self._cache_dir):
+            return entries
+        for sub_dir in os.scandir(self._cache_dir):
+            if sub_dir.is_dir():
+                for entry in os.scandir(sub_dir.path):
+                    if entry.name.endswith(".tok"):
+                        stat_info = entry.stat()
+                        entries.append((stat_info.st_mtime, stat_info.st_size, entry.path))
+        return entries
+
+    def evict(self, target_size):
+        """
+        To remove the least recently used entries until the total size is not greater than target_size
+        :param target_size:
+        :return: the total size after eviction
+        """
+        entries = sorted(self.entries())
+        total_size = sum([size for _, size, _ in entries])
+        for _, size, path in entries:
+            if total_size <= target_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size
+        return total_size
+
+    def _account(self, entry_size):
+        if self._total_size is None:
+            self._total_size = sum([size for _, size, _ in self.entries()])
+        else:
+            self._total_size += entry_size
+        if self._total_size > self._size_limit:
+            # Evict a bit more than needed so that eviction does not run on every store.
+            self._total_size = self.evict(self._size_limit * 9 // 10)
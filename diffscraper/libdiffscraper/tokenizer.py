@@ -5,66 +5,157 @@
     Author: Seunghyun Yoo (shyoo1st@cs.ucla.edu)
 """
 
-from . import htmlparser, textparser
+import array
+import functools
+
+from . import htmllexer, htmlparser, textparser
 
 
 class Tokenizer(object):
+    # An optional tokencache.TokenCache shared by every tokenization (see set_cache)
+    cache = None
+
     def __init__(self):
         pass
 
     @staticmethod
-    def feature(parser_type, raw_string):
-        parser = Tokenizer.create_parser(parser_type)
-
-        parser.clear(is_collecting_meta=True)
-        parser.feed(raw_string)
-        parser.close()
-
-        return parser.tokens_meta
+    def set_cache(cache):
+        """
+        To make tokenization results persistent across commands and invocations.
+        :param cache: a tokencache.TokenCache, or None to disable caching
+        :return:
+        """
+        Tokenizer.cache = cache
+        Tokenizer.feature.cache_clear()
 
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def feature(parser_type, raw_string):
+        """
+        To get feature records of the given string (e.g., an invariant segment).
+        Results are cached, because crawling scripts ask for the features of the same template for every document.
+        :param parser_type: a type of parser, supported parsers = {html, html-fast, text}
+        :param raw_string: a raw string
+        :return: a tuple of feature.Feature records
+        """
+        _, features = Tokenizer.analyze(parser_type, raw_string)
+        return features
 
+    @staticmethod
+    def analyze(parser_type, raw_string):
+        """
+        To get token boundaries and features from a single parse.
+        :param parser_type: a type of parser, supported parsers = {html, html-fast, text}
+        :param raw_string: a raw string of the original document.
+        :return: a pair of spans (see tokenize_spans) and a tuple of feature.Feature records
+        """
+        if parser_type == "html-fast":
+            parser_type = "html"  # The boundary-only lexer does not parse attributes.
+        cache = Tokenizer.cache
+        if cache is not None:
+            cached = cache.load(parser_type, raw_string, with_features=True)
+            if cached is not None:
+                return cached
+
+        parser = Tokenizer.parse(parser_type, raw_string, is_collecting_meta=True)
+        spans, features = Tokenizer.spans_from(parser, raw_string), tuple(parser.tokens_meta)
+        if cache is not None:
+            cache.store(parser_type, raw_string, spans, features)
+        return spans, features
 
     @staticmethod
     def tokenize(parser_type, raw_string):
         """
         Since a parser just returns metadata of type, line number and offset,
         we have to construct a list of string tokens using the metadata.
-        :param parser_type: a type of parser, supported parsers = {html, text}  
+        :param parser_type: a type of parser, supported parsers = {html, html-fast, text}  
         :param raw_string: a raw string of the original document.
         :return: a list of string tokens
         """
 
+        return list(Tokenizer.iter_tokens(raw_string, Tokenizer.tokenize_spans(parser_type, raw_string)))
+
+    @staticmethod
+    def tokenize_spans(parser_type, raw_string):
+        """
+        To get tokens as (start, end) offsets into the original document instead of materialised strings.
+        :param parser_type: a type of parser, supported parsers = {html, html-fast, text}
+        :param raw_string: a raw string of the original document.
+        :return: a pair of uint32 memoryviews (start offsets, end offsets)
+        """
+        cache = Tokenizer.cache
+        if cache is not None:
+            cached = cache.load(parser_type, raw_string)
+            if cached is not None:
+                return cached[0]
+
+        parser = Tokenizer.parse(parser_type, raw_string, is_collecting_meta=False)
+        spans = Tokenizer.spans_from(parser, raw_string)
+        if cache is not None:
+            cache.store(parser_type, raw_string, spans)
+        return spans
+
+    @staticmethod
+    def parse(parser_type, raw_string, is_collecting_meta):
         parser = Tokenizer.create_parser(parser_type)
 
-        parser.clear(is_collecting_meta=False)
+        parser.clear(is_collecting_meta=is_collecting_meta)
         parser.feed(raw_string)
         parser.close()
 
-        delimiter = "\n"
-        lines = raw_string.split(delimiter)
+        return parser
+
+    @staticmethod
+    def spans_from(parser, raw_string):
+        # A parser may record boundaries as offsets into the document; otherwise convert (line number, offset).
+        boundaries = getattr(parser, "offsets", None)
+        if boundaries is None:
+            line_offsets = Tokenizer.line_offsets(raw_string)
+            boundaries = [line_offsets[token_line_number - 1] + token_offset
+                          for _, token_line_number, token_offset in parser.tokens]
 
         # If the <doc_start> token is somehow missing, let's add it manually.
-        _, first_line_number, first_offset = parser.tokens[0]
-        if not (first_line_number == 1 and first_offset == 0):
-            parser.tokens.insert(0, ("<doc_start>", 1, 0))
-
-        output_tokens = []
-        prev_token_meta_data = None
-        for token_meta_data in parser.tokens:
-            token_type, token_line_number, token_offset = token_meta_data
-            if not prev_token_meta_data is None:
-                prev_token_type, prev_token_line_number, prev_token_offset = prev_token_meta_data
-                output_token = Tokenizer.get_string_token_from(lines, prev_token_line_number, prev_token_offset,
-                                                               token_line_number,
-                                                               token_offset, delimiter)
-                output_tokens.append(output_token)
-            prev_token_meta_data = token_meta_data
-        return output_tokens
+        if boundaries[0] != 0:
+            boundaries.insert(0, 0)
+
+        # Spans are two views of the same boundaries, as the spans of a cached entry are (see tokencache.TokenCache)
+        boundaries = memoryview(array.array("I", boundaries))
+        return boundaries[:-1], boundaries[1:]
+
+    @staticmethod
+    def line_offsets(raw_string, delimiter="\n"):
+        """
+        To make a table of the offset where each line starts, so that (line number, offset) can be converted to an
+        offset into the original document in O(1).
+        :param raw_string: a raw string of the original document.
+        :param delimiter: the delimiter between lines
+        :return: an array of offsets (the first line is at index 0)
+        """
+        offsets = array.array("I", [0])
+        offset = raw_string.find(delimiter)
+        while offset != -1:
+            offsets.append(offset + len(delimiter))
+            offset = raw_string.find(delimiter, offset + len(delimiter))
+        return offsets
+
+    @staticmethod
+    def iter_tokens(raw_string, spans):
+        """
+        To slice string tokens out of the original document lazily
+        :param raw_string: a raw string of the original document.
+        :param spans: a pair of sequences (start offsets, end offsets)
+        :return: a generator of string tokens
+        """
+        starts, ends = spans
+        for start, end in zip(starts, ends):
+            yield raw_string[start:end]
 
     @staticmethod
     def create_parser(parser_type):
         if parser_type == "html":
             return htmlparser.RawHTMLParser()
+        elif parser_type == "html-fast":
+            return htmllexer.RawHTMLLexer()
         elif parser_type == "text":
             return textparser.RawTextParser()
         else:
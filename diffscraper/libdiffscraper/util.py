@@ -11,6 +11,7 @@ import bisect
 import errno
 import hashlib
 import os
+import tempfile
 
 from diffscraper.thirdparty import merkle
 
@@ -36,10 +37,20 @@ def compute_hash(token):
     To compute a hash value of the given token by using 'md5' hash algorithm.
     We may try more lightweight hash algorithm if needed but md5 is sufficient in many cases.
     Hash collision is not the issue because we will use the original string eventually and it is very unlikely to happen.
+    A bytes-like token (e.g., a memoryview or mmap) is hashed as it is, so it has the same hash as its decoded string.
     :param token: 
     :return: 
     """
-    return hashlib.new("md5", token.encode("utf-8")).digest()
+    if isinstance(token, str):
+        token = token.encode("utf-8")
+    return hashlib.new("md5", token).digest()
+
+
+def new_hash():
+    """
+    :return: a hash object of the algorithm of compute_hash, for hashing a stream incrementally
+    """
+    return hashlib.new("md5")
 
 
 def hex_digest_from(digest):
@@ -69,6 +80,27 @@ def get_prev_line(current_line):
     return tuple([c - 1 for c in current_line])
 
 
+def to_line_offsets(raw_string, offsets):
+    """
+    To convert offsets into the given string to pairs of a line number (starting from one) and an offset in the line
+    :param raw_string:
+    :param offsets: a list of offsets that must be sorted in ascending order
+    :return:
+    """
+    line_offsets = []
+    line_number = 1
+    line_start = 0
+    prev_offset = 0
+    for offset in offsets:
+        num_of_lines = raw_string.count("\n", prev_offset, offset)
+        if num_of_lines:
+            line_number += num_of_lines
+            line_start = raw_string.rindex("\n", prev_offset, offset) + 1
+        prev_offset = offset
+        line_offsets.append((line_number, offset - line_start))
+    return line_offsets
+
+
 def compute_freq(locs, current_loc):
     """
     To compute the number of occurrences of the given token right after the current line (current_loc). 
@@ -105,11 +137,25 @@ def merkle_tree(items):
     :param items: 
     :return: 
     """
-    hashes = list(map(lambda x: compute_hash(str(x)), items))
+    hashes = list(map(lambda x: compute_hash(x if isinstance(x, (bytes, bytearray, memoryview)) else str(x)), items))
     tree = merkle.MerkleTree(piece_size=1, total_length=len(hashes), root_hash=None, hashes=hashes)
     return tree
 
 
+def diff_merkle_leaves(old_tree, new_tree):
+    """
+    To find the items that differ between two merkle trees of the same number of items (see merkle_tree)
+    :param old_tree:
+    :param new_tree:
+    :return: the indices of items whose leaf hashes differ
+    """
+    if old_tree.get_root_hash() == new_tree.get_root_hash():
+        return []
+    old_hashes = old_tree.get_piece_hashes()
+    new_hashes = new_tree.get_piece_hashes()
+    return [index for index in range(len(new_hashes)) if old_hashes[index] != new_hashes[index]]
+
+
 def mkdir_p(path):
     """
     Reference: http://stackoverflow.com/questions/600268/mkdir-p-functionality-in-python
@@ -122,4 +168,23 @@ def mkdir_p(path):
         if exc.errno == errno.EEXIST and os.path.isdir(path):
             pass
         else:
-            raise
\ No newline at end of file
+            raise
+
+
+def mkstemp_next_to(path):
+    """
+    To create a temporary file in the directory of path, which is meant to replace path (os.replace) once written.
+    Unlike tempfile.mkstemp, the file gets the mode of a newly created file (0666 masked by the umask) instead of 0600.
+    :param path:
+    :return: (file descriptor, path of the temporary file)
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    umask = os.umask(0)
+    os.umask(umask)
+    try:
+        os.chmod(temp_path, 0o666 & ~umask)
+    except OSError:
+        os.close(fd)
+        os.remove(temp_path)
+        raise
+    return fd, temp_path
@@ -31,6 +31,14 @@ def init_arg_parser():
                         nargs=1,
                         help="generate a template file from input documents")
 
+    parser.add_argument("--cluster",
+                        action="store_true",
+                        help="cluster input documents and generate a template per cluster with --generate")
+
+    parser.add_argument("--zdict",
+                        action="store_true",
+                        help="store a dictionary in the template for compressing data segments with --generate")
+
     parser.add_argument("--update",
                         nargs=1,
                         help="update an old template file with new input files")
@@ -43,6 +51,14 @@ def init_arg_parser():
                         action="store_true",
                         help="decompress (reconstruct) input files by using a template file")
 
+    parser.add_argument("--list",
+                        action="store_true",
+                        help="list the documents in an archive")
+
+    parser.add_argument("--delete",
+                        action="store_true",
+                        help="delete compressed files and the segments in a segment store that no file refers to")
+
     parser.add_argument("--suggest",
                         action="store_true",
                         help="suggest a code snippet for a data segment in which you are interested")
@@ -65,8 +81,33 @@ def init_arg_parser():
                         help="print skeleton code")
 
     parser.add_argument("--template",
+                        nargs="+",
+                        help="specify a template file for update/compress/decompress/print-* commands "
+                             "(compress/decompress/scrape accept several templates or a cluster manifest)")
+
+    parser.add_argument("--archive",
                         nargs=1,
-                        help="specify a template file for incremental/compress/decompress/print-* commands")
+                        help="specify an archive file (.dsa) for compress/decompress/list commands instead of one "
+                             "file per document")
+
+    parser.add_argument("--columnar",
+                        action="store_true",
+                        help="store data segments column by column in an archive (with --compress --archive)")
+
+    parser.add_argument("--codec",
+                        nargs=1,
+                        choices=["zlib", "lzma", "raw"],
+                        help="specify a codec for the columns of a columnar archive (default: zlib)")
+
+    parser.add_argument("--store",
+                        nargs=1,
+                        help="specify a segment store (directory) in which compress keeps each distinct long data "
+                             "segment once, for compress/decompress/delete commands")
+
+    parser.add_argument("--versioned",
+                        action="store_true",
+                        help="compress each document as the next version of the document of the same name in the "
+                             "output directory, storing only the data segments that changed (with --compress)")
 
     parser.add_argument("--index",
                         nargs=1,
@@ -84,6 +125,30 @@ def init_arg_parser():
                         nargs=1,
                         help="specify an output directory for compress/decompress commands")
 
+    parser.add_argument("--jobs",
+                        nargs=1,
+                        type=int,
+                        help="specify the number of worker processes for the generate and update commands")
+
+    parser.add_argument("--sample",
+                        nargs=1,
+                        type=int,
+                        help="generate a template from a sample of K documents and validate it against the rest")
+
+    parser.add_argument("--parser",
+                        nargs=1,
+                        choices=["html", "html-fast", "text"],
+                        help="specify a tokenizer for generate/update/suggest/print-* commands (default: html)")
+
+    parser.add_argument("--cache-dir",
+                        nargs=1,
+                        help="keep tokenization results in a directory shared across commands and invocations")
+
+    parser.add_argument("--cache-size",
+                        nargs=1,
+                        type=int,
+                        help="specify the size limit of the tokenization cache in megabytes (default: 256)")
+
     parser.add_argument("--force",
                         action="store_true",
                         help="force to execute a command -- safety check will not be performed")
@@ -99,20 +164,28 @@ def init_arg_parser():
 def main():
     # Basic Features
     # ==============
-    # <docs...> --generate <template_OUTPUT>
-    # <doc> --incremental <template_OUTPUT> --template <template_INPUT>
-    # <docs...> --compress --template <template_INPUT> --output-dir <directory>
-    # <diff...> --decompress --template <template_INPUT> --output-dir <directory>
+    # <docs...> --generate <template_OUTPUT> [--jobs <N>] [--sample <K>] [--parser <html|html-fast|text>] [--zdict]
+    # <docs...> --generate <template_OUTPUT> --cluster (writes <template_OUTPUT>.<k> and <template_OUTPUT>.manifest.json)
+    # <docs...> --update <template_OUTPUT> --template <template_INPUT>
+    # <docs...> --compress --template <template_INPUT...> --output-dir <directory>
+    # <diff...> --decompress --template <template_INPUT...> --output-dir <directory>
+    # <docs...> --compress --template <template_INPUT> --archive <archive_OUTPUT> [--columnar [--codec <zlib|lzma|raw>]]
+    # [names...] --decompress --archive <archive_INPUT> --output-dir <directory>
+    # --list --archive <archive_INPUT>
+    # compress/decompress accept [--store <directory>] to share data segments among documents
+    # <docs...> --compress --template <template_INPUT...> --output-dir <directory> --versioned (writes <doc>.v<N>.data)
+    #   (--decompress writes <doc>.v<N>, and --delete keeps a version that a later version is a delta against)
+    # <data...> --delete --template <template_INPUT...> --store <directory>
 
     # Advanced Features
     # =================
     # <docs...> --suggest --index <N> [--interactive]
     # <docs...> --suggest --search <keyword> [--interactive]
-    # <docs...> --scrape <module_INPUT> --template <template_INPUT> --output-dir <directory>
+    # <docs...> --scrape <module_INPUT> --template <template_INPUT...> --output-dir <directory>
     # <docs...> --print-unified
     # <docs...> --print-data-segments
     # --print-skeleton
-
+    # Every command accepts [--cache-dir <directory> [--cache-size <MB>]] to reuse tokenization results.
     # Debugging features
     # ==================
     # --force
@@ -126,20 +199,30 @@ def main():
     is_update = args.update is not None
     is_compress = args.compress is True
     is_decompress = args.decompress is True
+    is_list = args.list is True
+    is_delete = args.delete is True
     is_suggest = args.suggest is True
     is_scrape = args.scrape is not None
     is_print_unified = args.print_unified is True
     is_print_data_segments = args.print_data_segments is True
     is_print_skeleton = args.print_skeleton is True
     is_force = args.force is True
+    num_of_jobs = args.jobs[0] if args.jobs is not None else 1
+    sample_size = args.sample[0] if args.sample is not None else None
+    parser_type = args.parser[0] if args.parser is not None else "html"
+    cache_dir = args.cache_dir[0] if args.cache_dir is not None else None
+    cache_size = args.cache_size[0] if args.cache_size is not None else 256
+    store_dir = args.store[0] if args.store is not None else None
 
     diffscraper_cuihelper = cuihelper.CUIHelper(logger)
-    diffscraper_engine = engine.Engine(diffscraper_cuihelper)
+    diffscraper_engine = engine.Engine(diffscraper_cuihelper, cache_dir, cache_size * 1024 * 1024)
 
     num_of_commands = sum([int(c) for c in [is_generate,
                                             is_update,
                                             is_compress,
                                             is_decompress,
+                                            is_list,
+                                            is_delete,
                                             is_suggest,
                                             is_scrape,
                                             is_print_unified,
@@ -152,55 +235,92 @@ def main():
 
             if is_generate:
                 assert_condition(len(args.files) >= 2, localization.str_two_input_files_9610593a())
-                ret = diffscraper_engine.generate(input_docs=args.files, output_template=args.generate[0],
-                                                  force=is_force)
+                if args.cluster:
+                    ret = diffscraper_engine.generate_clusters(input_docs=args.files,
+                                                               output_template=args.generate[0], force=is_force,
+                                                               workers=num_of_jobs, sample_size=sample_size,
+                                                               parser_type=parser_type, zdict=args.zdict)
+                else:
+                    ret = diffscraper_engine.generate(input_docs=args.files, output_template=args.generate[0],
+                                                      force=is_force, workers=num_of_jobs, sample_size=sample_size,
+                                                      parser_type=parser_type, zdict=args.zdict)
             elif is_update:
-                assert_condition(len(args.files) == 1, localization.str_only_one_input_file_47547222())
+                assert_condition(len(args.files) >= 1, localization.str_one_input_file_2b1a06ef())
                 assert_condition(args.template is not None and len(args.template) == 1,
                                  localization.str_template_file_is_required_3628ad8c())
                 ret = diffscraper_engine.update(input_docs=args.files, input_template=args.template[0],
-                                                output_template=args.update[0], force=is_force)
+                                                output_template=args.update[0], force=is_force,
+                                                workers=num_of_jobs, parser_type=parser_type)
+            elif is_compress and args.archive is not None:
+                assert_condition(len(args.files) >= 1, localization.str_one_input_file_2b1a06ef())
+                assert_condition(args.template is not None and len(args.template) >= 1,
+                                 localization.str_template_file_is_required_3628ad8c())
+                assert_condition(args.versioned is False, localization.str_versioned_archive_bcb5d0bf())
+                ret = diffscraper_engine.compress(input_docs=args.files, input_templates=args.template,
+                                                  force=is_force, output_archive=args.archive[0],
+                                                  columnar=args.columnar,
+                                                  codec=args.codec[0] if args.codec is not None else "zlib",
+                                                  store_dir=store_dir)
             elif is_compress:
                 assert_condition(len(args.files) >= 1, localization.str_one_input_file_2b1a06ef())
-                assert_condition(args.template is not None and len(args.template) == 1,
+                assert_condition(args.template is not None and len(args.template) >= 1,
                                  localization.str_template_file_is_required_3628ad8c())
                 assert_condition(args.output_dir is not None and len(args.output_dir) == 1,
                                  localization.str_output_dir_is_required_51ed2ebe())
-                ret = diffscraper_engine.compress(input_docs=args.files, input_template=args.template[0],
-                                                  output_dir=args.output_dir[0], force=is_force)
+                ret = diffscraper_engine.compress(input_docs=args.files, input_templates=args.template,
+                                                  output_dir=args.output_dir[0], force=is_force,
+                                                  store_dir=store_dir, versioned=args.versioned)
+            elif is_decompress and args.archive is not None:
+                assert_condition(args.output_dir is not None and len(args.output_dir) == 1,
+                                 localization.str_output_dir_is_required_51ed2ebe())
+                ret = diffscraper_engine.decompress_archive(input_archive=args.archive[0],
+                                                            output_dir=args.output_dir[0], force=is_force,
+                                                            member_names=args.files if len(args.files) > 0 else None,
+                                                            store_dir=store_dir)
+            elif is_list:
+                assert_condition(args.archive is not None, localization.str_archive_is_required_93c1d0e5())
+                ret = diffscraper_engine.list_archive(input_archive=args.archive[0])
+            elif is_delete:
+                assert_condition(len(args.files) >= 1, localization.str_one_input_file_2b1a06ef())
+                assert_condition(args.template is not None and len(args.template) >= 1,
+                                 localization.str_template_file_is_required_3628ad8c())
+                assert_condition(store_dir is not None, localization.str_store_is_required_a4f19d62())
+                ret = diffscraper_engine.delete(input_data=args.files, input_templates=args.template,
+                                                store_dir=store_dir)
             elif is_decompress:
                 assert_condition(len(args.files) >= 1, localization.str_one_input_file_2b1a06ef())
-                assert_condition(args.template is not None and len(args.template) == 1,
+                assert_condition(args.template is not None and len(args.template) >= 1,
                                  localization.str_template_file_is_required_3628ad8c())
                 assert_condition(args.output_dir is not None and len(args.output_dir) == 1,
                                  localization.str_output_dir_is_required_51ed2ebe())
-                ret = diffscraper_engine.decompress(input_docs=args.files, input_template=args.template[0],
-                                                    output_dir=args.output_dir[0], force=is_force)
+                ret = diffscraper_engine.decompress(input_docs=args.files, input_templates=args.template,
+                                                    output_dir=args.output_dir[0], force=is_force,
+                                                    store_dir=store_dir)
             elif is_print_unified:
                 assert_condition(len(args.files) >= 2, localization.str_two_input_files_9610593a())
                 ret = diffscraper_engine.suggest(command="print-unified", input_docs=args.files,
                                                  input_template=args.template,
                                                  exclude_invariant_segments=False, index=args.index, search=args.search,
-                                                 interactive=args.interactive)
+                                                 interactive=args.interactive, parser_type=parser_type)
             elif is_print_data_segments:
                 assert_condition(len(args.files) >= 2, localization.str_two_input_files_9610593a())
                 ret = diffscraper_engine.suggest(command="print-data-segments", input_docs=args.files,
                                                  input_template=args.template,
                                                  exclude_invariant_segments=True, index=args.index, search=args.search,
-                                                 interactive=args.interactive)
+                                                 interactive=args.interactive, parser_type=parser_type)
             elif is_suggest:
                 assert_condition(len(args.files) >= 2, localization.str_two_input_files_9610593a())
                 ret = diffscraper_engine.suggest(command="suggest", input_docs=args.files, input_template=args.template,
                                                  exclude_invariant_segments=True, index=args.index, search=args.search,
-                                                 interactive=args.interactive)
+                                                 interactive=args.interactive, parser_type=parser_type)
             elif is_scrape:
                 assert_condition(len(args.files) >= 1, localization.str_one_input_file_2b1a06ef())
-                assert_condition(args.template is not None and len(args.template) == 1,
+                assert_condition(args.template is not None and len(args.template) >= 1,
                                  localization.str_template_file_is_required_3628ad8c())
                 assert_condition(args.output_dir is not None and len(args.output_dir) == 1,
                                  localization.str_output_dir_is_required_51ed2ebe())
                 ret = diffscraper_engine.scrape(input_docs=args.files, input_module=args.scrape,
-                                                input_template=args.template, output_dir=args.output_dir[0],
+                                                input_templates=args.template, output_dir=args.output_dir[0],
                                                 force=is_force)
             elif is_print_skeleton:
                 diffscraper_cuihelper.print_skeleton()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Author: Seunghyun Yoo (shyoo1st@cs.ucla.edu)
+"""
+
+import os
+import tempfile
+from unittest import TestCase
+
+from diffscraper.libdiffscraper import archive, template, util
+
+
+class TestArchive(TestCase):
+    def test_roundtrip(self):
+        template_object = template.make_template_object(["<a>", "<b>"], util.compute_hash("root"))
+        data_objects = dict()
+        for name, data_segments in [("1.html", [b"1", b"\xff", b""]), ("2.html", [b"", b"2" * 100, b"3"])]:
+            data_objects[name] = template.make_data_object(data_segments, template_object["mk_root"], None,
+                                                           util.compute_hash(name), binary=True)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "a.dsa")
+            archive_writer = archive.ArchiveWriter(path, template_object)
+            for name, data_object in data_objects.items():
+                if not archive_writer.add(name, template.serialize_object(data_object), 10, data_object["original_hash"]):
+                    self.fail()
+            if archive_writer.add("1.html", b"", 0, b""):
+                self.fail()
+            archive_writer.close()
+            if os.listdir(temp_dir) != ["a.dsa"]:
+                self.fail()
+
+            archive_reader = archive.ArchiveReader(path)
+            if archive_reader.template_object != template_object:
+                self.fail()
+            if [member.name for member in archive_reader.members()] != ["1.html", "2.html"]:
+                self.fail()
+            for name, data_object in data_objects.items():
+                if archive_reader.get(name) != data_object:
+                    self.fail()
+            if archive_reader.members()[1].digest != util.compute_hash("2.html") or "3.html" in archive_reader:
+                self.fail()
+
+    def test_abort(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            archive_writer = archive.ArchiveWriter(os.path.join(temp_dir, "a.dsa"),
+                                                   template.make_template_object(["<a>"], None))
+            archive_writer.abort()
+            if os.listdir(temp_dir) != []:
+                self.fail()
+
+
+class TestColumnarArchive(TestCase):
+    def test_roundtrip(self):
+        template_object = template.make_template_object(["<a>", "<b>"], util.compute_hash("root"))
+        data_objects = dict()
+        for index in range(5):
+            data_segments = [b"title %d" % index, b"\xff" * index, b"year 20%02d" % index]
+            data_objects["%d.html" % index] = template.make_data_object(
+                data_segments, template_object["mk_root"], util.merkle_tree(data_segments).get_root_hash(),
+                util.compute_hash(str(index)), binary=True)
+
+        for codec in ["zlib", "lzma", "raw"]:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                path = os.path.join(temp_dir, "a.dsa")
+                archive_writer = archive.ColumnarArchiveWriter(path, template_object, codec, batch_size=2)
+                for name, data_object in data_objects.items():
+                    if not archive_writer.add(name, data_object, 10):
+                        self.fail()
+                if archive_writer.add("0.html", data_objects["0.html"], 10):
+                    self.fail()
+                archive_writer.close()
+
+                archive_reader = archive.open_archive(path)
+                if not isinstance(archive_reader, archive.ColumnarArchiveReader):
+                    self.fail()
+                if archive_reader.template_object != template_object or len(archive_reader) != 5:
+                    self.fail()
+                for name, data_object in data_objects.items():
+                    if archive_reader.get(name) != data_object:
+                        self.fail()
+                if archive_reader.read_field("3.html", 2) != b"year 2003":
+                    self.fail()
+                if [(name, bytes(value)) for name, value in archive_reader.iter_column(0)] != \
+                        [("%d.html" % index, b"title %d" % index) for index in range(5)]:
+                    self.fail()
+                if archive_reader.read_field("3.html", -1) != b"year 2003":
+                    self.fail()
+                for column_index in [3, -4]:
+                    with self.assertRaises(IndexError):
+                        archive_reader.read_column(0, column_index)
+
+    def test_open_archive(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "a.dsa")
+            archive.ArchiveWriter(path, template.make_template_object(["<a>"], None)).close()
+            if not isinstance(archive.open_archive(path), archive.ArchiveReader):
+                self.fail()
+
+    def test_file_mode(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            umask = os.umask(0o022)
+            try:
+                for archive_writer_class in [archive.ArchiveWriter, archive.ColumnarArchiveWriter]:
+                    path = os.path.join(temp_dir, archive_writer_class.__name__ + ".dsa")
+                    archive_writer_class(path, template.make_template_object(["<a>"], None)).close()
+                    if os.stat(path).st_mode & 0o777 != 0o644:
+                        self.fail()
+            finally:
+                os.umask(umask)
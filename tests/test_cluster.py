@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Author: Seunghyun Yoo (shyoo1st@cs.ucla.edu)
+"""
+
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from diffscraper.libdiffscraper import cluster, cuihelper, engine, fileloader
+
+
+class TestShingles(TestCase):
+    def test_default(self):
+        if len(cluster.shingles(["<a>", "<b>", "<a>", "<b>", "<a>"], 2)) != 2:
+            self.fail()
+        if len(cluster.shingles(["<a>"], 2)) != 1:
+            self.fail()
+
+
+class TestMinHash(TestCase):
+    def test_same_as_pure_python(self):
+        hash_params = cluster.make_hash_params(8)
+        shingle_hashes = cluster.shingles(["<a>", "<b>", "1", "</b>", "</a>"])
+        signature = cluster.minhash(shingle_hashes, hash_params)
+        numpy, cluster.numpy = cluster.numpy, None
+        try:
+            if cluster.minhash(shingle_hashes, hash_params) != signature:
+                self.fail()
+        finally:
+            cluster.numpy = numpy
+
+
+class TestClusterDocuments(TestCase):
+    def test_default(self):
+        navigation = "<nav><ul>" + "".join(["<li><a href=/{0}>{0}</a></li>".format(i) for i in range(20)]) + "</ul></nav>"
+        index = "<dl>" + "".join(["<dt>{0}</dt><dd><span>{0}</span></dd>".format(i) for i in range(20)]) + "</dl>"
+        list_page = "<html><body>" + index + "<ul>{}</ul></body></html>"
+        detail_page = "<html><head><title>{}</title></head><body>" + navigation + \
+                      "<div id=main><h1>{}</h1><p>{}</p></div><footer>c</footer></body></html>"
+        docs = [detail_page.format(i, i * 2, i * 3) for i in range(5)] + \
+               [list_page.format("<li class=item>{}</li>".format(i) * 30) for i in range(2)]
+        clusters = cluster.cluster_documents(docs)
+        if clusters[0] != [0, 1, 2, 3, 4] or sorted(clusters[1]) != [5, 6]:
+            self.fail()
+
+    def test_group_by_bands(self):
+        signatures = [(1, 2, 3, 4), (1, 2, 5, 6), (7, 8, 9, 10), (0, 0, 9, 10), (11, 12, 13, 14)]
+        if cluster.group_by_bands(signatures, 2, 2) != [[0, 1], [2, 3], [4]]:
+            self.fail()
+
+
+class TestGenerateClusters(TestCase):
+    def test_manifest_paths(self):
+        docs = ["<html><body><h1>{0}</h1><p>{0}</p></body></html>".format(i) for i in range(3)]
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            try:
+                os.chdir(temp_dir)
+                os.mkdir("out")
+                for index, doc in enumerate(docs):
+                    with open("{}.html".format(index), "w") as f:
+                        f.write(doc)
+                diffscraper_engine = engine.Engine(cuihelper.CUIHelper(None))
+                success, _ = diffscraper_engine.generate_clusters(["{}.html".format(i) for i in range(3)],
+                                                                   os.path.join("out", "t.tpl"), False)
+                if not success:
+                    self.fail()
+            finally:
+                os.chdir(cwd)
+
+            # Template files are relative to the manifest, so it can be used from any directory
+            manifest_path = os.path.join(temp_dir, "out", "t.tpl.manifest.json")
+            with open(manifest_path) as f:
+                template_files = list(json.load(f)["templates"].values())
+            if not template_files or any([os.path.dirname(template_file) for template_file in template_files]):
+                self.fail()
+            template_library, _ = fileloader.FileLoader(cuihelper.CUIHelper(None)).load_library([manifest_path])
+            if len(template_library) != len(template_files):
+                self.fail()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Author: Seunghyun Yoo (shyoo1st@cs.ucla.edu)
+"""
+
+import contextlib
+import io
+from unittest import TestCase
+
+from diffscraper.crawling import research_google_pubs_html
+from diffscraper.libdiffscraper import cuihelper, selector, template
+
+
+class TestScripts(TestCase):
+    def test_selector_not_found(self):
+        # The template has a title but none of the other fields
+        invariant_segments = ["<html><head><title>", "</title></head><body>", "</body></html>"]
+        document = "<html><head><title>a</title></head><body>b</body></html>"
+        if research_google_pubs_html.diffscraper(invariant_segments, document) is not None:
+            self.fail()
+
+    def test_skeleton(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            cuihelper.CUIHelper(None).print_skeleton(["    item[\"title\"] = ts([selector.starttag(\"title\")], 1)",
+                                                     "    item[\"name\"] = ts([selector.class_(\"name\")], 1)"])
+        namespace = {"template": template, "selector": selector}
+        exec(output.getvalue().split("\n", 1)[1], namespace)
+        invariant_segments = ["<html><head><title>", "</title></head><body>", "</body></html>"]
+        if namespace["diffscraper"](invariant_segments, "<html><head><title>a</title></head><body>b</body></html>") \
+                is not None:
+            self.fail()
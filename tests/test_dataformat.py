@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Author: Seunghyun Yoo (shyoo1st@cs.ucla.edu)
+"""
+
+import os
+import pickle
+from unittest import TestCase
+
+from diffscraper.libdiffscraper import dataformat, template, util
+
+
+class TestDataFormat(TestCase):
+    def test_varint(self):
+        for value in [0, 1, 127, 128, 300, 2 ** 32, 2 ** 63]:
+            buffer = bytearray(b"\x00")
+            dataformat.encode_varint(value, buffer)
+            if dataformat.decode_varint(buffer, 1) != (value, len(buffer)):
+                self.fail()
+
+    def test_template_object(self):
+        template_object = template.make_template_object(["<a>", "é" * 100, ""], util.compute_hash("root"), "text")
+        serialized = template.serialize_object(template_object)
+        if serialized[:4] != dataformat.template_magic:
+            self.fail()
+        if template.deserialize_object(serialized) != template_object:
+            self.fail()
+
+    def test_data_object(self):
+        data_segments = [b"\xff", b"", b"<p>" * 100, b"x"]
+        data_object = template.make_data_object(data_segments, util.compute_hash("t"), None, util.compute_hash("d"),
+                                                binary=True)
+        serialized = template.serialize_object(data_object)
+        if len(serialized) >= sum(map(len, data_segments)):
+            self.fail()
+        deserialized = template.deserialize_object(serialized)
+        if deserialized != data_object:
+            self.fail()
+        # Raw segments are views of the input
+        if not isinstance(deserialized["data_seg"][0], memoryview):
+            self.fail()
+
+        data_object = template.make_data_object(["ü", "1"], None, None, None)
+        if template.deserialize_object(template.serialize_object(data_object)) != data_object:
+            self.fail()
+
+    def test_zdict(self):
+        zdict = b"<span class=author>" * 4
+        data_segments = [b"<span class=author>A</span>", b"", b"<span class=author>B</span>"]
+        data_object = template.make_data_object(data_segments, util.compute_hash("t"), None, None, binary=True)
+        serialized = template.serialize_object(data_object, zdict)
+        if len(serialized) >= len(template.serialize_object(data_object)):
+            self.fail()
+        if template.deserialize_object(serialized, zdict) != data_object:
+            self.fail()
+        if template.deserialize_object(serialized, lambda merkle_root: zdict) != data_object:
+            self.fail()
+        with self.assertRaises(Exception):
+            template.deserialize_object(serialized)
+
+    def test_extras(self):
+        template_object = template.make_template_object(["<a>"], None)
+        template_object["zdict"] = b"<a>"
+        if template.deserialize_object(template.serialize_object(template_object)) != template_object:
+            self.fail()
+
+    def test_legacy(self):
+        data_object = {"data_seg": ["1", "2"], "mk_root_template": None, "mk_root_data": None, "original_hash": None}
+        if template.deserialize_object(pickle.dumps(data_object)) != data_object:
+            self.fail()
+        item = {"title": "a", "year": 2017, "score": 0.5, "tags": ["x"], "open": True, "raw": b"\xff", "note": None}
+        if template.serialize_object(item) != pickle.dumps(item):
+            self.fail()
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            if template.deserialize_object(pickle.dumps(item, protocol)) != item:
+                self.fail()
+
+    def test_legacy_refuses_globals(self):
+        # Loading this pickle would call os.getcwd
+        with self.assertRaises(pickle.UnpicklingError):
+            template.deserialize_object(pickle.dumps(os.getcwd))
+        with self.assertRaises(pickle.UnpicklingError):
+            template.deserialize_object(b"cos\nsystem\n(S'true'\ntR.")
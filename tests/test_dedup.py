@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Author: Seunghyun Yoo (shyoo1st@cs.ucla.edu)
+"""
+
+import os
+import tempfile
+from unittest import TestCase
+
+from diffscraper.libdiffscraper import cuihelper, dataformat, dedup, engine, fileloader, template, util
+
+
+class TestSegmentStore(TestCase):
+    def test_refcount(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store = dedup.SegmentStore(temp_dir)
+            digest_a = store.put(b"a" * 10)
+            if store.put(b"a" * 10) != digest_a:
+                self.fail()
+            digest_b = store.put(b"\xff" * 20)
+            if len(store) != 2 or bytes(store.get(digest_a)) != b"a" * 10:
+                self.fail()
+            if store.referenced_size() != 40 or store.value_size() != 30 or store.stored_size() != 34:
+                self.fail()
+            store.close()
+
+            # The index is saved on close
+            store = dedup.SegmentStore(temp_dir)
+            if store.release(digest_a) != 1 or store.release(digest_b) != 0:
+                self.fail()
+            if store.gc() != 22 or digest_b in store or bytes(store.get(digest_a)) != b"a" * 10:
+                self.fail()
+            store.put(b"c" * 5)
+            store.close()
+
+            store = dedup.SegmentStore(temp_dir)
+            if [bytes(store.get(util.compute_hash(value))) for value in [b"a" * 10, b"c" * 5]] != [b"a" * 10, b"c" * 5]:
+                self.fail()
+
+    def test_release_unknown(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store = dedup.SegmentStore(temp_dir)
+            digest = store.put(b"a" * 10)
+            if store.release(util.compute_hash(b"b")) is not None or store.release(digest) != 0:
+                self.fail()
+            store.close()
+            if dedup.SegmentStore(temp_dir).stored_size() != 0:
+                self.fail()
+
+    def test_file_mode(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            umask = os.umask(0o022)
+            try:
+                store = dedup.SegmentStore(temp_dir)
+                store.release(store.put(b"a" * 10))
+                store.put(b"b" * 10)
+                store.gc()
+                store.close()
+            finally:
+                os.umask(umask)
+            for name in ["segments.dat", "segments.idx"]:
+                if os.stat(os.path.join(temp_dir, name)).st_mode & 0o777 != 0o644:
+                    self.fail()
+
+    def test_data_object(self):
+        long_segment = b"<li>" + b"x" * 100 + b"</li>"
+        data_objects = [template.make_data_object([long_segment, b"a", long_segment], None, None, None, binary=True),
+                        template.make_data_object(["é" * 100, long_segment.decode()], None, None, None)]
+        zdict = b"<li>" * 8
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store = dedup.SegmentStore(temp_dir)
+            for data_object in data_objects:
+                for compress_zdict in [None, zdict]:
+                    serialized = template.serialize_object(data_object, compress_zdict, store)
+                    if len(serialized) >= 100:
+                        self.fail()
+                    if template.deserialize_object(serialized, compress_zdict, store) != data_object:
+                        self.fail()
+                    if len(dataformat.references(serialized, compress_zdict)) != 2:
+                        self.fail()
+                    with self.assertRaises(Exception):
+                        template.deserialize_object(serialized, compress_zdict)
+                    store.release_references(serialized, compress_zdict)
+            # Both long segments were put eight times and released eight times
+            if len(store) != 2 or store.stored_size() != 0:
+                self.fail()
+            store.gc()
+            if len(store) != 0:
+                self.fail()
+
+    def test_aborted_archive(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            template_path = os.path.join(temp_dir, "t.tpl")
+            fileloader.FileLoader(cuihelper.CUIHelper(None)).save_template(
+                template_path, template.make_template_object(["<p>", "</p>"], util.compute_hash("t")))
+            document_path = os.path.join(temp_dir, "1.html")
+            with open(document_path, "w") as f:
+                f.write("<p>" + "x" * 100 + "</p>")
+
+            # The second document does not exist, so the archive is discarded
+            store_dir = os.path.join(temp_dir, "store")
+            diffscraper_engine = engine.Engine(cuihelper.CUIHelper(None))
+            with self.assertRaises(OSError):
+                diffscraper_engine.compress([document_path, os.path.join(temp_dir, "2.html")], [template_path],
+                                            output_archive=os.path.join(temp_dir, "a.dsa"), store_dir=store_dir)
+            if os.path.exists(os.path.join(temp_dir, "a.dsa")):
+                self.fail()
+            store = dedup.SegmentStore(store_dir)
+            if len(store) != 1 or store.referenced_size() != 0:
+                self.fail()
+
+
+class TestDelete(TestCase):
+    def test_versions(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            template_path = os.path.join(temp_dir, "t.tpl")
+            fileloader.FileLoader(cuihelper.CUIHelper(None)).save_template(
+                template_path, template.make_template_object(["<p>", "</p><q>", "</q>"], util.compute_hash("t")))
+            document_path = os.path.join(temp_dir, "1.html")
+            output_dir = os.path.join(temp_dir, "out")
+            store_dir = os.path.join(temp_dir, "store")
+            diffscraper_engine = engine.Engine(cuihelper.CUIHelper(None))
+            for value in ["a", "b"]:
+                with open(document_path, "w") as f:
+                    f.write("<p>" + "x" * 100 + "</p><q>" + value + "</q>")
+                diffscraper_engine.compress([document_path], [template_path], output_dir, versioned=True,
+                                            store_dir=store_dir)
+            versions = [os.path.join(output_dir, "1.html.v{}.data".format(version)) for version in [1, 2]]
+
+            # The first version is the base of the second one
+            success, _ = diffscraper_engine.delete(versions[:1], [template_path], store_dir)
+            if success or not os.path.exists(versions[0]):
+                self.fail()
+            success, _ = diffscraper_engine.delete(versions, [template_path], store_dir)
+            if not success or os.path.exists(versions[0]) or os.path.exists(versions[1]):
+                self.fail()
+            if len(dedup.SegmentStore(store_dir)) != 0:
+                self.fail()
+
+    def test_store_is_required(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            data_path = os.path.join(temp_dir, "1.html.data")
+            with open(data_path, "wb") as f:
+                f.write(b"")
+            success, _ = engine.Engine(cuihelper.CUIHelper(None)).delete([data_path], [], None)
+            if success or not os.path.exists(data_path):
+                self.fail()
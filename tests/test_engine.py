@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Author: Seunghyun Yoo (shyoo1st@cs.ucla.edu)
+"""
+
+import os
+import tempfile
+from unittest import TestCase
+
+from diffscraper.libdiffscraper import cuihelper, engine, fileloader, template, util
+
+
+class TestDecompress(TestCase):
+    def test_file_mode(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            template_path = os.path.join(temp_dir, "t.tpl")
+            fileloader.FileLoader(cuihelper.CUIHelper(None)).save_template(
+                template_path, template.make_template_object(["<p>", "</p>"], util.compute_hash("t")))
+            document_path = os.path.join(temp_dir, "1.html")
+            with open(document_path, "w") as f:
+                f.write("<p>a</p>")
+            diffscraper_engine = engine.Engine(cuihelper.CUIHelper(None))
+            compressed_dir = os.path.join(temp_dir, "compressed")
+            diffscraper_engine.compress([document_path], [template_path], compressed_dir)
+
+            # The document gets the mode of a newly created file rather than the mode of a temporary file
+            output_dir = os.path.join(temp_dir, "decompressed")
+            umask = os.umask(0o022)
+            try:
+                diffscraper_engine.decompress([os.path.join(compressed_dir, "1.html.data")], [template_path], output_dir)
+            finally:
+                os.umask(umask)
+            output_docs = os.listdir(output_dir)
+            if len(output_docs) != 1 or os.stat(os.path.join(output_dir, output_docs[0])).st_mode & 0o777 != 0o644:
+                self.fail()
+            with open(os.path.join(output_dir, output_docs[0])) as f:
+                if f.read() != "<p>a</p>":
+                    self.fail()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Author: Seunghyun Yoo (shyoo1st@cs.ucla.edu)
+"""
+
+from unittest import TestCase
+
+from diffscraper.libdiffscraper import library, template
+
+
+class TestTemplateLibrary(TestCase):
+    def setUp(self):
+        self.template_library = library.TemplateLibrary()
+        for invariant_segments in [["<html><body><ul>", "</ul></body></html>"],
+                                   ["<html><body><ul>", "</ul><div class=detail>", "</div></body></html>"],
+                                   ["<html><head><title>", "</title></head>", "</html>"]]:
+            self.template_library.add(template.make_template_object(invariant_segments, str(invariant_segments)))
+
+    def test_route(self):
+        template_index, data_segments = self.template_library.route("<html><body><ul>1</ul><div class=detail>2"
+                                                                    "</div></body></html>")
+        if template_index != 1 or data_segments != ["", "1", "2", ""]:
+            self.fail()
+        template_index, _ = self.template_library.route("<html><body><ul>1</ul></body></html>")
+        if template_index != 0:
+            self.fail()
+        template_index, _ = self.template_library.route("<html><head><title>2</title></head><body></body></html>")
+        if template_index != 2:
+            self.fail()
+        if self.template_library.route("<p>no template</p>") != (None, None):
+            self.fail()
+        template_index, data_segments = self.template_library.route(b"<html><body><ul>1</ul><div class=detail>2"
+                                                                    b"</div></body></html>")
+        if template_index != 1 or list(map(bytes, data_segments)) != [b"", b"1", b"2", b""]:
+            self.fail()
+
+    def test_candidates(self):
+        # Candidates are found by anchors only, so a candidate may still not match (the anchors are out of order here)
+        document = "</ul></body></html><html><body><ul>1"
+        if list(self.template_library.candidates(document)) != [0] or self.template_library.route(document) != (None, None):
+            self.fail()
+        if list(self.template_library.candidates("<p>no template</p>")) != []:
+            self.fail()
+
+    def test_find_by_root(self):
+        if self.template_library.find_by_root(str(["<html><body><ul>", "</ul></body></html>"])) is not \
+                self.template_library.get(0):
+            self.fail()
@@ -5,8 +5,12 @@
     Author: Seunghyun Yoo (shyoo1st@cs.ucla.edu)
 """
 
+import io
+import unittest
+import unittest.mock
 from unittest import TestCase
 from diffscraper.libdiffscraper.template import *
+from diffscraper.libdiffscraper import template
 from diffscraper.libdiffscraper import util
 
 
@@ -76,18 +80,29 @@ class TestExpandSegment(TestCase):
             self.fail()
 
 
+class TestInternTokens(TestCase):
+    def test_default(self):
+        tokens_of = [["a", "b", "c", "c"], ["b", "c", "a"]]
+        token_ids_of, vocabulary = intern_tokens(tokens_of)
+        if token_ids_of != [[0, 1, 2, 2], [1, 2, 0]]:
+            self.fail()
+        if vocabulary != ["a", "b", "c"]:
+            self.fail()
+
+
 class TestComputeTokensWithLoc(TestCase):
     def test_default(self):
         tokens_of = [["a", "b", "c", "c"], ["b", "c", "a"], ["c", "b", "a"]]
-        tokens_with_loc = compute_tokens_with_loc(tokens_of)
-        hash_of_a = util.compute_hash("a")
-        hash_of_b = util.compute_hash("b")
-        hash_of_c = util.compute_hash("c")
-        if (tokens_with_loc[hash_of_a]) != [[0], [2], [2]]:
+        token_ids_of, vocabulary = intern_tokens(tokens_of)
+        tokens_with_loc = compute_tokens_with_loc(token_ids_of)
+        id_of_a = vocabulary.index("a")
+        id_of_b = vocabulary.index("b")
+        id_of_c = vocabulary.index("c")
+        if (tokens_with_loc[id_of_a]) != [[0], [2], [2]]:
             self.fail()
-        if (tokens_with_loc[hash_of_b]) != [[1], [0], [1]]:
+        if (tokens_with_loc[id_of_b]) != [[1], [0], [1]]:
             self.fail()
-        if (tokens_with_loc[hash_of_c]) != [[2, 3], [1], [0]]:
+        if (tokens_with_loc[id_of_c]) != [[2, 3], [1], [0]]:
             self.fail()
 
 
@@ -107,6 +122,41 @@ class TestFindNextCandidates(TestCase):
             self.fail()
 
 
+class TestFindNextUniqueCandidates(TestCase):
+    def test_same_as_filtered_candidates(self):
+        tokens_of = [["a", "b", "c", "c", "d"], ["b", "c", "a", "d"], ["c", "b", "a", "d", "d"]]
+        tokens_with_loc = compute_tokens_with_loc(tokens_of)
+        last_locs_with = compute_last_locs(tokens_with_loc)
+        for current_line in [(0, 0, 0), (1, 0, 1), (2, 1, 0), (3, 3, 3)]:
+            expected = []
+            for candidate in find_next_candidates(tokens_of, tokens_with_loc, current_line):
+                freq = [util.compute_freq(tokens_with_loc[tokens_of[doc_index][token_index]][doc_index], token_index)
+                        for doc_index, token_index in enumerate(candidate)]
+                if all(map(lambda x: x == 1, freq)):
+                    expected.append(candidate)
+            if find_next_unique_candidates(tokens_of, last_locs_with, current_line) != expected:
+                self.fail()
+
+
+class TestFindLongestChain(TestCase):
+    def test_same_as_enumeration(self):
+        tokens_of = [["a", "x", "b", "c", "d", "e", "c"], ["b", "a", "c", "y", "d", "e"], ["a", "b", "c", "d", "z", "e"]]
+        token_ids_of, _ = intern_tokens(tokens_of)
+        tokens_with_loc = compute_tokens_with_loc(token_ids_of)
+        paths = find_unique_invariants(token_ids_of, tokens_with_loc, (0, 0, 0))
+        expected = max(paths, key=len)
+        candidate_tree = build_candidate_tree(token_ids_of, tokens_with_loc, (0, 0, 0))
+        if find_longest_chain(candidate_tree) != expected:
+            self.fail()
+
+    def test_no_candidate(self):
+        token_ids_of, _ = intern_tokens([["a"], ["b"]])
+        tokens_with_loc = compute_tokens_with_loc(token_ids_of)
+        candidate_tree = build_candidate_tree(token_ids_of, tokens_with_loc, (0, 0))
+        if find_longest_chain(candidate_tree) is not None:
+            self.fail()
+
+
 class TestInvariantMatchingAlgorithm(TestCase):
     def test_1(self):
         docs = ["<a/><b/><c/>", "<b/><c/><a/>", "<c/><b/><a/>"]
@@ -139,6 +189,43 @@ class TestInvariantMatchingAlgorithm(TestCase):
             self.fail()
 
 
+@unittest.skipIf(numpy is None, "NumPy is not installed")
+class TestMatchVectorized(TestCase):
+    def test_same_as_match(self):
+        token_ids_of = [[6, 0, 1, 2, 3, 4, 7, 5, 5, 5, 0, 1, 2],
+                        [8, 1, 2, 0, 3, 4, 9, 5, 5, 5, 0, 1, 2],
+                        [6, 2, 1, 0, 3, 4, 10, 5, 5, 5, 0, 1, 2]]
+        segments, tentative_decision = match(token_ids_of)
+        vectorized_segments, vectorized_decision = match_vectorized(token_ids_of, 11)
+        if vectorized_segments != segments or vectorized_segments != [(4, 5), (7, 12)]:
+            self.fail()
+        if [list(map(TokenType, decisions)) for decisions in vectorized_decision] != tentative_decision:
+            self.fail()
+
+    def test_expand_segment(self):
+        token_ids, doc_offsets, doc_lengths = concatenate_token_ids([[0, 1, 2, 2], [0, 1, 2, 3, 0]])
+        decisions = numpy.array([0, 2, 0, 0, 0, 2, 0, 0, 0], dtype=numpy.int8)
+        expand_segment_vectorized([1, 1], token_ids, decisions, doc_offsets, doc_lengths, True)
+        expand_segment_vectorized([1, 1], token_ids, decisions, doc_offsets, doc_lengths, False)
+        if decisions.tolist() != [1, 2, 1, 0, 1, 2, 1, 0, 0]:
+            self.fail()
+
+    def test_invariant_matching_algorithm(self):
+        docs = ["<g><a><b><c><d><e><data1><img/><f><f><f><f><a><b><c>",
+                "<h><b><c><a><d><e><data2><img/><f><f><f><f><a><b><c>",
+                "<g><c><b><a><d><e><data3><img/><f><f><f><f><a><b><c>"]
+        is_vectorized = template.vectorized
+        try:
+            template.vectorized = False
+            expected, _ = invariant_matching_algorithm(docs)
+            template.vectorized = True
+            invariant_segments_text, _ = invariant_matching_algorithm(docs)
+        finally:
+            template.vectorized = is_vectorized
+        if invariant_segments_text != expected:
+            self.fail()
+
+
 class TestGenerate(TestCase):
     def test_1(self):
         docs = ["<a/><b/><c/>", "<b/><c/><a/>", "<c/><b/><a/>"]
@@ -167,6 +254,121 @@ class TestGenerate(TestCase):
             self.fail()
 
 
+class TestGenerateText(TestCase):
+    def test_json(self):
+        docs = ['{"id": 1, "name": "first item"}', '{"id": 2, "name": "second item"}', '{"id": 3, "name": "third"}']
+        template = generate(docs, parser_type="text")
+        data_segments = list(map(lambda x: extract(template, x), docs))
+        if [data[1:-1] for data in data_segments] != [['1', 'first item'], ['2', 'second item'], ['3', 'third']]:
+            self.fail()
+
+
+class TestMerge(TestCase):
+    def test_split_at_separator(self):
+        template = merge(['<a>', '<b>'], ['<a><b>'])
+        if template != ['<a>', '<b>']:
+            self.fail()
+
+    def test_valid_for_both(self):
+        docs_a = ["<g><a><b><c><d><e><data1><img/><f><f>", "<h><b><c><a><d><e><data2><img/><f><f>"]
+        docs_b = ["<g><c><b><a><d><e><data3><img/><f><f>", "<a><d><e><data4><img/><f><x><f>"]
+        template = merge(generate(docs_a), generate(docs_b))
+        for doc in docs_a + docs_b:
+            if reconstruct(template, extract(template, doc)) != doc:
+                self.fail()
+
+
+class TestGenerateParallel(TestCase):
+    def test_same_as_generate(self):
+        docs = ["<g><a><b><c><d><e><data1><img/><f><f><f><f><a><b><c>",
+                "<h><b><c><a><d><e><data2><img/><f><f><f><f><a><b><c>",
+                "<g><c><b><a><d><e><data3><img/><f><f><f><f><a><b><c>",
+                "<g><a><d><e><data4><img/><f><f><f><f><a><b><c>"]
+        template = generate_parallel(docs, 2)
+        for doc in docs:
+            if reconstruct(template, extract(template, doc)) != doc:
+                self.fail()
+        if generate_parallel(docs, 1) != generate(docs):
+            self.fail()
+
+
+class TestGenerateSampled(TestCase):
+    def test_deduplicate(self):
+        if deduplicate(["<a/>", "<b/>", "<a/>"]) != ["<a/>", "<b/>"]:
+            self.fail()
+
+    def test_choose_sample(self):
+        docs = ["<a>1</a>", "<a>2</a>", "<a>3</a>", "<b>4</b>"]
+        if choose_sample(docs, 2) != [0, 3]:
+            self.fail()
+
+    def test_every_document_extracts(self):
+        docs = ["<g><a><b><c><d><e><data1><img/><f><f><f><f><a><b><c>",
+                "<g><a><b><c><d><e><data2><img/><f><f><f><f><a><b><c>",
+                "<h><b><c><a><d><e><data3><img/><f><f><f><f><a><b><c>",
+                "<g><c><b><a><d><e><data4><img/><f><f><f><f><a><b><c>",
+                "<g><c><b><a><d><e><data4><img/><f><f><f><f><a><b><c>"]
+        template = generate_sampled(docs, 2)
+        for doc in docs:
+            if extract(template, doc) is None:
+                self.fail()
+
+    def test_incremental(self):
+        docs = ["<g><a><b><c><d><e><data1><img/><f><f><f><f><a><b><c>",
+                "<g><a><b><c><d><e><data2><img/><f><f><f><f><a><b><c>",
+                "<h><b><c><a><d><e><data3><img/><f><f><f><f><a><b><c>",
+                "<g><c><b><a><d><e><data4><img/><f><f><f><f><a><b><c>"]
+        # After the initial sample, each round infers only the documents added to the sample
+        with unittest.mock.patch("diffscraper.libdiffscraper.template.generate_parallel",
+                                 wraps=generate_parallel) as generate_mock:
+            text = generate_sampled(docs, 2)
+        if generate_mock.call_count < 2 or any([len(call[0][0]) > 2 for call in generate_mock.call_args_list]):
+            self.fail()
+        for doc in docs:
+            if extract(text, doc) is None:
+                self.fail()
+
+
+class TestUpdate(TestCase):
+    def test_find_anchors(self):
+        anchors = find_anchors(["<a>", "<b>", "<c>", "<d>"], "<b><c>1<b><a><d>")
+        if anchors != [(0, 10), (3, 13)]:
+            self.fail()
+        # An occurrence before the last anchor does not make a segment ambiguous
+        if find_anchors(["<a>", "<b>"], "<b><a>1<b>") != [(0, 3), (1, 7)]:
+            self.fail()
+
+    def test_unchanged(self):
+        template = generate(["<a><b>1</b><c>2</c></a>", "<a><b>3</b><c>4</c></a>"])
+        if update(template, ["<a><b>5</b><c>6</c></a>"]) != template:
+            self.fail()
+
+    def test_valid_for_both(self):
+        old_docs = ["<g><a><b><c><d><e><data1><img/><f><f>", "<h><a><b><c><d><e><data2><img/><f><f>"]
+        new_docs = ["<g><a><b><x><d><e><data3><img/><f><f>", "<a><d><e><data4><img/><f><x><f>"]
+        template = update(generate(old_docs), new_docs)
+        if template != ["<a>", "<d><e>", "<img/><f>", "<f>"]:
+            self.fail()
+        for doc in old_docs + new_docs:
+            if reconstruct(template, extract(template, doc)) != doc:
+                self.fail()
+
+    def test_parallel(self):
+        old_docs = ["<g><a><b><c><d><e><data1><img/><f><f>", "<h><a><b><c><d><e><data2><img/><f><f>"]
+        new_docs = ["<g><a><b><x><d><e><data3><img/><f><f>", "<a><d><e><data4><img/><f><x><f>",
+                    "<h><a><b><c><d><e><data5><img/><f><f>"]
+        template = update_parallel(generate(old_docs), new_docs, 2)
+        for doc in old_docs + new_docs:
+            if reconstruct(template, extract(template, doc)) != doc:
+                self.fail()
+
+    def test_align_segment_not_found(self):
+        # A piece that cannot be placed after the previous one is dropped instead of resetting the offset
+        with unittest.mock.patch.object(template, "generate", return_value=["<b>", "<a>"]):
+            if template.align_segment("<a><b>", "<a><b>") != (["<b>"], 6):
+                self.fail()
+
+
 class TestExtractAndReconstruct(TestCase):
     def test_1(self):
         docs = ["<a/><b/><c/>", "<b/><c/><a/>", "<c/><b/><a/>"]
@@ -209,3 +411,137 @@ class TestExtractAndReconstruct(TestCase):
         reconstructed_docs = list(map(lambda x: reconstruct(template, x), data_segments))
         if reconstructed_docs != docs:
             self.fail()
+
+
+class TestCompiledTemplate(TestCase):
+    def test_extract(self):
+        compiled_template = compile_template(["<a>", "<b>"])
+        if compiled_template.extract_offsets("1<a>2<b>") != [0, 1, 4, 5, 8, 8]:
+            self.fail()
+        if compiled_template.extract("1<a>2<b>") != extract(["<a>", "<b>"], "1<a>2<b>"):
+            self.fail()
+        if compiled_template.extract("<b><a>") is not None:
+            self.fail()
+
+    def test_extract_segments(self):
+        doc = "1<a>2<b>3<c>4"
+        if extract_segments(["<a>", "<b>", "<c>"], doc, [2, 0, -1]) != {0: "1", 2: "3", -1: "4"}:
+            self.fail()
+        if extract_segments(["<a>", "<b>", "<c>"], "1<a>2<b>3", [1]) != {1: "2"}:
+            self.fail()
+        if extract_segments(["<a>", "<b>", "<c>"], "1<a>2<b>3", [3]) is not None:
+            self.fail()
+        if bytes(compile_template(["<a>", "<b>", "<c>"]).extract_segments(doc.encode("utf-8"), [1])[1]) != b"2":
+            self.fail()
+
+    def test_select(self):
+        compiled_template = compile_template(["<html><title>", "</title><p class=x>", "</p></html>"])
+        if compile_template(["<html><title>", "</title><p class=x>", "</p></html>"]) is not compiled_template:
+            self.fail()
+        if compiled_template.select([selector.starttag("title")], 1) != 1:
+            self.fail()
+        if compiled_template.select([selector.class_("x")], 1) != 2:
+            self.fail()
+        if compiled_template.select([selector.starttag("title")], 0) != 0:
+            self.fail()
+        if compiled_template.select([lambda e: e.type == "start" and e.tag == "p"], 1) != 2:
+            self.fail()
+
+
+class TestExtractBytes(TestCase):
+    def test_roundtrip(self):
+        invariant_segments = ["<p>", "é</p><b>"]
+        doc = b"\xff<p>\xc3\xa9\xc3\xa9</p><b>\xfe\x00"
+        data_segments = extract(encode_segments(invariant_segments), doc)
+        if [bytes(data_segment) for data_segment in data_segments] != [b"\xff", b"\xc3\xa9", b"\xfe\x00"]:
+            self.fail()
+        if not all([isinstance(data_segment, memoryview) for data_segment in data_segments]):
+            self.fail()
+        if reconstruct(encode_segments(invariant_segments), data_segments) != doc:
+            self.fail()
+
+    def test_compiled_template(self):
+        compiled_template = compile_template(["<a>", "<b>"])
+        if [bytes(x) for x in compiled_template.extract(b"1<a>2<b>")] != [b"1", b"2", b""]:
+            self.fail()
+        if compiled_template.extract(b"<b><a>") is not None:
+            self.fail()
+
+    def test_write_reconstructed(self):
+        hash_object = util.new_hash()
+        sink = io.BytesIO()
+        if write_reconstructed(sink, ["<a>", "<b>"], ["é", "", "ü"], hash_object) != 10:
+            self.fail()
+        if sink.getvalue() != "é<a><b>ü".encode("utf-8") or hash_object.digest() != util.compute_hash("é<a><b>ü"):
+            self.fail()
+        sink = io.BytesIO()
+        write_reconstructed(sink, [b"<a>"], [memoryview(b"\xff"), b"\xfe"])
+        if sink.getvalue() != b"\xff<a>\xfe":
+            self.fail()
+        if write_reconstructed(io.BytesIO(), ["<a>"], ["1"]) is not None:
+            self.fail()
+
+    def test_hash(self):
+        text_segments = extract(["<a>"], "é<a>ü")
+        bytes_segments = extract(encode_segments(["<a>"]), "é<a>ü".encode("utf-8"))
+        if util.merkle_tree(text_segments).get_root_hash() != util.merkle_tree(bytes_segments).get_root_hash():
+            self.fail()
+        if util.compute_hash("é<a>ü") != util.compute_hash("é<a>ü".encode("utf-8")):
+            self.fail()
+
+
+class TestZdict(TestCase):
+    def test_make_zdict(self):
+        documents = ["<p>{}</p><div>\n<b>Authors</b>\n{}</div>".format(index, ["Alice Kim", "Bob Lee"][index % 2])
+                     for index in range(10)]
+        zdict = make_zdict(["<p>", "</p><div>\n<b>Authors</b>\n", "</div>"], documents, size=64)
+        if len(zdict) > 64 or not zdict.startswith(b"<b>Authors</b>\n</div>"[-16:]):
+            self.fail()
+        if b"Alice Kim" not in zdict or b"Bob Lee" not in zdict or b"9" in zdict:
+            self.fail()
+
+
+class TestReadRange(TestCase):
+    def test_read_range(self):
+        invariant_segments = ["<a>", "é", "<b></b>"]
+        template_object = make_template_object(invariant_segments, None)
+        for data_segments in [["", "1", "ü2", ""], [b"\xff", b"", b"34", b"\xfe"]]:
+            data_object = make_data_object(data_segments)
+            legacy_data_object = {"data_seg": data_segments}
+            doc = reconstruct(encode_segments(invariant_segments), [x.encode("utf-8") if isinstance(x, str) else x
+                                                                    for x in data_segments])
+            for start in range(-1, len(doc) + 2):
+                for end in range(start, len(doc) + 2):
+                    if read_range(template_object, data_object, start, end) != doc[max(start, 0):max(end, 0)]:
+                        self.fail()
+                    if read_range({"inv_seg": invariant_segments}, legacy_data_object, start, end) != \
+                            doc[max(start, 0):max(end, 0)]:
+                        self.fail()
+            for index in range(-len(data_segments), len(data_segments)):
+                data_segment, (start, end) = read_data_segment(template_object, data_object, index)
+                if doc[start:end] != data_segment:
+                    self.fail()
+
+
+class TestDelta(TestCase):
+    def test_apply_delta(self):
+        def make(data_segments):
+            return template.make_data_object(data_segments, util.compute_hash("t"),
+                                             util.merkle_tree(data_segments).get_root_hash(),
+                                             util.compute_hash(b"".join(data_segments)), binary=True)
+
+        base_data_object = make([b"a", b"b", b"c"])
+        data_object = make([b"a", b"B", b"c"])
+        changed_indices = util.diff_merkle_leaves(util.merkle_tree(base_data_object["data_seg"]),
+                                                  util.merkle_tree(data_object["data_seg"]))
+        delta_object = template.make_delta_object(data_object, changed_indices, "x.v1.data", base_data_object, 1)
+        if delta_object["data_seg"] != [b"B"] or template.delta_base_name(delta_object) != "x.v1.data":
+            self.fail()
+        if template.delta_chain_length(delta_object) != 1 or template.delta_chain_length(base_data_object) != 0:
+            self.fail()
+
+        delta_object = template.deserialize_object(template.serialize_object(delta_object))
+        if not template.is_delta_object(delta_object) or template.apply_delta(delta_object, base_data_object) != data_object:
+            self.fail()
+        with self.assertRaises(Exception):
+            template.apply_delta(delta_object, data_object)
@@ -5,9 +5,12 @@
     Author: Seunghyun Yoo (shyoo1st@cs.ucla.edu)
 """
 
+import os
+import tempfile
+import unittest.mock
 from unittest import TestCase
 
-from diffscraper.libdiffscraper import tokenizer
+from diffscraper.libdiffscraper import tokenizer, tokencache
 
 
 class TestTokenizer(TestCase):
@@ -15,3 +18,150 @@ class TestTokenizer(TestCase):
         tokens = tokenizer.Tokenizer.tokenize("html", "<html><body></body></html>")
         if tokens != ['<html>', '<body>', '</body>', '</html>']:
             self.fail()
+
+    def test_spans(self):
+        raw_string = "<html>\n<body>hello\nworld</body>\n</html>"
+        starts, ends = tokenizer.Tokenizer.tokenize_spans("html", raw_string)
+        tokens = [raw_string[start:end] for start, end in zip(starts, ends)]
+        if tokens != ['<html>', '\n', '<body>', 'hello\nworld', '</body>', '\n', '</html>']:
+            self.fail()
+        if tokenizer.Tokenizer.tokenize("html", raw_string) != tokens:
+            self.fail()
+
+
+class TestLineOffsets(TestCase):
+    def test_default(self):
+        if list(tokenizer.Tokenizer.line_offsets("")) != [0]:
+            self.fail()
+        if list(tokenizer.Tokenizer.line_offsets("ab\ncd\n\ne")) != [0, 3, 6, 7]:
+            self.fail()
+
+
+class TestHTMLFastLexer(TestCase):
+    def test_same_boundaries(self):
+        raw_strings = ["<html><body></body></html>",
+                       "text only",
+                       "a < b && c > d",
+                       "<!DOCTYPE html>\n<html lang=\"en\"><!-- comment --><p class=x>hi<br/></p></html>",
+                       "<script type=\"text/javascript\">if (a < b) { x = '</div>'; }</script><p>after</p>",
+                       "<style>p > a { color: red }</style ><p>x</p>",
+                       "<p>unclosed <b",
+                       "<div>&amp; &nbsp",
+                       "<script>never closed",
+                       "</>x</ div>y<?php echo 1 ?><![CDATA[ x ]]>z",
+                       "<a href='x'/><img src=a.png /><p\n  id=\"a\"\n>line\nbreaks</p\n>",
+                       "trailing <"]
+        for raw_string in raw_strings:
+            if tokenizer.Tokenizer.tokenize_spans("html-fast", raw_string) != \
+                    tokenizer.Tokenizer.tokenize_spans("html", raw_string):
+                self.fail(raw_string)
+
+    def test_tokens(self):
+        parser = tokenizer.Tokenizer.create_parser("html-fast")
+        parser.feed("<p>\nhi</p>")
+        parser.close()
+        if [token[1:] for token in parser.tokens] != [(1, 0), (1, 3), (2, 2), (2, 6)]:
+            self.fail()
+
+
+class TestTextParser(TestCase):
+    def test_default(self):
+        tokens = tokenizer.Tokenizer.tokenize("text", "{\"id\": 12}\nok.")
+        if tokens != ['{', '"', 'id', '"', ':', ' ', '12', '}', '\n', 'ok', '.']:
+            self.fail()
+
+    def test_empty(self):
+        if tokenizer.Tokenizer.tokenize("text", "") != []:
+            self.fail()
+
+    def test_tokens(self):
+        parser = tokenizer.Tokenizer.create_parser("text")
+        parser.clear(is_collecting_meta=False)
+        parser.feed("a\nb")
+        parser.close()
+        if parser.tokens != [('<word>', 1, 0), ('<newline>', 1, 1), ('<word>', 2, 0), ('<doc_end>', 2, 1)]:
+            self.fail()
+
+
+class TestAnalyze(TestCase):
+    def test_default(self):
+        spans, features = tokenizer.Tokenizer.analyze("html", "<p class=\"a\">hi</p><br/>")
+        if spans != tokenizer.Tokenizer.tokenize_spans("html", "<p class=\"a\">hi</p><br/>"):
+            self.fail()
+        if [feature.type for feature in features] != ["start", "data", "end", "startend"]:
+            self.fail()
+        if features[0].tag != "p" or features[0].attrs != (("class", "a"),) or features[1].data != "hi":
+            self.fail()
+
+    def test_dict_style_access(self):
+        features = tokenizer.Tokenizer.feature("html", "<p class=\"a\">hi</p>")
+        if "attrs" not in features[0] or "attrs" in features[1] or features[0]["tag"] != "p":
+            self.fail()
+
+
+class TestTokenCache(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        tokenizer.Tokenizer.set_cache(None)
+        self.temp_dir.cleanup()
+
+    def test_roundtrip(self):
+        cache = tokencache.TokenCache(self.temp_dir.name, min_length=0)
+        raw_string = '<div class="a b" id=x><p>hello</p>\n<br/>world</div>'
+        spans, features = tokenizer.Tokenizer.analyze("html", raw_string)
+        cache.store("html", raw_string, spans, features)
+        cached_spans, cached_features = cache.load("html", raw_string, with_features=True)
+        if list(cached_spans[0]) != list(spans[0]) or list(cached_spans[1]) != list(spans[1]):
+            self.fail()
+        if cached_features != features:
+            self.fail()
+        if cache.load("text", raw_string) is not None:
+            self.fail()
+        # The spans of a hit and a miss have the same type
+        if type(cached_spans[0]) is not type(spans[0]) or cached_spans[0].format != spans[0].format:
+            self.fail()
+
+    def test_read_only(self):
+        cache = tokencache.TokenCache(self.temp_dir.name, min_length=0)
+        raw_string = "<p>hello</p>"
+        cache.store("html", raw_string, tokenizer.Tokenizer.tokenize_spans("html", raw_string))
+        # Refreshing the modification time fails (as on a read-only cache), but the entry is still a hit
+        with unittest.mock.patch("os.utime", side_effect=PermissionError):
+            if cache.load("html", raw_string) is None:
+                self.fail()
+
+    def test_store_failure(self):
+        cache = tokencache.TokenCache(self.temp_dir.name, min_length=0)
+        raw_string = "<p>hello</p>"
+        spans = tokenizer.Tokenizer.tokenize_spans("html", raw_string)
+        # A cache that cannot be written to is skipped silently
+        with unittest.mock.patch("tempfile.mkstemp", side_effect=PermissionError):
+            cache.store("html", raw_string, spans)
+        if cache.load("html", raw_string) is not None:
+            self.fail()
+        with unittest.mock.patch("os.replace", side_effect=OSError):
+            cache.store("html", raw_string, spans)
+        if cache.entries() != []:
+            self.fail()
+
+    def test_tokenizer(self):
+        tokenizer.Tokenizer.set_cache(tokencache.TokenCache(self.temp_dir.name, min_length=0))
+        raw_string = "<html><body>hello</body></html>"
+        tokens = tokenizer.Tokenizer.tokenize("html", raw_string)
+        if tokenizer.Tokenizer.tokenize("html", raw_string) != tokens:
+            self.fail()
+        if tokenizer.Tokenizer.analyze("html", raw_string)[1] != tokenizer.Tokenizer.analyze("html", raw_string)[1]:
+            self.fail()
+
+    def test_eviction(self):
+        cache = tokencache.TokenCache(self.temp_dir.name, size_limit=400, min_length=0)
+        raw_strings = ["<p>{}</p>".format("x" * i) * 10 for i in range(5)]
+        for index, raw_string in enumerate(raw_strings):
+            cache.store("html", raw_string, tokenizer.Tokenizer.tokenize_spans("html", raw_string))
+            os.utime(cache.path_of("html", raw_string), (index, index))
+        if sum([size for _, size, _ in cache.entries()]) > 400:
+            self.fail()
+        if cache.load("html", raw_strings[0]) is not None or cache.load("html", raw_strings[-1]) is None:
+            self.fail()
@@ -5,6 +5,8 @@
     Author: Seunghyun Yoo (shyoo1st@cs.ucla.edu)
 """
 
+import os
+import tempfile
 from unittest import TestCase
 
 from diffscraper.libdiffscraper import util
@@ -122,4 +124,22 @@ class TestMerkleTree(TestCase):
         if tree_1.get_root_hash() != tree_2.get_root_hash():
             self.fail()
 
+    def test_diff_leaves(self):
+        tree_1 = util.merkle_tree([1, 2, 3, 4, 5])
+        tree_2 = util.merkle_tree([1, 2.5, 3, 4, 5.5])
+        if util.diff_merkle_leaves(tree_1, tree_2) != [1, 4] or util.diff_merkle_leaves(tree_1, tree_1) != []:
+            self.fail()
+
 
+class TestMkstempNextTo(TestCase):
+    def test_mode(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "a.txt")
+            umask = os.umask(0o022)
+            try:
+                fd, temp_path = util.mkstemp_next_to(path)
+            finally:
+                os.umask(umask)
+            os.close(fd)
+            if os.path.dirname(temp_path) != temp_dir or os.stat(temp_path).st_mode & 0o777 != 0o644:
+                self.fail()